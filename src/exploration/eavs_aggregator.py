@@ -0,0 +1,240 @@
+'''
+Created on Oct 22, 2020
+
+@author: paepcke
+
+Rolls up the county/jurisdiction level Election
+Administration and Voting Survey (EAVS) panel (see
+eavs_panel.py) to State, county, or jurisdiction level.
+Used by both ElectionSurveyCleaner and MailVotingTransformer,
+so that all EAVS derived numbers come from the same code.
+
+The survey codes for 'Not Applicable' (-888888), and
+'Data Not Available' (-999999), as well as their
+spelled out variants ('-888888: Not Applicable'), and
+missing values all count as zero. They are removed in
+one pass over the requested measures, and all measures are
+then summed in a single grouped reduction.
+
+Results are memoized by (year, level, measures):
+
+    agg = EAVSAggregator(panel=panel_df)
+    agg.rollup(2016, ['TotalVote', 'TotalByMail'])
+    agg.rollup(2016, ['TotalVote'], level='county')
+
+    # Shared instance that reads from a panel directory,
+    # loading only the needed years, States, and columns:
+    agg = EAVSAggregator.for_panel_dir('/tmp/eavs_panel')
+'''
+import os
+
+import numpy as np
+import pandas as pd
+
+from exploration.eavs_panel import PANEL_INDEX, read_panel
+
+
+class EAVSAggregator(object):
+    '''
+    Single-pass cleaning and grouped roll-up of EAVS
+    measures.
+    '''
+
+    # Grouping keys for each level of aggregation:
+    LEVELS = {'state'        : ['State', 'Election'],
+              'county'       : ['State', 'CountyFIPS', 'Election'],
+              'jurisdiction' : ['State', 'Jurisdiction', 'Election']
+              }
+
+    # Guam, Virgin Islands, American Samoa, Puerto Rico:
+    TERRITORIES = ['GU', 'VI', 'AS', 'PR']
+
+    # Aggregators that read from panel directories,
+    # keyed by (panel_dir, states):
+    shared_aggregators = {}
+
+    #------------------------------------
+    # Constructor
+    #-------------------
+
+    def __init__(self, panel=None, panel_dir=None, states=None, excluded_states=None):
+        '''
+        Either panel, an in-memory long-format df, or
+        panel_dir, the root of a panel written by
+        eavs_panel.write_panel(), must be provided. An
+        in-memory panel may have FIPSDetailed, State,
+        Jurisdiction, and Election either in its index
+        or as columns; the Jurisdiction and FIPSDetailed
+        are only needed for some levels.
+
+        @param panel: long-format EAVS data
+        @type panel: {None | pd.DataFrame}
+        @param panel_dir: root of a Parquet panel
+        @type panel_dir: {None | str}
+        @param states: if provided, 2-letter abbreviations
+            of the only States to consider
+        @type states: {None | [str]}
+        @param excluded_states: 2-letter abbreviations of
+            States or territories to leave out. 
+            Default: TERRITORIES
+        @type excluded_states: {None | [str]}
+        '''
+        if (panel is None) == (panel_dir is None):
+            raise ValueError("Provide exactly one of panel or panel_dir")
+
+        if panel is not None:
+            index_cols = [name for name in panel.index.names if name in PANEL_INDEX]
+            if index_cols:
+                panel = panel.reset_index(index_cols)
+            if states is not None:
+                panel = panel[panel['State'].isin(states)]
+        self.panel     = panel
+        self.panel_dir = panel_dir
+        self.states    = states
+        self.excluded_states = self.TERRITORIES if excluded_states is None else excluded_states
+
+        # Memoized rollups:
+        self.rollups = {}
+
+    #------------------------------------
+    # for_panel_dir
+    #-------------------
+
+    @classmethod
+    def for_panel_dir(cls, panel_dir, states=None):
+        '''
+        Return an aggregator for the given panel directory
+        and States that is shared within the process, so that
+        rollups computed by one consumer are reused by others.
+
+        @param panel_dir: root of a Parquet panel
+        @type panel_dir: str
+        @param states: 2-letter State abbreviations to consider.
+            Default: all
+        @type states: {None | [str]}
+        @return: shared aggregator
+        @rtype: EAVSAggregator
+        '''
+        key = (os.path.abspath(panel_dir),
+               None if states is None else tuple(sorted(states)))
+        try:
+            return cls.shared_aggregators[key]
+        except KeyError:
+            aggregator = cls(panel_dir=panel_dir, states=states)
+            cls.shared_aggregators[key] = aggregator
+            return aggregator
+
+    #------------------------------------
+    # rollup
+    #-------------------
+
+    def rollup(self, year, measures, level='state'):
+        '''
+        Sum the given measures for one election year to
+        the given level. Returns a df indexed by the
+        grouping keys of the level (see LEVELS), with one
+        float column per measure. The caller may modify
+        the result; the memoized copy is not affected.
+
+        @param year: election year
+        @type year: int
+        @param measures: names of panel columns to sum
+        @type measures: [str]
+        @param level: one of 'state', 'county', 'jurisdiction'
+        @type level: str
+        @return: aggregated measures
+        @rtype: pd.DataFrame
+        '''
+        try:
+            group_keys = self.LEVELS[level]
+        except KeyError:
+            raise ValueError(f"Level must be one of {list(self.LEVELS.keys())}, not '{level}'")
+
+        memo_key = (year, level, tuple(measures))
+        try:
+            return self.rollups[memo_key].copy()
+        except KeyError:
+            pass
+
+        excerpt = self.panel_excerpt(year, measures, group_keys)
+        values  = self.clean_measures(excerpt, measures)
+
+        # Group on categoricals, so grouping and the result
+        # index work on integer codes. Election is the same
+        # for all rows; add it to the index afterwards:
+        key_arrays = [pd.Categorical(excerpt[key_col])
+                      for key_col in group_keys if key_col != 'Election']
+        # One grouped reduction over all measures:
+        rolled = pd.DataFrame(values, columns=measures).groupby(key_arrays, 
+                                                                observed=True, 
+                                                                sort=True).sum()
+        index_arrays = [rolled.index.get_level_values(i) for i in range(len(key_arrays))]
+        rolled.index = pd.MultiIndex.from_arrays(index_arrays + [np.full(len(rolled), year)],
+                                                 names=group_keys)
+
+        self.rollups[memo_key] = rolled
+        return rolled.copy()
+
+    #------------------------------------
+    # panel_excerpt
+    #-------------------
+
+    def panel_excerpt(self, year, measures, group_keys):
+        '''
+        Return the rows of one year, minus excluded States,
+        with just the group key and measure columns.
+
+        @param year: election year
+        @type year: int
+        @param measures: measure columns needed
+        @type measures: [str]
+        @param group_keys: grouping columns needed
+        @type group_keys: [str]
+        @return: excerpt with group keys and measures as columns
+        @rtype: pd.DataFrame
+        '''
+        key_cols = [key_col for key_col in group_keys if key_col != 'Election']
+        if self.panel is not None:
+            excerpt = self.panel
+            if 'Election' in excerpt.columns:
+                excerpt = excerpt[excerpt['Election'] == year]
+            excerpt = excerpt[key_cols + list(measures)]
+        else:
+            excerpt = read_panel(self.panel_dir,
+                                 years=[year],
+                                 states=self.states,
+                                 columns=[col for col in key_cols + list(measures)
+                                          if col not in PANEL_INDEX]
+                                 ).reset_index()[key_cols + list(measures)]
+
+        states = excerpt['State'].astype(str)
+        return excerpt[~states.isin(self.excluded_states).to_numpy()]
+
+    #------------------------------------
+    # clean_measures
+    #-------------------
+
+    def clean_measures(self, df, measures):
+        '''
+        Return the measure columns of df as one float
+        array, with the not-applicable/not-available codes,
+        text, NaN, and any other negative values all set
+        to zero.
+
+        @param df: df holding the measure columns
+        @type df: pd.DataFrame
+        @param measures: names of measure columns
+        @type measures: [str]
+        @return: cleaned values, one column per measure
+        @rtype: np.ndarray
+        '''
+        values = np.empty((len(df), len(measures)), dtype=float)
+        for i, measure in enumerate(measures):
+            col = df[measure]
+            if not pd.api.types.is_numeric_dtype(col):
+                # Strings like '-888888: Not Applicable' become NaN:
+                col = pd.to_numeric(col, errors='coerce')
+            values[:, i] = col.to_numpy(dtype=float, na_value=np.nan)
+        # NaN compares False, so this zeroes NaN and codes:
+        values[~(values >= 0)] = 0
+        return values
@@ -5,6 +5,7 @@ Created on Sep 30, 2020
 @author: paepcke
 '''
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 import os
 from pathlib import Path
 import sys
@@ -18,6 +19,9 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from spreadsheet_colname_mappings import spreadsheet_maps
+from eavs_aggregator import EAVSAggregator
+from eavs_panel import write_panel, to_panel_frame
+from state_attributes import StateAttributes
 from utils.logging_service import LoggingService
 
 def to_int_if_possible(one_row_series):
@@ -46,6 +50,27 @@ def catch_non_int(value):
             # Probably a string, like a State name:
             return value
 
+def clean_one_survey(year):
+    '''
+    Worker process entry point for cleaning the survey
+    of a single year. Builds its own ElectionSurveyCleaner,
+    which only loads the Census geocodes of the given year.
+    Returns a triple: the year, the compacted survey df, and
+    the percentages df (empty for years without percentage
+    computations).
+    
+    Must be module level so that it can be pickled
+    to the processes of a ProcessPoolExecutor.
+    
+    @param year: election year whose survey to clean
+    @type year: int
+    @return: year, cleaned survey, percentages
+    @rtype: (int, pd.DataFrame, pd.DataFrame)
+    '''
+    xformer = ElectionSurveyCleaner(years=[year])
+    df = xformer.compact_survey(xformer.transform(year))
+    return year, df, xformer.percentages
+
 
 class ElectionSurveyCleaner(BaseEstimator, TransformerMixin):
     '''
@@ -66,9 +91,15 @@ class ElectionSurveyCleaner(BaseEstimator, TransformerMixin):
     # Constructor 
     #-------------------
 
-    def __init__(self):
+    def __init__(self, years=None):
         '''
         Constructor
+        
+        @param years: election years whose Census geocodes
+            to load right away. Geocodes of other years
+            are loaded when their survey is first cleaned.
+            Default: [2018]
+        @type years: [int]
         '''
         self.log = LoggingService()
         
@@ -85,8 +116,9 @@ class ElectionSurveyCleaner(BaseEstimator, TransformerMixin):
         state_fips_file = os.path.join(os.path.dirname(__file__),
                                        '../../data/Exploration/fips_states_only.xlsx')
         
-        # Import the Census FIPS codes for all years:
-        self.load_census_geocodes()
+        # Import the Census FIPS codes for the requested years:
+        self.geocodes = {}
+        self.load_census_geocodes([2018] if years is None else years)
         
         # Initialize a simple table 
         #     StateFull,  StateFIPS,   State
@@ -113,21 +145,25 @@ class ElectionSurveyCleaner(BaseEstimator, TransformerMixin):
     # load_census_geocodes
     #-------------------
     
-    def load_census_geocodes(self):
+    def load_census_geocodes(self, years):
         '''
         Loads and if necessary corrects the
         Census bureau FIPS files in force in
-        2018, 2016, 2014. Initializes
+        the given years (2018, 2016, 2014). Adds
+        to
         
            self.geocodes{year}
+        
+        Years whose geocodes are already loaded
+        are skipped.
+        
+        @param years: years whose geocodes to load
+        @type years: [int]
         '''
 
-        self.geocodes = {}
-        
-        #*********
-        #for year in [2014, 2016, 2018]:
-        for year in [2018]:
-        #*********
+        for year in years:
+            if year in self.geocodes:
+                continue
             # Get reference to the Census geo codes:
             geocode_file = os.path.join(os.path.dirname(__file__),
                                         f'../../data/Exploration/all-geocodes-v{year}.xlsx')
@@ -164,6 +200,19 @@ class ElectionSurveyCleaner(BaseEstimator, TransformerMixin):
             self.geocodes[year] = self.geocodes[year].drop(self.geocodes[year][self.geocodes[year]['StateFIPS'] == '72'].index, 
                                                axis=0)
 
+            if year == 2018:
+                self.fix_census_geocodes_2018()
+
+    #------------------------------------
+    # fix_census_geocodes_2018
+    #-------------------
+
+    def fix_census_geocodes_2018(self):
+        '''
+        Adds entries that are missing from the
+        2018 Census geocodes, but are referenced
+        by the 2018 survey.
+        '''
         # Fixes for 2018:
         # ---------------
         # Fix missing entry for one Wisconsin county: 
@@ -172,7 +221,7 @@ class ElectionSurveyCleaner(BaseEstimator, TransformerMixin):
                                   'County'       : '101',
                                   'Subdivision'  : '89550',
                                   'Jurisdiction' : 'Racine County'
-                                  }, index=[len(self.geocodes[year])])
+                                  }, index=[len(self.geocodes[2018])])
         self.geocodes[2018] = pd.concat([self.geocodes[2018], new_entry], axis=0)
            
         # Fix missing Maine abroad entry:
@@ -180,7 +229,7 @@ class ElectionSurveyCleaner(BaseEstimator, TransformerMixin):
                                   'County'      : '000',
                                   'Subdivision' : '23',
                                   'Jurisdiction': 'MAINE - UOCAVA'
-                                  }, index=[len(self.geocodes)])
+                                  }, index=[len(self.geocodes[2018])])
         self.geocodes[2018] = pd.concat([self.geocodes[2018], new_entry], axis=0)
  
 #*************
@@ -782,6 +831,8 @@ class ElectionSurveyCleaner(BaseEstimator, TransformerMixin):
         Given a df with at least a State
         column, add an additional col at the end
         called "Swingstate", which is True or False.
+        Other per-State attributes are available via
+        StateAttributes.add_to().
         
         @param df: any df that has a State column,
             which is a State abbreviation
@@ -789,23 +840,7 @@ class ElectionSurveyCleaner(BaseEstimator, TransformerMixin):
         @return a new df with Battleground column added
         @rtype: pd.DataFrame
         '''
-        # Get rows that are in swing States:
-        swings = df.query("State in ['AZ','CO','FL','GA','IA','ME','MI','NC','OH','PA','TX','WI']")
-        # Get their FIPS:
-        swing_fips = swings.index.get_level_values('FIPSDetailed')
-        
-        # Make a new Swingstate col with all False; same
-        # number of rows as df, where this col will be
-        # adjoined. The index will just be the FIPS codes:
-        swinger_col = pd.Series([False]*len(df), 
-                                name='Swingstate', 
-                                index=df.index.get_level_values('FIPSDetailed'))
-        
-        # Set only the swing state rows to True:
-        swinger_col[swing_fips] = True 
-        df['Swingstate'] = swinger_col.values 
-        
-        return df
+        return StateAttributes().add_to(df, ['Swingstate'])
 
     #------------------------------------
     # compute_percentages_2018
@@ -988,23 +1023,195 @@ class ElectionSurveyCleaner(BaseEstimator, TransformerMixin):
         res = res.where(res != np.inf,0)
         return res 
 
+    #------------------------------------
+    # clean_surveys
+    #-------------------
+
+    def clean_surveys(self, years, workers=None):
+        '''
+        Cleans the surveys of several years, each in 
+        its own worker process. The slowest year thus
+        determines the total time. The returned dfs
+        are compacted (see compact_survey()). Percentages
+        computed by the workers are joined into 
+        self.percentages.
+        
+        With a single year, or workers == 1, the cleaning
+        runs in this process.
+        
+        @param years: election years whose surveys to clean
+        @type years: [int]
+        @param workers: maximum number of worker processes.
+            Default: one per year
+        @type workers: {None | int}
+        @return: dict mapping each year to its cleaned survey
+        @rtype: {int : pd.DataFrame}
+        '''
+        years = list(dict.fromkeys(years))
+        for year in years:
+            if year not in self.EAVS_FILES:
+                raise NotImplementedError(f"No cleanup capability for year {year}")
+
+        if workers is None:
+            workers = len(years)
+        
+        if len(years) == 1 or workers == 1:
+            results = [clean_one_survey(year) for year in years]
+        else:
+            self.log.info(f"Cleaning surveys of {years} in {min(workers, len(years))} processes...")
+            with ProcessPoolExecutor(max_workers=min(workers, len(years))) as pool:
+                results = list(pool.map(clean_one_survey, years))
+            self.log.info(f"Done cleaning surveys of {years}.")
+
+        dfs = {}
+        percentages = {}
+        for year, df, df_perc in results:
+            dfs[year] = df
+            if not df_perc.empty:
+                percentages[year] = df_perc
+        if percentages:
+            self.percentages = self.join_surveys(percentages)
+
+        return dfs
+
+    #------------------------------------
+    # compact_survey
+    #-------------------
+
+    def compact_survey(self, df):
+        '''
+        Survey dfs come out of cleaning with object
+        dtype columns, because of the cell-by-cell
+        to_int_if_possible() treatment. Convert all
+        columns that hold only numbers to numeric dtypes.
+        Integer columns get the narrowest integer dtype;
+        float columns stay float64, since float32 would
+        lose precision. FIPS code columns remain strings
+        to preserve their leading zeroes. Columns with
+        text, such as comments, are left alone.
+        
+        Makes the dfs cheap to ship back from worker
+        processes, and to join.
+        
+        @param df: cleaned survey
+        @type df: pd.DataFrame
+        @return: new df with compacted columns
+        @rtype: pd.DataFrame
+        '''
+        compacted = {}
+        for col_name in df.columns:
+            col = df[col_name]
+            if 'FIPS' in col_name or col.dtype != object:
+                compacted[col_name] = col
+                continue
+            try:
+                col = pd.to_numeric(col)
+            except (ValueError, TypeError):
+                # Free text:
+                compacted[col_name] = col
+                continue
+            if pd.api.types.is_integer_dtype(col):
+                col = pd.to_numeric(col, downcast='integer')
+            compacted[col_name] = col
+
+        return pd.DataFrame(compacted, index=df.index)
+
     #------------------------------------
     # join_surveys
     #-------------------
     
     def join_surveys(self, df_dict):
+        '''
+        Joins the surveys of several years into a single
+        wide df. The column names of all surveys start with
+        their year, so the surveys can be lined up side by
+        side on the FIPSDetailed/State/Jurisdiction index.
+        The Election index level is dropped in the result,
+        since each row then holds several elections.
+        
+        Rather than merging pairwise, which copies the
+        growing result once per year, all surveys are 
+        aligned to one shared categorical FIPSDetailed
+        level, and concatenated in one k-way outer join.
+        Jurisdictions missing from a year get NaN 
+        for that year's columns.
+        
+        The concat requires unique FIPSDetailed/State/Jurisdiction
+        index entries. If a survey repeats an entry, the
+        surveys are merged pairwise instead, as before, which
+        pairs each repeated row with every matching row of
+        the other years.
+        
+        @param df_dict: dict mapping years to survey dfs
+        @type df_dict: {int : pd.DataFrame}
+        @return: the joined surveys
+        @rtype: pd.DataFrame
+        @raise ValueError: if the surveys cannot be joined
+        '''
         
         dfs = list(df_dict.values())
         if len(dfs) == 1:
             return dfs[0]
-        df_merged = dfs[0]
-        for nxt_df in dfs[1:]:
-            df_merged = df_merged.merge(nxt_df, 
-                                        left_on=['FIPSDetailed','State','Jurisdiction'], 
-                                        right_on=['FIPSDetailed','State','Jurisdiction'],
-                                        how='outer')
 
-        return df_merged
+        # One FIPS code dictionary for all years; 
+        # index alignment then compares integer codes:
+        all_fips = dfs[0].index.levels[0]
+        for df in dfs[1:]:
+            all_fips = all_fips.union(df.index.levels[0])
+        fips_dtype = pd.CategoricalDtype(all_fips.astype(str))
+
+        aligned = {}
+        for year, df in df_dict.items():
+            df = df.droplevel('Election')
+            fips = pd.Categorical(df.index.get_level_values('FIPSDetailed'), dtype=fips_dtype)
+            df.index = pd.MultiIndex.from_arrays([fips,
+                                                  df.index.get_level_values('State'),
+                                                  df.index.get_level_values('Jurisdiction')
+                                                  ],
+                                                 names=['FIPSDetailed', 'State', 'Jurisdiction'])
+            aligned[year] = df
+
+        repeating = [year for year, df in aligned.items() if not df.index.is_unique]
+        if not repeating:
+            return pd.concat(aligned.values(), axis=1, join='outer', sort=True)
+
+        self.log.warn(f"Surveys of {repeating} repeat FIPSDetailed/State/Jurisdiction "
+                      f"entries; merging pairwise")
+        years = list(aligned.keys())
+        df_merged = aligned[years[0]]
+        for year in years[1:]:
+            try:
+                df_merged = df_merged.merge(aligned[year],
+                                            left_index=True,
+                                            right_index=True,
+                                            how='outer')
+            except Exception as e:
+                raise ValueError(f"Cannot join survey of {year} to those of {years[:years.index(year)]}: {e}") from e
+        return df_merged.sort_index()
+
+    #------------------------------------
+    # aggregator
+    #-------------------
+
+    def aggregator(self, df_dict):
+        '''
+        Returns an EAVSAggregator over the given cleaned 
+        surveys (and self.percentages), for rolling survey 
+        measures up to State, county, or jurisdiction level. 
+        MailVotingTransformer uses the same class, so roll-ups
+        from both sources agree. Example:
+        
+            dfs = xformer.clean_surveys([2016, 2018])
+            agg = xformer.aggregator(dfs)
+            agg.rollup(2018, ['TotalVoteCounted', 'TotalVoteByMail'])
+        
+        @param df_dict: dict mapping years to cleaned surveys
+        @type df_dict: {int : pd.DataFrame}
+        @return: aggregator over the surveys
+        @rtype: EAVSAggregator
+        '''
+        percentages = None if self.percentages.empty else self.percentages
+        return EAVSAggregator(panel=to_panel_frame(df_dict, percentages))
 
     #------------------------------------
     # parse_fips_codes 
@@ -1120,17 +1327,17 @@ class ElectionSurveyCleaner(BaseEstimator, TransformerMixin):
         # in problems: 
         pat  = r"(?P<one>town of) (?P<two>.*)"
         repl = lambda m: m.group('two')+' town'
-        problems.Jurisdiction = problems.Jurisdiction.str.replace(pat,repl)
+        problems.Jurisdiction = problems.Jurisdiction.str.replace(pat, repl, regex=True)
 
         # Same with 'city raspberry' and 'raspberry city':
         pat  = r"(?P<one>city of) (?P<two>.*)"
         repl = lambda m: m.group('two')+' city'
-        problems.Jurisdiction = problems.Jurisdiction.str.replace(pat,repl)
+        problems.Jurisdiction = problems.Jurisdiction.str.replace(pat, repl, regex=True)
         
         # ... and village:
         pat  = r"(?P<one>village of) (?P<two>.*)"
         repl = lambda m: m.group('two')+' village'
-        problems.Jurisdiction = problems.Jurisdiction.str.replace(pat,repl)
+        problems.Jurisdiction = problems.Jurisdiction.str.replace(pat, repl, regex=True)
         
         # Some counties are spelled differently in 
         # the surveys than in the Census. Make the 
@@ -1229,6 +1436,8 @@ class ElectionSurveyCleaner(BaseEstimator, TransformerMixin):
             data is requested.
         @type year: int
         '''
+        if year in self.EAVS_FILES:
+            self.load_census_geocodes([year])
         if year == 2014:
             df = self.clean_survey_2014(self.EAVS_FILES[2014])
         elif year == 2016:
@@ -1253,6 +1462,18 @@ if __name__ == '__main__':
                              'are directed. Default: stdout.',
                         dest='errLogFile',
                         default=None)
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        help='maximum number of processes that clean surveys in parallel.\n' +\
+                             'Default: one per year.',
+                        default=None)
+    parser.add_argument('-f', '--format',
+                        choices=['csv', 'parquet'],
+                        help='csv: one wide csv for details, another for percentages.\n' +\
+                             'parquet: a Parquet panel directory partitioned by election,\n' +\
+                             '         named like outfile without extension.\n' +\
+                             'Default: csv',
+                        default='csv')
     parser.add_argument('years',
                         type=int,
                         nargs='+',
@@ -1263,13 +1484,17 @@ if __name__ == '__main__':
 
     args = parser.parse_args();
 
-    xformer = ElectionSurveyCleaner()
-    dfs = {}
-    #*********
-    args.years = [2018]
-    #*********
-    for year in args.years:
-        dfs[year] = xformer.transform(year)
+    # The worker processes load their own geocodes:
+    xformer = ElectionSurveyCleaner(years=[])
+    dfs = xformer.clean_surveys(args.years, workers=args.workers)
+    outpath = Path(args.outfile)
+    
+    if args.format == 'parquet':
+        panel_dir = outpath.parent.joinpath(outpath.stem)
+        xformer.log.info(f"Writing panel to {panel_dir}...")
+        write_panel(dfs, panel_dir, percentages=xformer.percentages)
+        xformer.log.info(f"Done writing panel to {panel_dir}.")
+        sys.exit(0)
         
     # Combine the dfs:
     xformer.log.info(f"Combining {len(dfs)} surveys into one...")
@@ -1281,7 +1506,6 @@ if __name__ == '__main__':
     xformer.log.info(f"Done adding a Swingstate column")
     
     xformer.log.info(f"Writing result to {args.outfile}...")
-    outpath   = Path(args.outfile)
     out_csv_details       = outpath.parent.joinpath(f'{outpath.stem}.csv')
     out_csv_percentages   = outpath.parent.joinpath(f'{outpath.stem}_percentages.csv')
     #out_excel = outpath.parent.joinpath(outpath.stem + '.xlsx')
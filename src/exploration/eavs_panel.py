@@ -0,0 +1,217 @@
+'''
+Created on Oct 19, 2020
+
+@author: paepcke
+
+Store and retrieve cleaned Election Administration and
+Voting Survey (EAVS) results as a columnar panel: one
+row per (FIPSDetailed, State, Jurisdiction, Election),
+written as a Parquet dataset that is partitioned by
+Election:
+
+      <panel_dir>/Election=2014/<part>.parquet
+      <panel_dir>/Election=2016/<part>.parquet
+      <panel_dir>/Election=2018/<part>.parquet
+
+Within each partition rows are sorted by State, and
+written in small row groups. The per-row-group min/max
+statistics therefore let readers skip everything but
+the requested States. FIPSDetailed, State, and Jurisdiction
+are dictionary encoded.
+
+Column names in the panel are the cleaned survey column
+names without their leading year: '2018TotalVoteCounted'
+becomes 'TotalVoteCounted', and the year moves into the
+Election key.
+
+Usage:
+    write_panel({2016 : df2016, 2018: df2018}, '/tmp/eavs_panel')
+    df = read_panel('/tmp/eavs_panel',
+                    years=[2018],
+                    states=['AZ', 'WI'],
+                    columns=['TotalVoteCounted'])
+'''
+import os
+import re
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+PANEL_INDEX = ['FIPSDetailed', 'State', 'Jurisdiction', 'Election']
+
+# Rows per Parquet row group. Small enough that
+# one State's counties span only a few groups:
+ROW_GROUP_SIZE = 1024
+
+YEAR_PREFIX_PAT = re.compile(r'^(?:19|20)\d\d(?=\D)')
+
+#------------------------------------
+# write_panel
+#-------------------
+
+def write_panel(df_dict, panel_dir, percentages=None, compression='zstd'):
+    '''
+    Write cleaned surveys to a Parquet panel, one
+    partition per election year. Partitions of years
+    being written replace any existing partitions of
+    the same year. Other years are left alone.
+
+    The dfs are expected to be as produced by
+    ElectionSurveyCleaner.transform(): a multiindex
+    FIPSDetailed/State/Jurisdiction/Election, and
+    column names that start with the election year.
+
+    @param df_dict: dict mapping years to cleaned surveys
+    @type df_dict: {int : pd.DataFrame}
+    @param panel_dir: root directory of the panel
+    @type panel_dir: str
+    @param percentages: optional df of percentages
+        with the same index as the surveys; its
+        columns are added to the matching years.
+    @type percentages: {None | pd.DataFrame}
+    @param compression: Parquet compression codec
+    @type compression: str
+    @return: the long-format panel that was written
+    @rtype: pd.DataFrame
+    '''
+    panel = to_panel_frame(df_dict, percentages)
+
+    for year, year_panel in panel.groupby(level='Election', sort=True):
+        partition_dir = os.path.join(panel_dir, f'Election={year}')
+        if os.path.isdir(partition_dir):
+            shutil.rmtree(partition_dir)
+        os.makedirs(partition_dir)
+        # The year is encoded in the directory name. Categorical
+        # index columns become dictionary encoded Parquet columns:
+        table = pa.Table.from_pandas(year_panel.reset_index().drop('Election', axis=1),
+                                     preserve_index=False)
+        pq.write_table(table,
+                       os.path.join(partition_dir, 'part-0.parquet'),
+                       row_group_size=ROW_GROUP_SIZE,
+                       compression=compression,
+                       write_statistics=True)
+    return panel
+
+#------------------------------------
+# to_panel_frame
+#-------------------
+
+def to_panel_frame(df_dict, percentages=None):
+    '''
+    Stack cleaned surveys of several years into one
+    long df with index FIPSDetailed/State/Jurisdiction/Election.
+    Column names lose their leading year. Columns that
+    only exist in some years are NaN for the others.
+    String index levels become categoricals.
+
+    @param df_dict: dict mapping years to cleaned surveys
+    @type df_dict: {int : pd.DataFrame}
+    @param percentages: optional percentages df with the
+        same index as the surveys
+    @type percentages: {None | pd.DataFrame}
+    @return: long-format panel
+    @rtype: pd.DataFrame
+    '''
+    year_dfs = []
+    for year, df in df_dict.items():
+        if percentages is not None:
+            perc_cols = [col for col in percentages.columns
+                         if col.startswith(str(year)) and col not in df.columns]
+            if perc_cols:
+                df = df.join(percentages[perc_cols])
+        df = df.rename(strip_year, axis=1)
+        if 'Election' not in df.index.names:
+            df = df.assign(Election=year).set_index('Election', append=True)
+        year_dfs.append(df)
+
+    panel = pd.concat(year_dfs, axis=0, join='outer')
+    panel = panel.reset_index()
+    
+    # Free text columns, such as comments, mix strings
+    # with the zeroes that cleaning filled in. Parquet 
+    # columns need one type:
+    for col_name in panel.columns[panel.dtypes == object]:
+        if col_name not in PANEL_INDEX:
+            panel[col_name] = panel[col_name].where(panel[col_name].isna(),
+                                                    panel[col_name].astype(str))
+    
+    for col_name in ['FIPSDetailed', 'State', 'Jurisdiction']:
+        panel[col_name] = panel[col_name].astype(str).astype('category')
+    panel['Election'] = panel['Election'].astype('int16')
+    # Sort so that row group statistics on State
+    # are narrow:
+    panel = panel.sort_values(['Election', 'State', 'FIPSDetailed'], kind='stable')
+    return panel.set_index(PANEL_INDEX)
+
+#------------------------------------
+# read_panel
+#-------------------
+
+def read_panel(panel_dir, years=None, states=None, columns=None):
+    '''
+    Read all or part of a panel written by write_panel().
+    Year and State selections are pushed down to Parquet:
+    partitions of other years are never opened, and row
+    groups whose State statistics exclude the requested
+    States are skipped. Only the requested columns are
+    decoded.
+
+    @param panel_dir: root directory of the panel
+    @type panel_dir: str
+    @param years: election years to load. Default: all
+    @type years: {None | [int]}
+    @param states: 2-letter State abbreviations to load.
+        Default: all
+    @type states: {None | [str]}
+    @param columns: measure columns to load (without year
+        prefix). Default: all
+    @type columns: {None | [str]}
+    @return: panel excerpt with index
+        FIPSDetailed/State/Jurisdiction/Election
+    @rtype: pd.DataFrame
+    '''
+    # Partitions written at different times may disagree
+    # on the types of columns that are all-null in some
+    # years. Read with the union of the partition schemas:
+    partitioning = ds.partitioning(pa.schema([('Election', pa.int16())]),
+                                   flavor='hive')
+    dataset = ds.dataset(panel_dir, format='parquet', partitioning=partitioning)
+    schema  = pa.unify_schemas([fragment.physical_schema for fragment in dataset.get_fragments()] +
+                               [partitioning.schema],
+                               promote_options='permissive')
+    dataset = ds.dataset(panel_dir, schema=schema, format='parquet', partitioning=partitioning)
+
+    row_filter = None
+    if years is not None:
+        row_filter = ds.field('Election').isin([int(year) for year in years])
+    if states is not None:
+        state_filter = ds.field('State').isin(list(states))
+        row_filter = state_filter if row_filter is None else row_filter & state_filter
+
+    if columns is not None:
+        columns = PANEL_INDEX + [col for col in columns if col not in PANEL_INDEX]
+
+    table = dataset.to_table(columns=columns, filter=row_filter)
+    df = table.to_pandas()
+    return df.set_index(PANEL_INDEX)
+
+#------------------------------------
+# strip_year
+#-------------------
+
+def strip_year(col_name):
+    '''
+    Remove a leading election year from a
+    column name: '2018TotalVoteCounted'
+    becomes 'TotalVoteCounted'. Names without
+    leading year are returned unchanged.
+
+    @param col_name: survey column name
+    @type col_name: str
+    @return: column name without year
+    @rtype: str
+    '''
+    return YEAR_PREFIX_PAT.sub('', col_name)
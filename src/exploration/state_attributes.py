@@ -0,0 +1,152 @@
+'''
+Created on Oct 21, 2020
+
+@author: paepcke
+
+Per-State attributes, such as whether a State is a
+swing State, or votes entirely by mail. The attributes
+live in data/state_attributes.csv, one row per State
+(plus D.C.), one column per attribute:
+
+    State,Swingstate,MailOnlyState,CensusRegion,TimeZone
+    AL,False,False,South,Central
+    AK,False,False,West,Alaska
+             ...
+
+New attributes only need a new column in that file.
+
+Attributes are attached to county level or State level
+dfs by looking up each distinct State once, and then
+spreading the result to all rows with a single positional
+take over the State codes:
+
+    attrs = StateAttributes()
+    df = attrs.add_to(df)                       # All attributes
+    df = attrs.add_to(df, ['Swingstate'])       # Just one
+    df = attrs.add_to(df, state_col='Region')   # Different State col/level name
+'''
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class StateAttributes(object):
+    '''
+    Lookup table of State attributes. The table
+    is read once per process, and shared by all
+    instances.
+    '''
+
+    ATTRIBUTES_FILE = os.path.join(os.path.dirname(__file__),
+                                   '../../data/state_attributes.csv')
+
+    # Loaded tables, keyed by file name:
+    tables = {}
+
+    #------------------------------------
+    # Constructor
+    #-------------------
+
+    def __init__(self, attributes_file=None):
+        '''
+        Load the attributes table, unless it was
+        loaded earlier.
+
+        @param attributes_file: CSV file with a State column
+            of 2-letter abbreviations, and one column per
+            attribute. Default: data/state_attributes.csv
+        @type attributes_file: {None | str}
+        '''
+        if attributes_file is None:
+            attributes_file = self.ATTRIBUTES_FILE
+        try:
+            self.table = StateAttributes.tables[attributes_file]
+        except KeyError:
+            self.table = self.load_attributes(attributes_file)
+            StateAttributes.tables[attributes_file] = self.table
+
+    #------------------------------------
+    # load_attributes
+    #-------------------
+
+    def load_attributes(self, attributes_file):
+        '''
+        Read the attributes table. True/False columns
+        become nullable booleans, other text columns
+        become categoricals. A final all-NA row is
+        appended, so that States missing from the
+        table can be pointed to position -1.
+
+        @param attributes_file: path to attributes CSV
+        @type attributes_file: str
+        @return: attributes indexed by State, plus an NA row
+        @rtype: pd.DataFrame
+        '''
+        table = pd.read_csv(attributes_file, dtype={'State' : str}).set_index('State')
+        table = pd.concat([table, pd.DataFrame(index=pd.Index([None], name='State'))])
+        for col_name in table.columns:
+            if set(table[col_name].dropna().unique()) <= {True, False}:
+                table[col_name] = table[col_name].astype('boolean')
+            elif not pd.api.types.is_numeric_dtype(table[col_name]):
+                table[col_name] = table[col_name].astype('category')
+        return table
+
+    #------------------------------------
+    # attribute_names
+    #-------------------
+
+    @property
+    def attribute_names(self):
+        return list(self.table.columns)
+
+    #------------------------------------
+    # add_to
+    #-------------------
+
+    def add_to(self, df, attributes=None, state_col='State'):
+        '''
+        Add State attribute columns to the right of df.
+        The State of each row is taken from an index level
+        or column named state_col. Rows whose State is not
+        in the attributes table get NA. The df is modified
+        in place, and also returned.
+
+        @param df: any df with 2-letter State abbreviations
+            in an index level or column
+        @type df: pd.DataFrame
+        @param attributes: names of attributes to add.
+            Default: all
+        @type attributes: {None | [str]}
+        @param state_col: name of the State index level or column
+        @type state_col: str
+        @return: df with the attribute columns added
+        @rtype: pd.DataFrame
+        '''
+        if attributes is None:
+            attributes = self.attribute_names
+
+        # Get the distinct States, and for each row
+        # the position of its State among them:
+        if state_col in df.index.names:
+            if isinstance(df.index, pd.MultiIndex):
+                level  = df.index.names.index(state_col)
+                states = df.index.levels[level]
+                codes  = df.index.codes[level]
+            else:
+                codes, states = pd.factorize(df.index)
+        elif isinstance(df[state_col].dtype, pd.CategoricalDtype):
+            states = df[state_col].cat.categories
+            codes  = df[state_col].cat.codes.to_numpy()
+        else:
+            codes, states = pd.factorize(df[state_col])
+
+        # Table row of each distinct State; -1 (the NA row)
+        # for States that are unknown, or missing in df:
+        state_rows = self.table.index.get_indexer(states)
+        row_pos = np.where(codes < 0, -1, state_rows.take(codes))
+
+        attr_cols = self.table[attributes].take(row_pos)
+        for col_name in attributes:
+            df[col_name] = attr_cols[col_name].array
+        return df
@@ -4,11 +4,17 @@ Created on Oct 1, 2020
 @author: paepcke
 '''
 
+import tempfile
 import unittest
+from unittest import mock
 
 import pandas as pd
 
+import eavs_cleaning
 from eavs_cleaning import ElectionSurveyCleaner
+from eavs_aggregator import EAVSAggregator
+from eavs_panel import write_panel, read_panel
+from state_attributes import StateAttributes
 
 pd.set_option('display.max_columns', None)  
 pd.set_option('display.expand_frame_repr', False)
@@ -18,6 +24,40 @@ pd.set_option('max_colwidth', None)
 #******TEST_ALL = True
 TEST_ALL = False
 
+def synthetic_survey(year, jurisdictions):
+    '''
+    Build a small cleaned survey: one row per
+    (FIPSDetailed, State, Jurisdiction, votes).
+    
+    @param year: election year
+    @type year: int
+    @param jurisdictions: index entries and vote counts
+    @type jurisdictions: [(str, str, str, int)]
+    @return: survey with a {year}TotalVote column
+    @rtype: pd.DataFrame
+    '''
+    mindx = pd.MultiIndex.from_tuples([(fips, state, juris, year)
+                                       for fips, state, juris, _votes in jurisdictions],
+                                      names=['FIPSDetailed', 'State', 'Jurisdiction', 'Election'])
+    return pd.DataFrame({f'{year}TotalVote' : [votes for *_index, votes in jurisdictions]},
+                        index=mindx)
+
+def fake_clean_one_survey(year):
+    '''
+    Stand-in for eavs_cleaning.clean_one_survey() that
+    needs no spreadsheets. Module level, so that it can
+    be pickled to worker processes.
+    '''
+    df = synthetic_survey(year, [('5500100000', 'WI', 'ADAMS COUNTY', year // 10),
+                                 ('0400100000', 'AZ', 'APACHE COUNTY', year // 20)])
+    if year == 2018:
+        percentages = pd.DataFrame({f'{year}PercByMailTotal' : [12.5, 25.0]},
+                                   index=df.index.droplevel('Election'))
+    else:
+        percentages = pd.DataFrame()
+    return year, df, percentages
+
+
 
 class MailVotingTest(unittest.TestCase):
 
@@ -194,6 +234,152 @@ class MailVotingTest(unittest.TestCase):
         
         self.assertTrue(len(prob_col), 0)
 
+    #------------------------------------
+    # test_panel_round_trip
+    #-------------------
+
+    def test_panel_round_trip(self):
+        dfs = {}
+        for year, votes in [(2016, [10, 20, 30]), (2018, [11, 21, 31])]:
+            mindx = pd.MultiIndex.from_tuples([('0400100000', 'AZ', 'APACHE COUNTY', year),
+                                               ('5500100000', 'WI', 'ADAMS COUNTY', year),
+                                               ('0100100000', 'AL', 'AUTAUGA COUNTY', year)],
+                                              names=['FIPSDetailed','State','Jurisdiction','Election'])
+            dfs[year] = pd.DataFrame({f'{year}TotalVote' : votes,
+                                      f'{year}CountyFIPS' : ['04001', '55001', '01001']},
+                                      index=mindx)
+        with tempfile.TemporaryDirectory() as panel_dir:
+            write_panel(dfs, panel_dir)
+            
+            panel = read_panel(panel_dir)
+            self.assertEqual(len(panel), 6)
+            self.assertEqual(panel.loc[('5500100000', 'WI', 'ADAMS COUNTY', 2018), 'TotalVote'], 21)
+            # Leading zeroes survive:
+            self.assertEqual(panel.loc[('0100100000', 'AL', 'AUTAUGA COUNTY', 2016), 'CountyFIPS'], 
+                             '01001')
+            
+            excerpt = read_panel(panel_dir, years=[2018], states=['AZ', 'WI'], columns=['TotalVote'])
+            self.assertEqual(list(excerpt.columns), ['TotalVote'])
+            self.assertEqual(sorted(excerpt.TotalVote), [11, 21])
+            self.assertEqual(set(excerpt.index.get_level_values('Election')), {2018})
+
+    #------------------------------------
+    # test_state_attributes
+    #-------------------
+
+    def test_state_attributes(self):
+        mindx = pd.MultiIndex.from_tuples([('0400100000', 'AZ', 'APACHE COUNTY', 2018),
+                                           ('0600100000', 'CA', 'ALAMEDA COUNTY', 2018),
+                                           ('0400300000', 'AZ', 'COCHISE COUNTY', 2018),
+                                           ('6600100000', 'GU', 'GUAM', 2018)],
+                                          names=['FIPSDetailed','State','Jurisdiction','Election'])
+        df = pd.DataFrame({'2018TotalVote' : [1, 2, 3, 4]}, index=mindx)
+        df = StateAttributes().add_to(df, ['Swingstate', 'TimeZone'])
+        self.assertEqual(list(df.Swingstate[:3]), [True, False, True])
+        self.assertTrue(pd.isna(df.Swingstate.iloc[3]))
+        self.assertEqual(list(df.TimeZone[:3]), ['Mountain', 'Pacific', 'Mountain'])
+        
+        # State in a column rather than the index:
+        df = pd.DataFrame({'State' : ['OR', 'WI'], 'Votes' : [10, 20]})
+        df = StateAttributes().add_to(df)
+        self.assertEqual(list(df.MailOnlyState), [True, False])
+        self.assertEqual(list(df.CensusRegion), ['West', 'Midwest'])
+
+    #------------------------------------
+    # test_aggregator
+    #-------------------
+
+    def test_aggregator(self):
+        panel = pd.DataFrame({'State'        : ['WI', 'WI', 'WI', 'AZ', 'GU'],
+                              'Jurisdiction' : ['ABRAMS TOWN', 'ACKLEY TOWN', 'ADAMS CITY', 
+                                                'APACHE COUNTY', 'GUAM'],
+                              'CountyFIPS'   : ['55083', '55067', '55067', '04001', '66010'],
+                              'Election'     : [2016] * 5,
+                              'TotalVote'    : [100, -888888, 300, 400, 500],
+                              'TotalByMail'  : ['10', '-999999: Data Not Available', None, 40, 50]
+                              })
+        agg = EAVSAggregator(panel=panel)
+        by_state = agg.rollup(2016, ['TotalVote', 'TotalByMail'])
+        # Guam is dropped, and the codes count as zero:
+        self.assertEqual(list(by_state.index), [('AZ', 2016), ('WI', 2016)])
+        self.assertEqual(list(by_state.TotalVote), [400, 400])
+        self.assertEqual(list(by_state.TotalByMail), [40, 10])
+        
+        by_county = agg.rollup(2016, ['TotalVote'], level='county')
+        self.assertEqual(by_county.loc[('WI', '55067', 2016), 'TotalVote'], 300)
+        
+        # Memoized result is protected from changes by callers:
+        by_state['TotalVote'] = 0
+        self.assertEqual(list(agg.rollup(2016, ['TotalVote', 'TotalByMail']).TotalVote), [400, 400])
+
+    #------------------------------------
+    # test_clean_surveys
+    #-------------------
+
+    @mock.patch.object(eavs_cleaning, 'clean_one_survey', fake_clean_one_survey)
+    def test_clean_surveys(self):
+        xformer = ElectionSurveyCleaner(years=[])
+        # Repeated years are cleaned once, in worker processes:
+        dfs = xformer.clean_surveys([2016, 2018, 2016])
+        self.assertEqual(list(dfs.keys()), [2016, 2018])
+        self.assertEqual(dfs[2018].loc[('5500100000', 'WI', 'ADAMS COUNTY', 2018), '2018TotalVote'], 201)
+        self.assertEqual(list(xformer.percentages.columns), ['2018PercByMailTotal'])
+        
+        # Same result without worker processes:
+        in_process = xformer.clean_surveys([2016, 2018], workers=1)
+        for year, df in dfs.items():
+            pd.testing.assert_frame_equal(in_process[year], df)
+        
+        with self.assertRaises(NotImplementedError):
+            xformer.clean_surveys([2018, 2020])
+
+    #------------------------------------
+    # test_compact_survey
+    #-------------------
+
+    def test_compact_survey(self):
+        xformer = ElectionSurveyCleaner(years=[])
+        df = pd.DataFrame({'FIPSCode'   : ['0100100000', '5500100000'],
+                           'TotalVote'  : [201, 35000],
+                           'PercByMail' : [0.1234567891, 33.3333333333],
+                           'Comments'   : ['none', 'recount']},
+                          dtype=object)
+        compacted = xformer.compact_survey(df)
+        self.assertEqual(compacted['FIPSCode'].dtype, object)
+        self.assertEqual(compacted['TotalVote'].dtype, 'int32')
+        self.assertEqual(compacted['Comments'].dtype, object)
+        # Floats are not narrowed to float32:
+        self.assertEqual(compacted['PercByMail'].dtype, 'float64')
+        self.assertEqual(list(compacted['PercByMail']), [0.1234567891, 33.3333333333])
+
+    #------------------------------------
+    # test_join_surveys
+    #-------------------
+
+    def test_join_surveys(self):
+        xformer = ElectionSurveyCleaner(years=[])
+        df_2016 = synthetic_survey(2016, [('5500100000', 'WI', 'ADAMS COUNTY', 10),
+                                          ('0400100000', 'AZ', 'APACHE COUNTY', 20)])
+        df_2018 = synthetic_survey(2018, [('5500100000', 'WI', 'ADAMS COUNTY', 11),
+                                          ('0100100000', 'AL', 'AUTAUGA COUNTY', 31)])
+        joined = xformer.join_surveys({2016 : df_2016, 2018 : df_2018})
+        self.assertEqual(list(joined.index.names), ['FIPSDetailed', 'State', 'Jurisdiction'])
+        self.assertEqual(list(joined.index.get_level_values('FIPSDetailed')),
+                         ['0100100000', '0400100000', '5500100000'])
+        self.assertEqual(list(joined['2018TotalVote'].fillna(-1)), [31, -1, 11])
+        self.assertEqual(list(joined['2016TotalVote'].fillna(-1)), [-1, 20, 10])
+        
+        # A repeated jurisdiction falls back to merging,
+        # rather than failing the concat:
+        df_2016 = synthetic_survey(2016, [('5500100000', 'WI', 'ADAMS COUNTY', 10),
+                                          ('5500100000', 'WI', 'ADAMS COUNTY', 12),
+                                          ('0400100000', 'AZ', 'APACHE COUNTY', 20)])
+        joined = xformer.join_surveys({2016 : df_2016, 2018 : df_2018})
+        adams = joined.xs('ADAMS COUNTY', level='Jurisdiction')
+        self.assertEqual(sorted(adams['2016TotalVote']), [10, 12])
+        self.assertEqual(list(adams['2018TotalVote']), [11, 11])
+        self.assertEqual(len(joined), 4)
+
 
 # --------------------------- Main ----------
 if __name__ == "__main__":
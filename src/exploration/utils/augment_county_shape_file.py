@@ -10,11 +10,19 @@ import dbf
 import tempfile
 import shutil
 
+import numpy as np
+
 class ShapeFileAugmenter(object):
     '''
-    classdocs
+    Add a FULL_FIPS column (state + county FIPS)
+    to the attributes table of a county shapefile
+    zip archive, and write the result to a new
+    archive.
     '''
 
+    # Bytes per read when copying archive members:
+    COPY_CHUNK_SIZE = 1024 * 1024
+
     #------------------------------------
     # Constructor
     #-------------------
@@ -36,6 +44,8 @@ class ShapeFileAugmenter(object):
             except StopIteration:
                 raise ValueError(f"No .dbf file in {county_shape_file}.")
             
+            # The dbf package needs a real file to modify;
+            # all other members are streamed below:
             with tempfile.TemporaryDirectory(suffix=".dbf", 
                                              prefix=dbf_zipfname, 
                                              dir=data_dir) as tmpdir_name:
@@ -45,38 +55,48 @@ class ShapeFileAugmenter(object):
                 tbl = dbf.Table(dbf_fname)
                 
                 # Did we already add the FULL_FIPS column?
-                try:
-                    tbl.field_names.index('FULL_FIPS')
-                    print(f"Attribute file {dbf_fname} in zip archive {county_shape_file} already contains a FULL_FIPS column.")
-                    sys.exit
-                except ValueError:
-                    # Good, it's not already there:
-                    pass
-                
-                tbl.open(mode=dbf.READ_WRITE)
+                if 'FULL_FIPS' in tbl.field_names:
+                    print(f"Attribute file {dbf_zipfname} in zip archive {county_shape_file} already contains a FULL_FIPS column.")
+                    return
                 
-                # County FIPS are two chars: 2 state, 3 county:
-                tbl.add_fields('FULL_FIPS C(5)')
+                # County FIPS are two chars: 2 state, 3 county.
+                # Computed for all counties at once, and written
+                # with a single rewrite of the table:
+                with tbl:
+                    tbl.add_computed_field('FULL_FIPS C(5)',
+                                           self.full_fips,
+                                           fields=['STATEFP', 'COUNTYFP'])
                 
-                for record in tbl:
-                    with record as r:
-                        r.FULL_FIPS = f"{str(r.STATEFP).zfill(2) + str(r.COUNTYFP).zfill(3)}"
-                        
-                tbl.close()
-                
-                #****shutil.copyfile(county_shape_file, outfile)
                 with ZipFile(outfile, mode='w') as new_county_shapes_zip:
                     # Write the new attributes file:
                     new_county_shapes_zip.write(dbf_fname, arcname=dbf_zipfname)
-                    # Copy the other files from the old to the new:
-                    zipped_files = county_shapes_zip.namelist()
-                    for zipped_fname in zipped_files:
-                        if not zipped_fname.lower().endswith('.dbf'):
-                            with tempfile.TemporaryDirectory(suffix=".dbf", 
-                                                             prefix=zipped_fname,
-                                                             dir=data_dir) as tmp_file:
-                                one_file = county_shapes_zip.extract(zipped_fname, path=tmp_file)
-                                new_county_shapes_zip.write(one_file, arcname=zipped_fname)
+                    # Copy the other files from the old to the new,
+                    # keeping their compression and timestamps:
+                    for zip_info in county_shapes_zip.infolist():
+                        if zip_info.filename == dbf_zipfname:
+                            continue
+                        with county_shapes_zip.open(zip_info) as src_fd, \
+                            new_county_shapes_zip.open(zip_info, mode='w') as dst_fd:
+                            shutil.copyfileobj(src_fd, dst_fd, self.COPY_CHUNK_SIZE)
+
+    #------------------------------------
+    # full_fips
+    #-------------------
+
+    @staticmethod
+    def full_fips(columns):
+        '''
+        Given the STATEFP and COUNTYFP columns of the
+        attributes table, return the 5-digit county FIPS
+        codes.
+        
+        @param columns: STATEFP and COUNTYFP arrays
+        @type columns: {str : np.ndarray}
+        @return: STATEFP + COUNTYFP, zero-padded
+        @rtype: np.ndarray
+        '''
+        return np.char.add(np.char.zfill(columns['STATEFP'], 2),
+                           np.char.zfill(columns['COUNTYFP'], 3))
 
                 
 # ----------------------------
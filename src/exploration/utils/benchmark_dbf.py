@@ -0,0 +1,524 @@
+'''
+Created on Oct 24, 2020
+
+@author: paepcke
+
+Throughput benchmarks for the vendored dbf package,
+run on synthetic county-level data:
+
+    python benchmark_dbf.py from_csv pack record parallel batch import datetime --rows 500000 --workers 8
+'''
+import argparse
+import contextlib
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(__file__))
+import dbf
+
+
+class DbfBenchmark(object):
+    '''
+    Times dbf operations on a synthetic table
+    of county election results, and reports
+    rows and megabytes per second.
+    '''
+
+    BENCHMARKS = ['from_csv', 'pack', 'record', 'parallel', 'batch', 'import', 'datetime', 'nulls', 'record_set']
+
+    #------------------------------------
+    # county_turnout
+    #-------------------
+
+    @staticmethod
+    def county_turnout(record):
+        '''
+        Per-record work for bench_parallel: a
+        deliberately slow running sum over the
+        vote count.
+
+        @param record: record of a county table
+        @type record: dbf.Record
+        @return: checksum of the record's votes
+        @rtype: int
+        '''
+        votes = dbf.values(record)[3] or 0
+        total = 0
+        for step in range(100):
+            total = (total + votes * step) % 1000003
+        return total
+
+    #------------------------------------
+    # Constructor
+    #-------------------
+
+    def __init__(self, rows=200000, chunk_size=65536, workers=None, seed=42):
+        '''
+        @param rows: number of synthetic records
+        @type rows: int
+        @param chunk_size: records per chunk for chunked operations
+        @type chunk_size: int
+        @param workers: processes for parallel operations; None for one per cpu
+        @type workers: {None | int}
+        @param seed: seed for the synthetic data
+        @type seed: int
+        '''
+        self.rows = rows
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.rng = np.random.default_rng(seed)
+        self.tmpdir = tempfile.TemporaryDirectory(prefix='dbf_benchmark')
+
+    #------------------------------------
+    # county_frame
+    #-------------------
+
+    def county_frame(self):
+        '''
+        Return a df with one synthetic county result per row.
+
+        @return: STATEFP, COUNTYFP, NAME, VOTES, SHARE, ELECTION, SWING columns
+        @rtype: pd.DataFrame
+        '''
+        rng = self.rng
+        votes = rng.integers(100, 3000000, self.rows).astype(float)
+        # Some counties did not report:
+        votes[rng.random(self.rows) < 0.05] = np.nan
+        return pd.DataFrame({
+            'STATEFP'  : np.char.zfill(rng.integers(1, 57, self.rows).astype(str), 2),
+            'COUNTYFP' : np.char.zfill(rng.integers(1, 840, self.rows).astype(str), 3),
+            'NAME'     : np.char.add('County ', rng.integers(0, 3200, self.rows).astype(str)),
+            'VOTES'    : pd.array(votes, dtype='Int64'),
+            'SHARE'    : rng.random(self.rows).round(3),
+            'ELECTION' : rng.choice(['2014-11-04', '2016-11-08', '2018-11-06', '2020-11-03'], self.rows),
+            'SWING'    : rng.choice(['T', 'F'], self.rows)
+            })
+
+    #------------------------------------
+    # county_table
+    #-------------------
+
+    def county_table(self, filename):
+        '''
+        Create a dbf table in the temp directory,
+        and fill it with self.county_frame().
+        The table is closed on return.
+
+        @param filename: name of the dbf file
+        @type filename: str
+        @return: the table
+        @rtype: dbf.Table
+        '''
+        table = dbf.Table(os.path.join(self.tmpdir.name, filename),
+                          'STATEFP C(2); COUNTYFP C(3); NAME C(12); VOTES N(8,0); '
+                          'SHARE N(6,3); ELECTION D; SWING L')
+        counties = self.county_frame()
+        counties['SWING'] = counties.SWING == 'T'
+        counties['ELECTION'] = pd.to_datetime(counties.ELECTION)
+        with table:
+            table.append_many(counties)
+        return table
+
+    #------------------------------------
+    # bench_from_csv
+    #-------------------
+
+    def bench_from_csv(self):
+        '''
+        Time dbf.from_csv() on a csv file of
+        self.rows rows, with field types inferred.
+
+        @return: seconds, rows per second, and csv megabytes per second
+        @rtype: {str : float}
+        '''
+        csv_path = os.path.join(self.tmpdir.name, 'counties.csv')
+        self.county_frame().to_csv(csv_path, index=False)
+        megabytes = os.path.getsize(csv_path) / 2**20
+
+        start = time.perf_counter()
+        table = dbf.from_csv(csv_path,
+                             filename=os.path.join(self.tmpdir.name, 'counties.dbf'),
+                             header=True,
+                             chunk_size=self.chunk_size)
+        seconds = time.perf_counter() - start
+
+        with table:
+            if len(table) != self.rows:
+                raise RuntimeError(f"Imported {len(table)} rows, not {self.rows}")
+        return {'seconds' : seconds,
+                'rows_per_sec' : self.rows / seconds,
+                'mb_per_sec' : megabytes / seconds
+                }
+
+    #------------------------------------
+    # bench_pack
+    #-------------------
+
+    def bench_pack(self):
+        '''
+        Time Table.pack() after deleting every
+        tenth record of a self.rows table that
+        has an index on COUNTYFP.
+
+        @return: seconds, rows per second, and table megabytes per second
+        @rtype: {str : float}
+        '''
+        table = self.county_table('pack.dbf')
+        with table:
+            table.create_index('COUNTYFP')
+            for recnum in range(0, self.rows, 10):
+                dbf.delete(table[recnum])
+            megabytes = os.path.getsize(table.filename) / 2**20
+
+            start = time.perf_counter()
+            table.pack()
+            seconds = time.perf_counter() - start
+
+            if len(table) != self.rows - len(range(0, self.rows, 10)):
+                raise RuntimeError(f"{len(table)} rows left after pack")
+        return {'seconds' : seconds,
+                'rows_per_sec' : self.rows / seconds,
+                'mb_per_sec' : megabytes / seconds
+                }
+
+    #------------------------------------
+    # bench_record
+    #-------------------
+
+    def bench_record(self):
+        '''
+        Time reading all field values of every record
+        with dbf.values(), which decodes through the
+        table's compiled field decoders. The time of
+        reading the same values one field at a time
+        is reported as field_seconds.
+
+        @return: seconds, rows per second, table megabytes per second, and field_seconds
+        @rtype: {str : float}
+        '''
+        table = self.county_table('record.dbf')
+        with table:
+            megabytes = os.path.getsize(table.filename) / 2**20
+            field_names = table.field_names
+
+            start = time.perf_counter()
+            by_field = [[record[name] for name in field_names] for record in table]
+            field_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            by_record = [dbf.values(record) for record in table]
+            seconds = time.perf_counter() - start
+
+            if by_record != by_field:
+                raise RuntimeError("dbf.values() differs from field by field access")
+        return {'seconds' : seconds,
+                'rows_per_sec' : self.rows / seconds,
+                'mb_per_sec' : megabytes / seconds,
+                'field_seconds' : field_seconds
+                }
+
+    #------------------------------------
+    # bench_parallel
+    #-------------------
+
+    def bench_parallel(self):
+        '''
+        Time dbf.parallel_map() of county_turnout()
+        over all records. The time of the same
+        map in this process is reported as
+        serial_seconds.
+
+        @return: seconds, rows per second, table megabytes per second, and serial_seconds
+        @rtype: {str : float}
+        '''
+        table = self.county_table('parallel.dbf')
+        with table:
+            megabytes = os.path.getsize(table.filename) / 2**20
+
+            start = time.perf_counter()
+            serial = [self.county_turnout(record) for record in table]
+            serial_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            parallel = dbf.parallel_map(table, self.county_turnout, workers=self.workers)
+            seconds = time.perf_counter() - start
+
+            if parallel != serial:
+                raise RuntimeError("dbf.parallel_map() differs from the serial map")
+        return {'seconds' : seconds,
+                'rows_per_sec' : self.rows / seconds,
+                'mb_per_sec' : megabytes / seconds,
+                'serial_seconds' : serial_seconds
+                }
+
+    #------------------------------------
+    # bench_batch
+    #-------------------
+
+    def bench_batch(self):
+        '''
+        Time a backfill of a FULL_FIPS field,
+        record by record, inside Table.batch().
+        The time of the same backfill without
+        a batch is reported as unbatched_seconds,
+        and the number of writes of the batch
+        as writes.
+
+        @return: seconds, rows per second, table megabytes per second,
+            unbatched_seconds, and writes
+        @rtype: {str : float}
+        '''
+        timings = {}
+        for batched in (False, True):
+            table = self.county_table(f"batch_{batched}.dbf")
+            with table:
+                table.add_fields('FULL_FIPS C(5)')
+                megabytes = os.path.getsize(table.filename) / 2**20
+                start = time.perf_counter()
+                with table.batch() if batched else contextlib.nullcontext() as journal:
+                    for record in table:
+                        with record:
+                            record.FULL_FIPS = record.STATEFP + record.COUNTYFP
+                timings[batched] = time.perf_counter() - start
+        return {'seconds' : timings[True],
+                'rows_per_sec' : self.rows / timings[True],
+                'mb_per_sec' : megabytes / timings[True],
+                'unbatched_seconds' : timings[False],
+                'writes' : journal.writes
+                }
+
+    #------------------------------------
+    # bench_import
+    #-------------------
+
+    def bench_import(self, repeats=5):
+        '''
+        Time 'import dbf' in fresh interpreters, as
+        reported by python -X importtime (best of
+        repeats), and opening a table of self.rows
+        rows once it is imported.
+
+        @param repeats: number of interpreters to start
+        @type repeats: int
+        @return: seconds for the import, and open_ms for one open
+        @rtype: {str : float}
+        '''
+        utils_dir = os.path.dirname(os.path.abspath(__file__))
+        import_times = []
+        for _i in range(repeats):
+            # Without cached bytecode, compiling the module would be timed:
+            env = dict(os.environ)
+            env.pop('PYTHONDONTWRITEBYTECODE', None)
+            report = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import dbf'],
+                                    cwd=utils_dir,
+                                    env=env,
+                                    capture_output=True,
+                                    text=True,
+                                    check=True).stderr
+            # Lines are 'import time: <self us> | <cumulative us> | <module>':
+            cumulative = re.search(r'\|\s*(\d+) \| dbf$', report, re.MULTILINE)
+            import_times.append(int(cumulative.group(1)) / 1e6)
+
+        table = self.county_table('import.dbf')
+        opens = 100
+        start = time.perf_counter()
+        for _i in range(opens):
+            dbf.Table(table.filename).open(dbf.READ_ONLY).close()
+        open_ms = (time.perf_counter() - start) / opens * 1000
+        return {'seconds' : min(import_times),
+                'open_ms' : open_ms
+                }
+
+    #------------------------------------
+    # bench_datetime
+    #-------------------
+
+    def bench_datetime(self):
+        '''
+        Time writing and reading a Visual FoxPro
+        DateTime column of poll closing times
+        with append_many() and to_numpy(). The
+        time of reading the column record by
+        record is reported as record_seconds.
+
+        @return: seconds (write plus read), rows per second, table megabytes
+            per second, and record_seconds
+        @rtype: {str : float}
+        '''
+        table = dbf.Table(os.path.join(self.tmpdir.name, 'polls.dbf'),
+                          'STATEFP C(2); CLOSED T',
+                          dbf_type='vfp')
+        election = np.datetime64('2020-11-03T19:00', 'ms')
+        closed = election + self.rng.integers(0, 4 * 3600 * 1000, self.rows).astype('timedelta64[ms]')
+        with table:
+            start = time.perf_counter()
+            table.append_many({'STATEFP' : np.char.zfill(self.rng.integers(1, 57, self.rows).astype(str), 2),
+                               'CLOSED' : closed})
+            columns = table.to_numpy('CLOSED')
+            seconds = time.perf_counter() - start
+            megabytes = os.path.getsize(table.filename) / 2**20
+
+            start = time.perf_counter()
+            by_record = [record.CLOSED for record in table]
+            record_seconds = time.perf_counter() - start
+
+            if not (columns['CLOSED'] == closed).all() or len(by_record) != self.rows:
+                raise RuntimeError("DateTime column did not survive the round trip")
+        return {'seconds' : seconds,
+                'rows_per_sec' : self.rows / seconds,
+                'mb_per_sec' : megabytes / seconds,
+                'record_seconds' : record_seconds
+                }
+
+    #------------------------------------
+    # bench_nulls
+    #-------------------
+
+    def bench_nulls(self):
+        '''
+        Time reading nullable Visual FoxPro columns,
+        a tenth of whose values are Null, as masked
+        arrays with to_numpy(masked=True). The time
+        of reading the columns record by record is
+        reported as record_seconds.
+
+        @return: seconds, rows per second, table megabytes
+            per second, and record_seconds
+        @rtype: {str : float}
+        '''
+        table = dbf.Table(os.path.join(self.tmpdir.name, 'reported.dbf'),
+                          'FIPS C(5) null; VOTES N(8,0) null; MAILED L null',
+                          dbf_type='vfp')
+        null = self.rng.random(self.rows) < 0.1
+        votes = self.rng.integers(0, 1000000, self.rows).astype(object)
+        votes[null] = None
+        with table:
+            table.append_many({'FIPS' : np.char.zfill(self.rng.integers(1, 57000, self.rows).astype(str), 5),
+                               'VOTES' : votes,
+                               'MAILED' : self.rng.random(self.rows) < 0.5})
+            megabytes = os.path.getsize(table.filename) / 2**20
+
+            start = time.perf_counter()
+            columns = table.to_numpy(masked=True)
+            seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            by_record = [(record.FIPS, record.VOTES, record.MAILED) for record in table]
+            record_seconds = time.perf_counter() - start
+
+            if (columns['VOTES'].mask != null).any() or len(by_record) != self.rows:
+                raise RuntimeError("Null flags did not survive the round trip")
+        return {'seconds' : seconds,
+                'rows_per_sec' : self.rows / seconds,
+                'mb_per_sec' : megabytes / seconds,
+                'record_seconds' : record_seconds
+                }
+
+    #------------------------------------
+    # bench_record_set
+    #-------------------
+
+    def bench_record_set(self):
+        '''
+        Time the union and the difference of two
+        query results (counties with more than
+        100,000 votes, and swing counties) held
+        as dbf.record_set()s. The time of the same
+        with dbf.Lists is reported as list_seconds.
+        Peak memory of each is reported as set_mb
+        and list_mb.
+
+        @return: seconds, rows per second, set_mb, list_seconds, and list_mb
+        @rtype: {str : float}
+        '''
+        table = self.county_table('record_set.dbf')
+        with table:
+            large = table.where("votes > 100000")
+            swing = table.where("swing")
+            results = {}
+            for kind in ('set', 'list'):
+                tracemalloc.start()
+                start = time.perf_counter()
+                if kind == 'set':
+                    left = dbf.record_set(table, large)
+                    right = dbf.record_set(table, swing)
+                else:
+                    left = dbf.List(table[int(recnum)] for recnum in large)
+                    right = dbf.List(table[int(recnum)] for recnum in swing)
+                union = left + right
+                difference = left - right
+                results[kind] = (time.perf_counter() - start,
+                                 tracemalloc.get_traced_memory()[1] / 2**20,
+                                 len(union),
+                                 len(difference))
+                tracemalloc.stop()
+            if results['set'][2:] != results['list'][2:]:
+                raise RuntimeError("record sets and Lists disagree")
+        seconds = results['set'][0]
+        return {'seconds' : seconds,
+                'rows_per_sec' : self.rows / seconds,
+                'set_mb' : results['set'][1],
+                'list_seconds' : results['list'][0],
+                'list_mb' : results['list'][1]
+                }
+
+    #------------------------------------
+    # run
+    #-------------------
+
+    def run(self, benchmarks):
+        '''
+        Run the named benchmarks, and print one
+        line of results for each.
+
+        @param benchmarks: names from BENCHMARKS
+        @type benchmarks: [str]
+        @return: results by benchmark name
+        @rtype: {str : {str : float}}
+        '''
+        results = {}
+        for name in benchmarks:
+            result = getattr(self, f"bench_{name}")()
+            results[name] = result
+            print(f"{name:<12} {self.rows:>9,} rows  " +
+                  "  ".join(f"{key} {value:,.2f}" for key, value in result.items()))
+        return results
+
+# ------------------------ Main ------------
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     description="Throughput of dbf operations on synthetic county data"
+                                     )
+
+    parser.add_argument('-r', '--rows',
+                        type=int,
+                        help='number of synthetic records. Default: 200,000',
+                        default=200000)
+    parser.add_argument('-c', '--chunk_size',
+                        type=int,
+                        help='records per chunk. Default: 65,536',
+                        default=65536)
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        help='processes for parallel benchmarks. Default: one per cpu',
+                        default=None)
+    parser.add_argument('benchmarks',
+                        nargs='*',
+                        help=f"benchmarks to run: {', '.join(DbfBenchmark.BENCHMARKS)}. Default: all")
+
+    args = parser.parse_args();
+
+    unknown = set(args.benchmarks) - set(DbfBenchmark.BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmark(s): {', '.join(sorted(unknown))}")
+    DbfBenchmark(rows=args.rows, chunk_size=args.chunk_size, workers=args.workers).run(args.benchmarks or DbfBenchmark.BENCHMARKS)
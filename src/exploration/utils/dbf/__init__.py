@@ -37,11 +37,11 @@ import collections
 import csv
 import datetime
 import decimal
+import mmap
 import os
 import struct
 import sys
 import time
-import traceback
 import warnings
 import weakref
 
@@ -86,6 +86,9 @@ module = globals()
 ## Return None if True, else raise BadDataError
 LOGICAL_BAD_IS_NONE = True
 
+#****** Andreas: read back every memo right after writing it
+VERIFY_MEMO_WRITES = False
+
 ## treat non-unicode data as ...
 input_decoding = 'utf-8'
 
@@ -2829,21 +2832,51 @@ class FieldnameList(list):
 
 
 # add xmlrpc support
+def _register_marshaller(Marshaller):
+    # Char is unicode
+    Marshaller.dispatch[Char] = Marshaller.dump_unicode
+    # Logical unknown becomes False
+    Marshaller.dispatch[Logical] = Marshaller.dump_bool
+    # DateTime is transmitted as UTC if aware, local if naive
+    Marshaller.dispatch[DateTime] = lambda s, dt, w: w(
+            '<value><dateTime.iso8601>'
+            '%04d%02d%02dT%02d:%02d:%02d'
+            '</dateTime.iso8601></value>\n'
+                % dt.utctimetuple()[:6])
+
+#****** Andreas: xmlrpc.client (with http.client, email, and ssl) takes
+# longer to import than dbf itself, so the dbf types are registered when
+# xmlrpc.client is imported, rather than importing it here
+class _MarshallerHook(object):
+    """
+    import hook that registers the dbf types with xmlrpc.client.Marshaller
+    once xmlrpc.client is imported
+    """
+
+    def find_spec(self, name, path, target=None):
+        if name != 'xmlrpc.client':
+            return None
+        sys.meta_path.remove(self)
+        from importlib.machinery import PathFinder
+        spec = PathFinder.find_spec(name, path)
+        if spec is None or spec.loader is None:
+            return spec
+        exec_module = spec.loader.exec_module
+        def exec_and_register(module):
+            exec_module(module)
+            _register_marshaller(module.Marshaller)
+        spec.loader.exec_module = exec_and_register
+        return spec
+
 if py_ver < (3, 0):
     from xmlrpclib import Marshaller
+    _register_marshaller(Marshaller)
+    del Marshaller
+elif 'xmlrpc.client' in sys.modules:
+    _register_marshaller(sys.modules['xmlrpc.client'].Marshaller)
 else:
-    from xmlrpc.client import Marshaller
-# Char is unicode
-Marshaller.dispatch[Char] = Marshaller.dump_unicode
-# Logical unknown becomes False
-Marshaller.dispatch[Logical] = Marshaller.dump_bool
-# DateTime is transmitted as UTC if aware, local if naive
-Marshaller.dispatch[DateTime] = lambda s, dt, w: w(
-        '<value><dateTime.iso8601>'
-        '%04d%02d%02dT%02d:%02d:%02d'
-        '</dateTime.iso8601></value>\n'
-            % dt.utctimetuple()[:6])
-del Marshaller
+    sys.meta_path.insert(0, _MarshallerHook())
+#****** Andreas: END xmlrpc registration
 
 # Internal classes
 
@@ -3119,7 +3152,8 @@ class Record(object):
             self._rollback_flux()
 
     def __iter__(self):
-        return (self[field] for field in self._meta.user_fields)
+        #****** Andreas: all fields in one pass
+        return iter(self._values())
 
     def __getattr__(self, name):
         if name[0:2] == '__' and name[-2:] == '__':
@@ -3285,6 +3319,8 @@ class Record(object):
                 decimals = layout[name][DECIMALS]
                 signature[-1] = '_'.join([unicode(x) for x in (signature[-1], type.symbol, size, decimals)])
         layout.blankrecord = record._data[:]
+        #****** Andreas: the field decoders are compiled again for the new layout
+        layout.decoders = None
         data_types = []
         for fieldtype, defs in sorted(layout.fieldtypes.items()):
             if fieldtype != _NULLFLAG:    # ignore the nullflags field
@@ -3312,21 +3348,11 @@ class Record(object):
         flags = fielddef[FLAGS]
         nullable = flags & NULLABLE and '_NULLFLAGS' in self._meta
         if nullable:
-            index = fielddef[NUL]
-            byte, bit = divmod(index, 8)
-            null_def = self._meta['_NULLFLAGS']
-            null_data = self._data[null_def[START]:null_def[END]]
-            try:
-                if null_data[byte] >> bit & 1:
-                    return Null
-            except IndexError:
-                print(null_data)
-                print(index)
-                print(byte, bit)
-                print(len(self._data), self._data)
-                print(null_def)
-                print(null_data)
-                raise
+            #****** Andreas: test the bit in place, without copying the flag bytes
+            byte, bit = divmod(fielddef[NUL], 8)
+            if self._data[self._meta['_NULLFLAGS'][START] + byte] >> bit & 1:
+                return Null
+            #****** Andreas: END test the bit in place
         record_data = self._data[fielddef[START]:fielddef[END]]
         field_type = fielddef[TYPE]
         retrieve = self._meta.fieldtypes[field_type]['Retrieve']
@@ -3397,18 +3423,42 @@ class Record(object):
             raise DbfError("cannot update a packed record")
         if layout.location == ON_DISK:
             header = layout.header
+            #****** Andreas: in a batch the data is written when the batch ends
+            journal = layout.journal if location == '' else None
             if location == '':
                 location = self._recnum * header.record_length + header.start
             if data is None:
                 data = self._data
-            layout.dfd.seek(location)
-            layout.dfd.write(data)
+            if journal is not None:
+                journal.put(self._recnum, bytes(data))
+            else:
+                layout.dfd.seek(location)
+                layout.dfd.write(data)
             self._dirty = False
+            #****** Andreas: cached raw data of this record is stale now
+            if layout.record_cache is not None:
+                layout.record_cache.discard(self._recnum)
         table = layout.table()
         if table is not None:  # is None when table is being destroyed
             for index in table._indexen:
                 index(self)
 
+    #****** Andreas: decode all fields with the layout's compiled decoders
+    def _values(self):
+        """
+        returns the values of all user fields, decoded in one loop
+        """
+        meta = self._meta
+        if self._memos:
+            return [self[field] for field in meta.user_fields]
+        decoders = meta.decoders
+        if decoders is None:
+            decoders = meta.decoders = field_decoders(meta)
+        data = self._data
+        raw = data.tobytes()
+        return [decode(data, raw) for decode in decoders]
+    #****** Andreas: END decode all fields
+
     def _write(self):
         for field, value in self._memos.items():
             self._update_field_value(field, value)
@@ -3782,6 +3832,13 @@ class _DbfMemo(object):
     store memo contents to disk
     """
 
+    #****** Andreas: memos are read through one read-only map of the memo
+    #****** file, as memoryview slices; see _mapped()
+    _map = None                 # mmap of meta.mfd, or b'' for an empty file
+    _map_fd = None              # the file _map was made from
+    _view = None                # memoryview of _map
+    _unflushed = False          # writes may still sit in the file buffer
+
     def _init(self):
         """
         Initialize disk file usage
@@ -3811,9 +3868,50 @@ class _DbfMemo(object):
         self._init()
         self.meta.newmemofile = False
 
+    def _mapped(self):
+        """
+        returns a memoryview of the memo file; memos written after the
+        file was mapped lie past its end, and are read from the file until
+        the file has doubled in size and is mapped again
+        """
+        meta = self.meta
+        if self._unflushed:
+            meta.mfd.flush()
+            self._unflushed = False
+        if self._view is None or self._map_fd is not meta.mfd:
+            size = os.fstat(meta.mfd.fileno()).st_size
+            # the old map stays alive for as long as slices of it are in use
+            self._map = mmap.mmap(meta.mfd.fileno(), size, access=mmap.ACCESS_READ) if size else b''
+            self._map_fd = meta.mfd
+            self._view = memoryview(self._map)
+        return self._view
+
+    def _verify(self, block, data):
+        """
+        raises DbfError if the memo in block is not data
+        """
+        double_check = self._get_memo(block)
+        if double_check != data:
+            uhoh = open('dbf_memo_dump.err', 'wb')
+            uhoh.write(('block: %d\nnextmemo: %d\nsaved: %d bytes\n' % (block, self.nextmemo, len(data))).encode('ascii'))
+            uhoh.write(data)
+            uhoh.write(('\nretrieved: %d bytes\n' % len(double_check)).encode('ascii'))
+            uhoh.write(double_check)
+            uhoh.close()
+            raise DbfError("unknown error: memo not saved")
+
+    def _written(self, end):
+        """
+        notes a write that ends at file offset end
+        """
+        self._unflushed = True
+        if self._view is not None and end > 2 * len(self._view):
+            self._view = None
+
     def get_memo(self, block):
         """
-        Gets the memo in block
+        Gets the memo in block; memos from disk are memoryview slices of
+        the mapped memo file, valid until the memo file is zapped
         """
         if self.meta.ignorememos or not block:
             return ''
@@ -3822,6 +3920,18 @@ class _DbfMemo(object):
         else:
             return self.memory[block]
 
+    def get_memos(self, blocks):
+        """
+        Gets the memos in blocks, read in file order; returns them in
+        the order of blocks
+        """
+        blocks = [int(block) for block in blocks]
+        memos = [None] * len(blocks)
+        for i in sorted(range(len(blocks)), key=blocks.__getitem__):
+            memos[i] = self.get_memo(blocks[i])
+        return memos
+    #****** Andreas: END memos through one map
+
     def put_memo(self, data):
         """
         Stores data in memo file, returns block number
@@ -3861,17 +3971,35 @@ class _Db3Memo(_DbfMemo):
                     raise DbfError("memo file appears to be corrupt: %r" % exc.args).from_exc(None)
 
     def _get_memo(self, block):
-        block = int(block)
-        self.meta.mfd.seek(block * self.meta.memo_size)
-        eom = -1
-        data = b''
-        while eom == -1:
-            newdata = self.meta.mfd.read(self.meta.memo_size)
+        #****** Andreas: one search for the terminator in the mapped file
+        start = int(block) * self.meta.memo_size
+        view = self._mapped()
+        if start >= len(view):
+            return self._read_unmapped(start)
+        eom = self._map.find(b'\x1a\x1a', start)
+        if eom == -1:
+            eom = len(view)
+        return view[start:eom]
+
+    def _read_unmapped(self, start):
+        """
+        reads a memo written after the file was mapped, in blocks that
+        double in size; only the new bytes are searched for the terminator
+        """
+        mfd = self.meta.mfd
+        mfd.seek(start)
+        data = bytearray()
+        size = self.meta.memo_size
+        while True:
+            newdata = mfd.read(size)
             if not newdata:
-                return data
+                return memoryview(bytes(data))
+            searched = max(0, len(data) - 1)
             data += newdata
-            eom = data.find(b'\x1a\x1a')
-        return data[:eom]
+            eom = data.find(b'\x1a\x1a', searched)
+            if eom != -1:
+                return memoryview(bytes(data[:eom]))
+            size *= 2
 
     def _put_memo(self, data):
         data = data
@@ -3886,17 +4014,10 @@ class _Db3Memo(_DbfMemo):
         self.meta.mfd.seek(thismemo * self.meta.memo_size)
         self.meta.mfd.write(data)
         self.meta.mfd.write(b'\x1a\x1a')
-        double_check = self._get_memo(thismemo)
-        if len(double_check) != len(data):
-            uhoh = open('dbf_memo_dump.err', 'wb')
-            uhoh.write('thismemo: %d' % thismemo)
-            uhoh.write('nextmemo: %d' % self.nextmemo)
-            uhoh.write('saved: %d bytes' % len(data))
-            uhoh.write(data)
-            uhoh.write('retrieved: %d bytes' % len(double_check))
-            uhoh.write(double_check)
-            uhoh.close()
-            raise DbfError("unknown error: memo not saved")
+        #****** Andreas: reading the memo back is optional
+        self._written(thismemo * self.meta.memo_size + len(data) + 2)
+        if VERIFY_MEMO_WRITES:
+            self._verify(thismemo, data)
         return thismemo
 
     def _zap(self):
@@ -3906,6 +4027,7 @@ class _Db3Memo(_DbfMemo):
             mfd.truncate(0)
             mfd.write(pack_long_int(1) + b'\x00' * 508)
             mfd.flush()
+            self._view = None
 
 class _VfpMemo(_DbfMemo):
     """
@@ -3940,10 +4062,28 @@ class _VfpMemo(_DbfMemo):
                     raise DbfError("memo file appears to be corrupt: %r" % exc.args).from_exc(None)
 
     def _get_memo(self, block):
-        self.meta.mfd.seek(block * self.meta.memo_size)
-        header = self.meta.mfd.read(8)
+        #****** Andreas: the length comes from the block header in the mapped file
+        start = int(block) * self.meta.memo_size
+        view = self._mapped()
+        if start >= len(view):
+            return self._read_unmapped(start)
+        header = view[start:start + 8]
+        if len(header) < 8:
+            return header[:0]
+        length = unpack_long_int(header[4:].tobytes(), bigendian=True)
+        return view[start + 8:start + 8 + length]
+
+    def _read_unmapped(self, start):
+        """
+        reads a memo written after the file was mapped
+        """
+        mfd = self.meta.mfd
+        mfd.seek(start)
+        header = mfd.read(8)
+        if len(header) < 8:
+            return memoryview(b'')
         length = unpack_long_int(header[4:], bigendian=True)
-        return self.meta.mfd.read(length)
+        return memoryview(mfd.read(length))
 
     def _put_memo(self, data):
         data = data
@@ -3957,6 +4097,10 @@ class _VfpMemo(_DbfMemo):
         self.meta.mfd.write(pack_long_int(thismemo + blocks, bigendian=True))
         self.meta.mfd.seek(thismemo * self.meta.memo_size)
         self.meta.mfd.write(b'\x00\x00\x00\x01' + pack_long_int(len(data), bigendian=True) + data)
+        #****** Andreas: reading the memo back is optional
+        self._written(thismemo * self.meta.memo_size + 8 + len(data))
+        if VERIFY_MEMO_WRITES:
+            self._verify(thismemo, data)
         return thismemo
 
     def _zap(self):
@@ -3971,6 +4115,7 @@ class _VfpMemo(_DbfMemo):
             mfd.write(pack_long_int(nextmemo, bigendian=True) + b'\x00\x00' + \
                     pack_short_int(self.meta.memo_size, bigendian=True) + b'\x00' * 504)
             mfd.flush()
+            self._view = None
 
 
 class DbfCsv(csv.Dialect):
@@ -4281,7 +4426,8 @@ def retrieve_memo(bytes, fielddef, memo, decoder):
     block = int(stringval)
     data = memo.get_memo(block)
     if fielddef[FLAGS] & BINARY:
-        return data
+        #****** Andreas: memos from disk are memoryviews of the mapped file
+        return to_bytes(data)
     return fielddef[CLASS](decoder(data)[0])
 
 def update_memo(string, fielddef, memo, decoder, encoder):
@@ -4408,7 +4554,8 @@ def retrieve_vfp_memo(bytes, fielddef, memo, decoder):
         return cls()
     data = memo.get_memo(block)
     if fielddef[FLAGS] & BINARY:
-        return data
+        #****** Andreas: memos from disk are memoryviews of the mapped file
+        return to_bytes(data)
     return fielddef[CLASS](decoder(data)[0])
 
 def update_vfp_memo(string, fielddef, memo, decoder, encoder):
@@ -4430,6 +4577,88 @@ def update_vfp_memo(string, fielddef, memo, decoder, encoder):
     block = memo.put_memo(string)
     return struct.pack('<i', block)
 
+#****** Andreas: per-layout field decoders
+def field_decoders(meta):
+    """
+    Returns one decoder per user field of meta, in field order; each is
+    called with the record data (array) and the same data as bytes, and
+    returns the value of its field as _retrieve_field_value() would
+    """
+    decoders = []
+    for name in meta.user_fields:
+        fielddef = meta[name]
+        decode = field_decoder(meta, fielddef)
+        if fielddef[FLAGS] & NULLABLE and '_NULLFLAGS' in meta:
+            byte, bit = divmod(fielddef[NUL], 8)
+            decode = nullable_decoder(decode, meta['_NULLFLAGS'][START] + byte, 1 << bit)
+        decoders.append(decode)
+    return tuple(decoders)
+
+def field_decoder(meta, fielddef):
+    """
+    Returns the decoder of one field, specialized for the common field
+    types; other fields go through their Retrieve function
+    """
+    start, end = fielddef[START], fielddef[END]
+    cls, empty, flags = fielddef[CLASS], fielddef[EMPTY], fielddef[FLAGS]
+    retrieve = meta.fieldtypes[fielddef[TYPE]]['Retrieve']
+    if retrieve is retrieve_character and not flags & BINARY:
+        text_decoder = meta.decoder
+        def decode(data, raw):
+            chunk = raw[start:end]
+            try:
+                value = cls(text_decoder(chunk)[0])
+            except UnicodeDecodeError:
+                value = codecs.latin_1_decode(chunk)[0]
+            if not value.strip():
+                if empty is NoneType:
+                    return None
+                return empty(value)
+            return value
+    elif retrieve is retrieve_numeric and cls == 'default':
+        convert, zero = (float, 0.0) if fielddef[DECIMALS] else (int, 0)
+        def decode(data, raw):
+            string = raw[start:end].replace(b'\x00', b'').strip()
+            if not string or string[0:1] == b'*':
+                if empty is NoneType:
+                    return None
+                if empty != 'default':
+                    return empty()
+            return string and convert(string) or zero
+    elif retrieve is retrieve_date:
+        def decode(data, raw):
+            text = raw[start:end]
+            if text in (b'        ', b'00000000'):
+                if empty is NoneType:
+                    return None
+                return empty()
+            return cls(int(text[0:4]), int(text[4:6]), int(text[6:8]))
+    elif retrieve in (retrieve_logical, retrieve_currency):
+        def decode(data, raw):
+            return retrieve(raw[start:end], fielddef)
+    elif retrieve in (retrieve_integer, retrieve_double):
+        unpack = struct.Struct('<i' if retrieve is retrieve_integer else '<d').unpack_from
+        number = cls if cls != 'default' else (int if retrieve is retrieve_integer else float)
+        def decode(data, raw):
+            return number(unpack(raw, start)[0])
+    else:
+        # memos, datetimes, binary data: memo and decoder are looked
+        # up on every call, as they change with the table
+        def decode(data, raw):
+            return retrieve(data[start:end], fielddef, meta.memo, meta.decoder)
+    return decode
+
+def nullable_decoder(decode, byte, mask):
+    """
+    Returns decode wrapped in a check of the field's null flag
+    """
+    def decode_nullable(data, raw):
+        if raw[byte] & mask:
+            return Null
+        return decode(data, raw)
+    return decode_nullable
+#****** Andreas: END per-layout field decoders
+
 def add_character(format, flags):
     if format[0][0] != '(' or format[0][-1] != ')' or any([f not in flags for f in format[1:]]):
         raise FieldSpecError("Format for Character field creation is 'C(n)%s', not 'C%s'" % field_spec_error_text(format, flags))
@@ -4802,6 +5031,197 @@ class Iter(_Navigation):
             raise StopIteration
 
 
+#****** Andreas: positioned reads of record data, where the os has them
+pread = getattr(os, 'pread', None)
+
+
+#****** Andreas: cache of raw record data
+class RecordCache(object):
+    """
+    least recently used raw record data of a table, keyed by record
+    number, and limited to maxbytes bytes; reads that miss the cache
+    during a sequential scan fetch read_ahead bytes of records at once
+    """
+
+    __slots__ = 'maxbytes', 'read_ahead', 'nbytes', 'hits', 'misses', 'evictions', '_records'
+
+    def __init__(self, maxbytes=4 * 1024 * 1024, read_ahead=64 * 1024):
+        self.maxbytes = maxbytes
+        self.read_ahead = min(read_ahead, maxbytes // 4)
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self._records = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._records)
+
+    def __repr__(self):
+        return ('RecordCache(records=%(records)d, nbytes=%(nbytes)d, hits=%(hits)d, '
+                'misses=%(misses)d, evictions=%(evictions)d)' % self.stats())
+
+    def clear(self):
+        self._records.clear()
+        self.nbytes = 0
+
+    def discard(self, recnum):
+        data = self._records.pop(recnum, None)
+        if data is not None:
+            self.nbytes -= len(data)
+
+    def get(self, recnum):
+        """
+        returns the data of record recnum, or None if it is not cached
+        """
+        data = self._records.get(recnum)
+        if data is None:
+            self.misses += 1
+            return None
+        self._records.move_to_end(recnum)
+        self.hits += 1
+        return data
+
+    def put(self, recnum, data):
+        self.discard(recnum)
+        if len(data) > self.maxbytes:
+            return
+        records = self._records
+        records[recnum] = data
+        self.nbytes += len(data)
+        while self.nbytes > self.maxbytes:
+            _, evicted = records.popitem(last=False)
+            self.nbytes -= len(evicted)
+            self.evictions += 1
+
+    def stats(self):
+        return dict(
+                records=len(self._records), nbytes=self.nbytes, maxbytes=self.maxbytes,
+                hits=self.hits, misses=self.misses, evictions=self.evictions,
+                )
+
+
+#****** Andreas: journal of record changes in a batch
+class RecordJournal(object):
+    """
+    record data changed or appended during a Table.batch(), keyed by
+    record number; the records are written when the batch ends, in file
+    order, with one write per run of consecutive records, followed by a
+    single header update; if the batch raises, the changes are discarded
+    """
+
+    __slots__ = 'table', 'fsync', 'record_count', 'writes', '_records', '_active'
+
+    def __init__(self, table, fsync=False):
+        self.table = table
+        self.fsync = fsync
+        self.record_count = None
+        self.writes = 0
+        self._records = {}
+        self._active = False
+
+    def __len__(self):
+        return len(self._records)
+
+    def __repr__(self):
+        return 'RecordJournal(records=%d, writes=%d)' % (len(self._records), self.writes)
+
+    def __enter__(self):
+        meta = self.table._meta
+        if meta.location != ON_DISK:
+            return self
+        if meta.status != READ_WRITE:
+            raise DbfError('%s not in read/write mode, unable to start a batch' % meta.filename)
+        if meta.journal is None:
+            # a batch inside a batch is part of the outer one
+            self.record_count = meta.header.record_count
+            self._active = True
+            meta.journal = self
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self._active:
+            return
+        self._active = False
+        meta = self.table._meta
+        meta.journal = None
+        if exc_info[0] is None:
+            self.write()
+            self.table._update_disk(headeronly=True)
+            meta.dfd.flush()
+            if meta.mfd is not None:
+                meta.mfd.flush()
+            if self.fsync:
+                os.fsync(meta.dfd.fileno())
+                if meta.mfd is not None:
+                    os.fsync(meta.mfd.fileno())
+        else:
+            self.discard()
+
+    def get(self, recnum, default=None):
+        return self._records.get(recnum, default)
+
+    def put(self, recnum, data):
+        self._records[recnum] = data
+
+    def write(self):
+        """
+        writes the journaled records, and empties the journal
+        """
+        records = self._records
+        if not records:
+            return
+        meta = self.table._meta
+        header = meta.header
+        size = header.record_length
+        cache = meta.record_cache
+        recnums = sorted(records)
+        first = 0
+        for i in range(1, len(recnums) + 1):
+            if i < len(recnums) and recnums[i] == recnums[i - 1] + 1:
+                continue
+            meta.dfd.seek(header.start + recnums[first] * size)
+            meta.dfd.write(b''.join([records[recnum] for recnum in recnums[first:i]]))
+            self.writes += 1
+            first = i
+        if cache is not None:
+            for recnum in recnums:
+                cache.discard(recnum)
+        records.clear()
+
+    def discard(self):
+        """
+        drops the journaled records, and restores the records in use and
+        the indexes to the data on disk
+        """
+        table = self.table
+        meta = table._meta
+        records = table._table
+        appended = records._max_count - self.record_count
+        meta.header.record_count = self.record_count
+        for recnum in list(records._weakref_list):
+            if recnum >= self.record_count:
+                del records._weakref_list[recnum]
+        records._max_count = self.record_count
+        if appended > 0:
+            from ._columnar import np as numpy
+            translation = list(range(self.record_count)) + [-1] * appended
+            translation = array('l', translation) if numpy is None else numpy.array(translation)
+            for dbfindex in table._indexen:
+                dbfindex._remap(translation)
+        size = meta.header.record_length
+        for recnum in self._records:
+            maybe = records._weakref_list.get(recnum)
+            record = maybe() if maybe is not None else None
+            if record is not None and recnum < self.record_count:
+                meta.dfd.seek(meta.header.start + recnum * size)
+                record._data[:] = array('B', meta.dfd.read(size))
+                record._dirty = False
+        self._records.clear()
+        if meta.record_cache is not None:
+            meta.record_cache.clear()
+        table.reindex()
+#****** Andreas: END journal of record changes
+
+
 class Table(_Navigation):
     """
     Base class for dbf style tables
@@ -4907,6 +5327,9 @@ class Table(_Navigation):
         memofields = None         # field names of Memo type
         newmemofile = False       # True when memo file needs to be created
         nulls = None              # non-None when Nullable fields present
+        record_cache = None       # raw record data of disk tables (RecordCache)
+        decoders = None           # compiled field decoders, see field_decoders()
+        journal = None            # record data held back by Table.batch() (RecordJournal)
         user_fields = None        # not counting SYSTEM fields
         user_field_count = 0      # also not counting SYSTEM fields
         unicode_errors = 'strict' # default to strict unicode translations
@@ -5094,6 +5517,8 @@ class Table(_Navigation):
             self._weakref_list = {}
             self._accesses = 0
             self._dead_check = 1024
+            #****** Andreas: a miss here starts a read-ahead
+            self._next_read = 0
 
         def __getitem__(self, index):
             # maybe = self._weakref_list[index]()
@@ -5108,6 +5533,8 @@ class Table(_Navigation):
                 maybe = maybe()
             self._accesses += 1
             if self._accesses >= self._dead_check:
+                #****** Andreas: sweep every _dead_check accesses, not on every access after the first sweep
+                self._accesses = 0
                 for key, value in list(self._weakref_list.items()):
                     if value() is None:
                         del self._weakref_list[key]
@@ -5115,21 +5542,52 @@ class Table(_Navigation):
                 meta = self._meta
                 if meta.status == CLOSED:
                     raise DbfError("%s is closed; record %d is unavailable" % (meta.filename, index))
-                header = meta.header
-                if index < 0:
-                    index += header.record_count
-                size = header.record_length
-                location = index * size + header.start
-                meta.dfd.seek(location)
-                if meta.dfd.tell() != location:
-                    raise ValueError("unable to seek to offset %d in file" % location)
-                bytes = meta.dfd.read(size)
-                if not bytes:
-                    raise ValueError("unable to read record data from %s at location %d" % (meta.filename, location))
+                #****** Andreas: raw record data comes from the record cache if possible
+                cache = meta.record_cache
+                bytes = None if cache is None else cache.get(index)
+                if meta.journal is not None:
+                    # changed in the current batch, not yet written
+                    bytes = meta.journal.get(index, bytes)
+                if bytes is None:
+                    bytes = self._read(index)
                 maybe = Record(recnum=index, layout=meta, kamikaze=bytes, _fromdisk=True)
                 self._weakref_list[index] = weakref.ref(maybe)
             return maybe
 
+        def _read(self, index):
+            """
+            reads the data of record index; a miss right after the records
+            read last starts a read-ahead of cache.read_ahead bytes, which
+            go into the record cache
+            """
+            meta = self._meta
+            header = meta.header
+            cache = meta.record_cache
+            size = header.record_length
+            count = 1
+            if cache is not None and index == self._next_read:
+                count = max(1, min(cache.read_ahead // size, self._max_count - index))
+            location = index * size + header.start
+            if pread is not None:
+                # past the file object's read buffer, so that changes made
+                # through other handles are seen; our own writes go first
+                meta.dfd.flush()
+                data = pread(meta.dfd.fileno(), size * count, location)
+            else:
+                meta.dfd.seek(location)
+                if meta.dfd.tell() != location:
+                    raise ValueError("unable to seek to offset %d in file" % location)
+                data = meta.dfd.read(size * count)
+            if not data:
+                raise ValueError("unable to read record data from %s at location %d" % (meta.filename, location))
+            count = max(1, len(data) // size)
+            self._next_read = index + count
+            if cache is not None:
+                for i in range(count):
+                    cache.put(index + i, data[i * size:(i + 1) * size])
+            return data[:size]
+        #****** Andreas: END raw record data from the record cache
+
         def append(self, record):
             self._weakref_list[self._max_count] = weakref.ref(record)
             self._max_count += 1
@@ -5138,6 +5596,9 @@ class Table(_Navigation):
             for key in list(self._weakref_list.keys()):
                 del self._weakref_list[key]
             self._max_count = 0
+            self._next_read = 0
+            if self._meta.record_cache is not None:
+                self._meta.record_cache.clear()
 
         def flush(self):
             for maybe in self._weakref_list.values():
@@ -5151,6 +5612,8 @@ class Table(_Navigation):
             self._max_count -= 1
             record = self._weakref_list[self._max_count]
             del self._weakref_list[self._max_count]
+            if self._meta.record_cache is not None:
+                self._meta.record_cache.discard(self._max_count)
             return record
 
     def _build_header_fields(self):
@@ -5316,6 +5779,9 @@ class Table(_Navigation):
         if self._meta.location == IN_MEMORY:
             return
         meta = self._meta
+        #****** Andreas: records and header are written when the batch ends
+        if meta.journal is not None:
+            return
         header = meta.header
         fd = meta.dfd
         fd.seek(0)
@@ -5408,6 +5874,8 @@ class Table(_Navigation):
                 raise DbfError("field list must be specified for memory tables")
         self._indexen = self._Indexen()
         self._meta = meta = self._MetaData()
+        #****** Andreas: record caching is opt-in, see set_record_cache()
+        meta.record_cache = None
         meta.max_fields = self._max_fields
         meta.max_records = self._max_records
         meta.table = weakref.ref(self)
@@ -5650,6 +6118,8 @@ class Table(_Navigation):
             raise DbfError('%s not in read/write mode, unable to change codepage' % meta.filename)
         cp, sd, ld = _codepage_lookup(meta.header.codepage(codepage.code))
         meta.decoder, meta.encoder = unicode_error_handler(codecs.getdecoder(sd), codecs.getencoder(sd), meta.unicode_errors)
+        #****** Andreas: character decoders hold on to the old decoder
+        meta.decoders = None
         self._update_disk(headeronly=True)
 
     @property
@@ -5687,6 +6157,14 @@ class Table(_Navigation):
         """
         return self._meta.memoname
 
+    #****** Andreas: record cache
+    @property
+    def record_cache(self):
+        """
+        cache of raw record data (None if disabled); see set_record_cache
+        """
+        return self._meta.record_cache
+
     @property
     def record_length(self):
         """
@@ -5785,6 +6263,8 @@ class Table(_Navigation):
                 raise FieldSpecError('bad field spec: %r' % field)
             if field_seq >= original_fields and (name[0] == '_' or name[0].isdigit() or not name.replace('_', '').isalnum()):
                 # find appropriate line to point warning to
+                #****** Andreas: traceback is only imported when needed
+                import traceback
                 for i, frame in enumerate(reversed(traceback.extract_stack()), start=1):
                     if frame[0] == __file__ and frame[2] == 'resize_field':
                         # ignore
@@ -5834,12 +6314,40 @@ class Table(_Navigation):
                 self.append(scatter(record))
             old_table.close()
 
+    #****** Andreas: added computed fields:
+    def add_computed_field(self, field_spec, func, fields=None):
+        """
+        adds one field (format as for add_fields) whose values are
+        func(columns), where columns is to_numpy(fields); func returns one
+        value per record, e.g.:
+            lambda cols: np.char.add(cols['STATEFP'], cols['COUNTYFP'])
+        unlike add_fields followed by per-record updates, the table is
+        rewritten once; returns the number of records filled
+        """
+        from ._columnar import add_computed_field
+        return add_computed_field(self, field_spec, func, fields)
+    #****** Andreas: END added computed fields
+
     def allow_nulls(self, fields):
         """
         set fields to allow null values -- NO LONGER ALLOWED, MUST BE SET AT TABLE CREATION
         """
         raise DbfError('fields can only be set to allow NULLs at table creation')
 
+    #****** Andreas: added bulk append:
+    def append_many(self, data, drop=False):
+        """
+        appends one record per row of data -- a pandas DataFrame, a numpy
+        structured array, or a dict of field name: sequence of values;
+        fields not in data are left blank, columns not in the table raise
+        unless drop is True; each column is encoded in one step, and the
+        records are written with one write and one header update;
+        returns the number of records appended
+        """
+        from ._columnar import append_columns
+        return append_columns(self, data, drop)
+    #****** Andreas: END added bulk append
+
     def append(self, data=b'', drop=False, multiple=1):
         """
         adds <multiple> blank records, and fills fields with dict/tuple values if present
@@ -5929,6 +6437,12 @@ class Table(_Navigation):
         """
         if self._meta.location == ON_DISK and self._meta.status != CLOSED:
             self._table.flush()
+            #****** Andreas: save changed persistent indexes:
+            for dbfindex in self._indexen:
+                if hasattr(dbfindex, '_close'):
+                    dbfindex._close()
+            if self._meta.record_cache is not None:
+                self._meta.record_cache.clear()
             if self._meta.mfd is not None:
                 self._meta.mfd.close()
                 self._meta.mfd = None
@@ -5974,13 +6488,24 @@ class Table(_Navigation):
             self.close()
         return bkup
 
-    def create_index(self, key):
+    def create_index(self, key, persistent=False):
         """
-        creates an in-memory index using the function key
+        creates an in-memory index using the function key, or on the
+        field(s) named in key (e.g. 'STATEFP' or 'STATEFP, COUNTYFP');
+        an index on one character, numeric, or date field is array-backed,
+        and, if persistent, saved next to the table for reuse
         """
         meta = self._meta
         if meta.status == CLOSED:
             raise DbfError('%s is closed' % meta.filename)
+        #****** Andreas: indexes on named fields:
+        if isinstance(key, basestring):
+            from ._array_index import ArrayIndex, supports
+            if supports(self, key):
+                return ArrayIndex(self, key, persistent=persistent)
+            key = _field_key(self, key)
+        if persistent:
+            raise DbfError('only indexes on one character, numeric, or date field can be persistent')
         return Index(self, key)
 
     def create_template(self, record=None, defaults=None):
@@ -6149,9 +6674,13 @@ class Table(_Navigation):
             return self
         if '_table' in dir(self):
             del self._table
+        #****** Andreas: the file may have changed since the table was last open
+        if meta.record_cache is not None:
+            meta.record_cache.clear()
         mode = ('rb', 'r+b')[meta.status is READ_WRITE]
         dfd = meta.dfd = open(meta.filename, mode)
         dfd.seek(0)
+        old_header = meta.header
         header = meta.header = self._TableHeader(dfd.read(32), self._pack_date, self._unpack_date)
         if not header.version in self._supported_tables:
             dfd.close()
@@ -6169,7 +6698,13 @@ class Table(_Navigation):
         header.fields = fieldblock[:fieldend]
         header.extra = fieldblock[fieldend + 1:]  # skip trailing \r
         self._meta.ignorememos = self._meta.original_ignorememos
-        self._initialize_fields()
+        #****** Andreas: the fields are only parsed again if the file's
+        # field definitions differ from the ones parsed last
+        if (old_header is None or not meta.fields
+                or old_header.fields != header.fields
+                or old_header.record_length != header.record_length
+                or old_header.codepage() != header.codepage()):
+            self._initialize_fields()
         self._check_memo_integrity()
         self._index = -1
         dfd.seek(0)
@@ -6182,6 +6717,13 @@ class Table(_Navigation):
         meta = self._meta
         if meta.status != READ_WRITE:
             raise DbfError('%s not in read/write mode, unable to pack records' % meta.filename)
+        #****** Andreas: one pass over the deletion flags; indexes are remapped, not rebuilt
+        from ._columnar import np as numpy
+        if numpy is not None:
+            from ._columnar import pack_records
+            pack_records(self)
+            return
+        #****** Andreas: END one pass pack
         for dbfindex in self._indexen:
             dbfindex._clear()
         newtable = []
@@ -6290,6 +6832,19 @@ class Table(_Navigation):
                 self.append(scatter(record), drop=True)
             old_table.close()
 
+    #****** Andreas: record cache
+    def set_record_cache(self, cache):
+        """
+        replaces the cache of raw record data; cache is None (no caching,
+        the default) or an object with the methods of RecordCache, e.g.
+        RecordCache(); cached records are only refreshed by writes through
+        this table, so only cache tables that no other Table object or
+        process rewrites while they are open
+        """
+        if self._meta.location == ON_DISK and self._meta.status != CLOSED:
+            self._table._next_read = 0
+        self._meta.record_cache = cache
+
     def structure(self, fields=None):
         """
         return field specification list suitable for creating same table layout
@@ -6304,6 +6859,63 @@ class Table(_Navigation):
             raise DbfError("field %s does not exist" % name).from_exc(None)
         return field_specs
 
+    #****** Andreas: added bulk column access:
+    def batch(self, fsync=False):
+        """
+        returns a context manager for bulk record edits: inside the with
+        block, records changed (with record as r: ...) or appended are kept
+        in memory, and are written when the block ends, one write per run
+        of consecutive records, with one header update; fsync=True also
+        waits for the data to reach the disk; if the block raises, the
+        changes are discarded (memos already written stay in the memo file)
+        """
+        return RecordJournal(self, fsync)
+
+    def to_dataframe(self, fields=None, skip_deleted=False, categorical=False, nullable=False):
+        """
+        returns the records as a pandas DataFrame indexed by record number,
+        one column per field; see to_numpy() for the column types; repeated
+        values of character fields share one str, or, if categorical is
+        True, character fields are pandas Categoricals; if nullable is True,
+        numeric and logical fields have pandas' nullable dtypes (Int64,
+        Float64, boolean), with blank and Null values as NA
+        """
+        from ._columnar import table_frame
+        return table_frame(self, fields, skip_deleted, categorical, nullable)
+
+    def to_numpy(self, fields=None, skip_deleted=False, masked=False):
+        """
+        returns {field_name: numpy array} for fields (default: all), decoding
+        each column at once from a memory map of the record block instead of
+        building a Record per row; skip_deleted leaves out deleted records;
+        blank and Null values are NaN, NaT, or None, or, if masked is True,
+        the arrays are numpy masked arrays of the decoded type, masked there
+        """
+        from ._columnar import table_columns
+        record_numbers, columns = table_columns(self, fields, skip_deleted, masked)
+        return columns
+
+    def where(self, criteria, mask=False):
+        """
+        returns a numpy array of the record numbers matching criteria (the
+        part of a pql command after 'where', e.g. "votes > 100 and
+        statefp == '06'"), or a boolean mask over all records if mask is
+        True; criteria are evaluated a column at a time, and comparisons
+        of fields with constants use indexes from create_index('FIELD')
+        """
+        from ._query import select_records
+        return select_records(self, criteria, mask)
+
+    def write_columns(self, data, start=0):
+        """
+        overwrites fields of existing records in place, starting at record
+        number start; data is as for append_many(), and only the fields in
+        data are changed; returns the number of records written
+        """
+        from ._columnar import write_columns
+        return write_columns(self, data, start)
+    #****** Andreas: END added bulk column access
+
     def zap(self):
         """
         removes all records from table -- this cannot be undone!
@@ -6311,6 +6923,10 @@ class Table(_Navigation):
         meta = self._meta
         if meta.status != READ_WRITE:
             raise DbfError('%s not in read/write mode, unable to zap table' % meta.filename)
+        #****** Andreas: indexes would otherwise still point at the removed records
+        for dbfindex in self._indexen:
+            dbfindex._clear()
+        #****** Andreas: END clear indexes
         if meta.location == IN_MEMORY:
             self._table[:] = []
         else:
@@ -7427,6 +8043,8 @@ class Index(_Navigation):
         self._records = {}            # record numbers:values
         self.__doc__ = key.__doc__ or 'unknown'
         self._key = key
+        #****** Andreas: names of indexed fields, if the key is a _field_key()
+        self.fields = getattr(key, 'fields', None)
         self._previous_status = []
         for record in table:
             value = key(record)
@@ -7570,6 +8188,24 @@ class Index(_Navigation):
         for record in self._table:
             self(record)
 
+    #****** Andreas: renumber entries after a pack instead of reindexing
+    def _remap(self, translation):
+        """
+        translation holds the new number of each old record, -1 if the
+        record was removed; key order is unchanged
+        """
+        translation = translation.tolist()
+        values, rec_by_val = [], []
+        for value, rec_num in zip(self._values, self._rec_by_val):
+            rec_num = translation[rec_num]
+            if rec_num >= 0:
+                values.append(value)
+                rec_by_val.append(rec_num)
+        self._values[:] = values
+        self._rec_by_val[:] = rec_by_val
+        self._records = dict(zip(rec_by_val, values))
+    #****** Andreas: END renumber entries
+
     def _search(self, match, lo=0, hi=None, where=None):
         if hi is None:
             hi = len(self._values)
@@ -7636,6 +8272,28 @@ class Index(_Navigation):
         self._nav_check()
         return pql(self, criteria)
 
+    #****** Andreas: added range search:
+    def search_range(self, low=None, high=None, include_low=True, include_high=True):
+        """
+        returns the record numbers, in key order, of keys between low and
+        high (None for unbounded); keys are compared as tuples
+        """
+        self._nav_check()
+        if low is not None and not isinstance(low, tuple):
+            low = (low, )
+        if high is not None and not isinstance(high, tuple):
+            high = (high, )
+        if low is None:
+            lo = 0
+        else:
+            lo = self._search(low, where=('right', 'left')[include_low])
+        if high is None:
+            hi = len(self._values)
+        else:
+            hi = self._search(high, where=('left', 'right')[include_high])
+        return self._rec_by_val[lo:hi]
+    #****** Andreas: END added range search
+
     def search(self, match, partial=False):
         """
         returns dbf.List of all (partially) matching records
@@ -7659,6 +8317,20 @@ class Index(_Navigation):
         return result
 
 
+#****** Andreas: key functions for indexes on named fields
+def _field_key(table, fields):
+    """
+    returns a key function for Index that returns the values of the named
+    fields; the field names are available as key.fields
+    """
+    names = table._list_fields(fields)
+    def key(record):
+        return tuple(record[name] for name in names)
+    key.fields = tuple(name.upper() for name in names)
+    key.__doc__ = ', '.join(key.fields)
+    return key
+
+
 class Relation(object):
     """
     establishes a relation between two dbf tables (not persistent)
@@ -7799,6 +8471,28 @@ class Relation(object):
             yo._tables[yo._tgt_table] = 'one'
         return yo.index
 
+    #****** Andreas: set-oriented joins
+    def join(yo, src_records=None, how='inner', validate=None):
+        """
+        returns (source record numbers, target record numbers), aligned
+        numpy arrays of the matching records of src_records (records or
+        record numbers; default: all source records), found with one hash
+        join over the key columns; how='left' keeps source records without
+        a match, paired with -1; validate is None, '1:1', '1:n', or 'n:1'
+        """
+        from ._join import join_records
+        return join_records(yo, src_records, how, validate)
+
+    def join_frame(yo, src_records=None, src_fields=None, tgt_fields=None, how='inner', validate=None):
+        """
+        returns the records matched by join() as a pandas DataFrame of
+        src_fields and tgt_fields (default: all), indexed by
+        (src_recno, tgt_recno)
+        """
+        from ._join import join_frame
+        return join_frame(yo, src_records, src_fields, tgt_fields, how, validate)
+    #****** Andreas: END set-oriented joins
+
     def one_or_many(yo, table):
         yo.index    # make sure yo._tables has been populated
         try:
@@ -7983,9 +8677,10 @@ class LruCache(object):
     """
 
     class Link(object):
-        __slots__ = 'prev_link', 'next_link', 'key', 'value'
-        def __init__(self, prev=None, next=None, key=None, value=None):
-            self.prev_link, self.next_link, self.key, self.value = prev, next, key, value
+        #****** Andreas: size of the value, for byte-bounded caches
+        __slots__ = 'prev_link', 'next_link', 'key', 'value', 'size'
+        def __init__(self, prev=None, next=None, key=None, value=None, size=0):
+            self.prev_link, self.next_link, self.key, self.value, self.size = prev, next, key, value, size
 
         def __iter__(self):
             return iter((self.prev_link, self.next_link, self.key, self.value))
@@ -7996,8 +8691,12 @@ class LruCache(object):
                 value = value[:12] + '...'
             return 'Link<key=%r, value=%r>' % (self.key, value)
 
-    def __init__(self, maxsize, func=None):
+    #****** Andreas: optional byte limit; values are measured with sizeof
+    def __init__(self, maxsize, func=None, maxbytes=None, sizeof=len):
         self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.nbytes = 0
         self.mapping = {}
         self.tail = self.Link()                      # oldest
         self.head = self.Link(self.tail)             # newest
@@ -8013,20 +8712,45 @@ class LruCache(object):
             self.__name__ = func.__name__
             self.__doc__ = func.__doc__
             return self
+        return self.get(func, self.func)
+
+    def __len__(self):
+        return len(self.mapping)
+
+    def clear(self):
+        """
+        removes all items
+        """
+        self.mapping.clear()
+        self.tail.next_link = self.head
+        self.head.prev_link = self.tail
+        self.nbytes = 0
+
+    def get(self, key, func):
+        """
+        returns the value cached for key, calling func(*key) to get it
+        if it is not cached
+        """
         mapping, head, tail = self.mapping, self.head, self.tail
-        link = mapping.get(func, head)
+        link = mapping.get(key, head)
         if link is head:
-            value = self.func(*func)
-            if len(mapping) >= self.maxsize:
-                old_prev, old_next, old_key, old_value = tail.next_link
-                tail.next_link = old_next
-                old_next.prev_link = tail
-                del mapping[old_key]
+            value = func(*key)
+            size = 0 if self.maxbytes is None else self.sizeof(value)
+            while mapping and (
+                    self.maxsize is not None and len(mapping) >= self.maxsize
+                    or self.maxbytes is not None and self.nbytes + size > self.maxbytes
+                    ):
+                oldest = tail.next_link
+                tail.next_link = oldest.next_link
+                oldest.next_link.prev_link = tail
+                del mapping[oldest.key]
+                self.nbytes -= oldest.size
             behind = head.prev_link
-            link = self.Link(behind, head, func, value)
-            mapping[func] = behind.next_link = head.prev_link = link
+            link = self.Link(behind, head, key, value, size)
+            mapping[key] = behind.next_link = head.prev_link = link
+            self.nbytes += size
         else:
-            link_prev, link_next, func, value = link
+            link_prev, link_next, key, value = link
             link_prev.next_link = link_next
             link_next.prev_link = link_prev
             behind = head.prev_link
@@ -8034,12 +8758,22 @@ class LruCache(object):
             link.prev_link = behind
             link.next_link = head
         return value
+    #****** Andreas: END optional byte limit
 
 
 class Idx(object):
     # default numeric storage is little-endian
     # numbers used as key values, and the 4-byte numbers in leaf nodes are big-endian
 
+    #****** Andreas: the index file is mapped once, nodes are decoded with
+    # struct.unpack_from, and kept in a byte-bounded cache shared by all Idx
+    # instances; ordered scans read the records of a batch of keys in file order
+
+    # nodes of all index files; replace (or resize with set_node_cache) before
+    # opening indexes
+    node_cache = LruCache(maxsize=None, maxbytes=4 * 1024 * 1024, sizeof=lambda node: node.nbytes)
+    batch_size = 1024
+
     @DataBlock(512)
     class Header(object):
         root_node = Int32(0)
@@ -8051,19 +8785,33 @@ class Idx(object):
         key_expr = Bytes(16, 220, strip_null=True)
         for_expr = Bytes(236, 220, strip_null=True)
 
-    @DataBlock(512)
+    class Key(object):
+        __slots__ = 'key', 'rec_no'
+        def __init__(self, key, rec_no):
+            self.key = key
+            self.rec_no = rec_no
+        def __repr__(self):
+            return 'Key(key=%r, rec_no=%r)' % (self.key, self.rec_no)
+
     class Node(object):
-        attributes = Int16(0)
-        num_keys = Int16(2)
-        left_peer = Int32(4, neg_one_is_none=True)
-        right_peer = Int32(8, neg_one_is_none=True)
-        pool = Bytes(12, fill_to=512)
-        def __init__(self, byte_data, node_key, record_key):
-            if len(byte_data) != 512:
-                raise DbfError("incomplete header: only received %d bytes" % len(byte_data))
-            self._data = byte_data
-            self._node_key = node_key
-            self._record_key = record_key
+        # attributes, num_keys, left_peer, right_peer
+        layout = struct.Struct('<hhll')
+        size = 512
+        __slots__ = 'attributes', 'num_keys', 'left_peer', 'right_peer', '_keys', 'nbytes'
+        def __init__(self, byte_data, offset, key_struct):
+            if len(byte_data) < offset + self.size:
+                raise DbfError("incomplete node: only received %d bytes" % (len(byte_data) - offset))
+            attributes, num_keys, left_peer, right_peer = self.layout.unpack_from(byte_data, offset)
+            self.attributes = attributes
+            self.num_keys = num_keys
+            self.left_peer = None if left_peer == -1 else left_peer
+            self.right_peer = None if right_peer == -1 else right_peer
+            # leaf nodes store record numbers one based
+            base = 1 if self.is_leaf() else 0
+            start = offset + self.layout.size
+            pool = memoryview(byte_data)[start:start + num_keys * key_struct.size]
+            self._keys = [Idx.Key(key, rec_no - base) for key, rec_no in key_struct.iter_unpack(pool)]
+            self.nbytes = self.size + num_keys * (key_struct.size + 72)
         def is_leaf(self):
             return self.attributes in (2, 3)
         def is_root(self):
@@ -8071,96 +8819,107 @@ class Idx(object):
         def is_interior(self):
             return self.attributes in (0, 1)
         def keys(self):
-            result = []
-            if self.is_leaf():
-                key = self._record_key
-            else:
-                key = self._node_key
-            key_len = key._size_
-            for i in range(self.num_keys):
-                start = i * key_len
-                end = start + key_len
-                result.append(key(self.pool[start:end]))
-            return result
+            return self._keys
 
-    def __init__(self, table, filename, size_limit=100):
+    def __init__(self, table, filename, size_limit=None):
         self.table = weakref.ref(table)
         self.filename = filename
-        self.limit = size_limit
         with open(filename, 'rb') as idx:
             self.header = header = self.Header(idx.read(512))
-            # offset = 512
-            @DataBlock(header.key_length+4)
-            class NodeKey(object):
-                key = Bytes(0, header.key_length)
-                rec_no = Int32(header.key_length, big_endian=True)
-            @DataBlock(header.key_length+4)
-            class RecordKey(object):
-                key = Bytes(0, header.key_length)
-                rec_no = Int32(header.key_length, big_endian=True, one_based=True)
-            self.NodeKey = NodeKey
-            self.RecordKey = RecordKey
-            # set up root node
-            idx.seek(header.root_node)
-            self.root_node = self.Node(idx.read(512), self.NodeKey, self.RecordKey)
-        # set up node reader
-        self.read_node = LruCache(maxsize=size_limit, func=self.read_node)
+            status = os.fstat(idx.fileno())
+            self._map = mmap.mmap(idx.fileno(), 0, access=mmap.ACCESS_READ)
+        # identifies the file contents in the shared cache
+        self._file_key = (os.path.realpath(filename), status.st_size, status.st_mtime_ns)
+        self._key_struct = struct.Struct('>%dsL' % header.key_length)
+        # a size limit gives this index its own cache of size_limit nodes
+        self._cache = self.node_cache
+        if size_limit is not None:
+            self._cache = LruCache(maxsize=size_limit)
+        self.root_node = self.read_node(header.root_node)
         # set up iterating members
         self.current_node = None
         self.current_key = None
 
+    @classmethod
+    def set_node_cache(cls, maxbytes):
+        """
+        replaces the node cache shared by indexes opened from now on
+        """
+        cls.node_cache = LruCache(maxsize=None, maxbytes=maxbytes, sizeof=lambda node: node.nbytes)
+
     def __iter__(self):
-        # find the first leaf node
         table = self.table()
         if table is None:
             raise DbfError('the database linked to %r has been closed' % self.filename)
+        for batch in self.rec_no_batches():
+            for record in self._read_records(table, batch):
+                yield record
+    forward = __iter__
+
+    def _decode_node(self, file_key, offset):
+        return self.Node(self._map, offset, self._key_struct)
+
+    def _leaf_nodes(self, reverse=False):
+        """
+        yields the leaf nodes in key order
+        """
         node = self.root_node
         if not node.num_keys:
-            yield
             return
+        first = (0, -1)[reverse]
         while "looking for a leaf":
-            # travel the links down to the first leaf node
+            # travel the links down to the first (last) leaf node
             if node.is_leaf():
                 break
-            node = self.read_node(node.keys()[0].rec_no)
+            node = self.read_node(node.keys()[first].rec_no)
         while "traversing nodes":
-            for key in node.keys():
-                yield table[key.rec_no]
-            next_node = node.right_peer
+            yield node
+            next_node = (node.right_peer, node.left_peer)[reverse]
             if next_node is None:
                 return
             node = self.read_node(next_node)
-    forward = __iter__
+
+    def _read_records(self, table, batch):
+        """
+        returns the records of batch, read in record number order
+        """
+        records = dict((rec_no, table[rec_no]) for rec_no in sorted(set(batch)))
+        return [records[rec_no] for rec_no in batch]
+
+    def close(self):
+        self._map.close()
 
     def read_node(self, offset):
         """
         reads the sector indicated, and returns a Node object
         """
-        with open(self.filename, 'rb') as idx:
-            idx.seek(offset)
-            return self.Node(idx.read(512), self.NodeKey, self.RecordKey)
+        return self._cache.get((self._file_key, offset), self._decode_node)
+
+    def rec_no_batches(self, reverse=False, batch_size=None):
+        """
+        yields lists of up to batch_size record numbers in key order
+        """
+        batch_size = batch_size or self.batch_size
+        batch = []
+        for node in self._leaf_nodes(reverse):
+            keys = node.keys()
+            if reverse:
+                keys = reversed(keys)
+            batch.extend(key.rec_no for key in keys)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
 
     def backward(self):
-        # find the last leaf node
         table = self.table()
         if table is None:
             raise DbfError('the database linked to %r has been closed' % self.filename)
-        node = self.root_node
-        if not node.num_keys:
-            yield
-            return
-        while "looking for last leaf":
-            # travel the links down to the last leaf node
-            if node.is_leaf():
-                break
-            node = self.read_node(node.keys()[-1].rec_no)
-        while "traversing nodes":
-            for key in reversed(node.keys()):
-                yield table[key.rec_no]
-            prev_node = node.left_peer
-            if prev_node is None:
-                return
-            node = self.read_node(prev_node)
+        for batch in self.rec_no_batches(reverse=True):
+            for record in self._read_records(table, batch):
+                yield record
+    #****** Andreas: END mapped index file
 
 
 # table meta
@@ -8589,6 +9348,14 @@ class _Db4Table(Table):
 
 # utility functions
 
+#****** Andreas: all field values of a record in one pass
+def as_tuple(record):
+    """
+    returns the values of all fields of record as a tuple
+    """
+    return tuple(record)
+#****** Andreas: END as_tuple
+
 def create_template(table_or_record, defaults=None):
     if isinstance(table_or_record, Table):
         return RecordTemplate(table_or_record._meta, defaults)
@@ -8621,14 +9388,22 @@ def ensure_unicode(value):
         value = value.decode(input_decoding)
     return value
 
-def export(table_or_records, filename=None, field_names=None, format='csv', header=True, dialect='dbf', encoding=None):
+def export(table_or_records, filename=None, field_names=None, format='csv', header=True, dialect='dbf', encoding=None,
+           chunk_size=65536):
     """
-    writes the records using CSV or tab-delimited format, using the filename
-    given if specified, otherwise the table name
+    writes the records using CSV, tab-delimited, fixed, Parquet, or Feather
+    format, using the filename given if specified, otherwise the table name
     if table_or_records is a collection of records (not an actual table) they
     should all be of the same format
+    records of one table are exported chunk_size records at a time by the
+    columnar reader (requires numpy, and pandas or pyarrow); blank values are
+    written as empty fields (nulls), and trailing padding is removed
     """
-    table = source_table(table_or_records[0])
+    #****** Andreas: bulk export, and Parquet and Feather formats
+    if isinstance(table_or_records, Table):
+        table = table_or_records
+    else:
+        table = source_table(table_or_records[0])
     if filename is None:
         filename = table.filename
     if field_names is None:
@@ -8636,10 +9411,29 @@ def export(table_or_records, filename=None, field_names=None, format='csv', head
     if isinstance(field_names, basestring):
         field_names = [f.strip() for f in field_names.split(',')]
     format = format.lower()
-    if format not in ('csv', 'tab', 'fixed'):
-        raise DbfError("export format: csv, tab, or fixed -- not %s" % format)
+    if format not in ('csv', 'tab', 'fixed', 'parquet', 'feather'):
+        raise DbfError("export format: csv, tab, fixed, parquet, or feather -- not %s" % format)
     if format == 'fixed':
         format = 'txt'
+    if format != 'txt':
+        from ._columnar import export_columns, np as numpy
+        record_numbers = None
+        if table_or_records is not table:
+            if all(source_table(record) is table for record in table_or_records):
+                record_numbers = [recno(record) for record in table_or_records]
+            elif format in ('parquet', 'feather'):
+                raise DbfError('%s export needs records of a single table' % format)
+        if numpy is not None and (table_or_records is table or record_numbers is not None):
+            base, ext = os.path.splitext(filename)
+            if ext.lower() in ('', '.dbf'):
+                filename = base + "." + format
+            return export_columns(
+                    table, filename, field_names, format=format, header=header, dialect=dialect,
+                    encoding=encoding, record_numbers=record_numbers, chunk_size=chunk_size,
+                    )
+        elif format in ('parquet', 'feather'):
+            raise DbfError('numpy is required for %s export' % format)
+    #****** Andreas: END bulk export
     if encoding is None:
         encoding = table.codepage.name
     encoder = codecs.getencoder(encoding)
@@ -8774,6 +9568,15 @@ def undelete(record):
         raise
     if not template and not record_in_flux:
         record._commit_flux()
+#****** Andreas: all field values of a record in one pass
+def values(record):
+    """
+    returns the values of all fields of record as a list, decoded with
+    the table's compiled field decoders
+    """
+    return list(record)
+#****** Andreas: END values
+
 def write(record, **kwargs):
     """
     write record data to disk (updates indices)
@@ -8814,6 +9617,45 @@ def Process(records, start=0, stop=None, filter=None):
         if not already_open:
             records.close()
 
+#****** Andreas: sharded scans in worker processes
+def parallel_map(table, func, workers=None, skip_deleted=False):
+    """
+    returns [func(record)] for all records of table, in record order; the
+    records are split into one contiguous shard per worker process (default:
+    one per cpu), and each worker reads its shard from a memory map of the
+    file; func must be picklable (a module level function), and the records
+    it gets are read-only
+    """
+    from ._parallel import parallel_map
+    return parallel_map(table, func, workers, skip_deleted)
+
+def parallel_query(table, criteria, workers=None, mask=False):
+    """
+    as table.where(criteria, mask), with the records split into one
+    contiguous shard per worker process (default: one per cpu); indexes
+    are not used
+    """
+    from ._parallel import parallel_query
+    return parallel_query(table, criteria, workers, mask)
+#****** Andreas: END sharded scans
+
+#****** Andreas: record sets as record number arrays
+def record_set(records=None, record_numbers=None, desc=None):
+    """
+    returns a RecordSet of records (a table, List, RecordSet, or iterable
+    of records), or of the record_numbers (or boolean mask) of the table
+    records, e.g. from table.where(criteria); a RecordSet keeps sorted
+    record numbers per table, and &, |, and - are computed on those
+    numbers; records are read when iterated over
+    """
+    from ._record_set import RecordSet
+    if record_numbers is not None:
+        if not isinstance(records, Table):
+            raise DbfError('record numbers need a table, not %r' % (records, ))
+        return RecordSet.from_numbers(records, record_numbers, desc)
+    return RecordSet(records, desc)
+#****** Andreas: END record sets
+
 def Templates(records, start=0, stop=None, filter=None):
     """
     returns a template of each record instead of the record itself
@@ -8924,14 +9766,30 @@ def first_record(table_name):
 
 def from_csv(csvfile, to_disk=False, filename=None, field_names=None, extra_fields=None,
         dbf_type='db3', memo_size=64, min_field_size=1,
-        encoding=None, errors=None):
+        encoding=None, errors=None, header=False, sample_rows=None, chunk_size=65536):
     """
-    creates a Character table from a csv file
+    creates a table from a csv file
     to_disk will create a table with the same name
     filename will be used if provided
-    field_names default to f0, f1, f2, etc, unless specified (list)
+    field_names default to f0, f1, f2, etc, unless specified (list), or
+      taken from the first row if header is True
+    fields named without a type are Logical, Date, Numeric, Character, or Memo,
+      as inferred from the first sample_rows rows (default: all rows); rows are
+      appended chunk_size at a time (requires numpy and pandas; without them
+      all fields are Memo fields)
     extra_fields can be used to add additional fields -- should be normal field specifiers (list)
     """
+    #****** Andreas: streaming import with inferred field types
+    from ._columnar import np as numpy
+    if numpy is not None:
+        from ._csv_import import import_csv
+        return import_csv(
+                csvfile, filename=filename, to_disk=to_disk, field_names=field_names,
+                extra_fields=extra_fields, dbf_type=dbf_type, memo_size=memo_size,
+                min_field_size=min_field_size, encoding=encoding, errors=errors,
+                header=header, sample_rows=sample_rows, chunk_size=chunk_size,
+                )
+    #****** Andreas: END streaming import
     with codecs.open(csvfile, 'r', encoding='latin-1', errors=errors) as fd:
         reader = csv.reader(fd)
         if field_names:
@@ -9091,7 +9949,8 @@ class fake_module(object):
 api = fake_module('api',
     'Table', 'Record', 'List', 'Index', 'Relation', 'Iter', 'Null', 'Char', 'Date', 'DateTime', 'Time',
     'Logical', 'Quantum', 'CodePage', 'create_template', 'delete', 'field_names', 'gather', 'is_deleted',
-    'recno', 'source_table', 'reset', 'scatter', 'undelete',
+    'recno', 'source_table', 'reset', 'scatter', 'undelete', 'as_tuple', 'values',
+    'parallel_map', 'parallel_query', 'record_set',
     'NullDate', 'NullDateTime', 'NullTime', 'NoneType', 'NullType', 'Decimal', 'Vapor', 'Period',
     'Truth', 'Falsth', 'Unknown', 'On', 'Off', 'Other',
     'DbfError', 'DataOverflowError', 'BadDataError', 'FieldMissingError',
@@ -0,0 +1,426 @@
+"""
+array-backed index on one field of a table
+
+dbf.Index keeps its keys in Python lists and inserts one record at a
+time, which takes quadratic time for large tables.  An ArrayIndex
+reads the key column with the columnar reader, sorts it once with
+np.argsort, and keeps the sorted keys and their record numbers in two
+NumPy arrays:
+
+    with table:
+        by_fips = table.create_index('FULL_FIPS', persistent=True)
+        by_fips.search('06001')
+        by_fips.search_range('06', '07', include_high=False)
+
+Keys are the decoded column values: Character keys without trailing
+padding, Numeric, Float, Integer, Double, and Currency keys as float64
+(blanks are NaN), and Date keys as datetime64[D] (blanks are NaT).
+Search values are converted the same way, so padded and unpadded
+strings find the same records.
+
+Changes to records reach the index through the usual index(record)
+call; they are collected in a delta buffer and merged into the arrays
+the next time the index is read, or when the buffer grows past
+MAX_DELTA entries.  Table.pack() renumbers the entries without
+reading the table again.
+
+A persistent index is saved next to the table as <table>.<field>.npz,
+stamped with the record count, size, and modification time of the
+table file; creating the index again on an unchanged table loads the
+arrays instead of reading the table.  The sidecar is written when the
+index is created or rebuilt, on save(), and when the table is closed.
+"""
+from __future__ import print_function
+
+import os
+
+from ._columnar import decode_column, fill_missing, np, record_block, record_layout, require_numpy, resolve_fields
+from . import (
+        BINARY, CHAR, CLOSED, CURRENCY, DATE, DOUBLE, FLAGS, FLOAT, INTEGER, LENGTH, NUMERIC, ON_DISK,
+        READ_WRITE, START, DECIMALS, TYPE,
+        DbfError, Index, IndexLocation, List, NotFoundError, Record, RecordTemplate,
+        _field_key, baseinteger, basestring, recno,
+        )
+
+MAX_DELTA = 4096
+SIDECAR_VERSION = 1
+numeric_types = (CURRENCY, DOUBLE, FLOAT, INTEGER, NUMERIC)
+
+
+def key_dtype(fielddef):
+    """
+    Returns the dtype of the keys of an index on fielddef, or None if
+    ArrayIndex does not support the field type
+    """
+    field_type = fielddef[TYPE]
+    if field_type == CHAR and not fielddef[FLAGS] & BINARY:
+        return np.dtype('U%d' % fielddef[LENGTH])
+    elif field_type in numeric_types:
+        return np.dtype(np.float64)
+    elif field_type == DATE:
+        return np.dtype('M8[D]')
+    return None
+
+def supports(table, fields):
+    """
+    Returns True if fields names a single field an ArrayIndex can index
+    """
+    if np is None:
+        return False
+    try:
+        names = resolve_fields(table, fields)
+    except DbfError:
+        return False
+    return len(names) == 1 and key_dtype(table._meta[names[0]]) is not None
+
+def sidecar_name(table, name):
+    return '%s.%s.npz' % (os.path.splitext(table._meta.filename)[0], name.lower())
+
+
+class ArrayIndex(Index):
+    """
+    index on one field, kept in sorted NumPy arrays
+    """
+
+    def __init__(self, table, field, persistent=False):
+        require_numpy()
+        meta = table._meta
+        name, = resolve_fields(table, field)
+        fielddef = meta[name]
+        dtype = key_dtype(fielddef)
+        if dtype is None:
+            raise DbfError('field %s: ArrayIndex does not support this field type' % name)
+        if persistent and meta.location != ON_DISK:
+            raise DbfError('in-memory table %s cannot have a persistent index' % meta.filename)
+        self._table = table
+        self._name = name
+        self._fielddef = fielddef
+        self._layout = record_layout(meta, [name])
+        self._dtype = dtype
+        self._persistent = persistent
+        self._delta = {}              # record number: key, or None once purged
+        self._dirty = False           # arrays differ from the sidecar
+        # key(record), as used by Index, is the record's value of the field
+        self._key = _field_key(table, name)
+        self.fields = self._key.fields
+        self.__doc__ = name
+        self._previous_status = []
+        if not (persistent and self._load()):
+            self._build()
+        table._indexen.add(self)
+
+    def __call__(self, record):
+        self._delta[recno(record)] = self._decode(np.frombuffer(record._data, dtype=self._layout))[0]
+        if len(self._delta) > MAX_DELTA:
+            self._merge()
+
+    def __contains__(self, data):
+        if not isinstance(data, (Record, RecordTemplate, tuple, dict)):
+            raise TypeError("%r is not a record, templace, tuple, nor dict" % (data, ))
+        try:
+            value = self._as_key(self.key(data))
+        except Exception:
+            return Index.__contains__(self, data)
+        lo = self._search(value, where='left')
+        return lo < len(self._keys) and self._keys[lo] == value
+
+    def __getitem__(self, key):
+        '''if key is an integer, returns the matching record;
+        if key is a [slice | string | tuple | record] returns a List;
+        raises NotFoundError on failure'''
+        self._merge()
+        if isinstance(key, baseinteger):
+            count = len(self._keys)
+            if not -count <= key < count:
+                raise NotFoundError("Record %d is not in list." % key)
+            return self._table[int(self._rec_nos[key])]
+        elif isinstance(key, slice):
+            return self._list(self._rec_nos[key])
+        elif isinstance(key, (basestring, tuple, Record, RecordTemplate)):
+            if isinstance(key, (Record, RecordTemplate)):
+                key = self.key(key)
+            value = self._as_key(key)
+            lo = self._search(value, where='left')
+            hi = self._search(value, where='right')
+            if lo == hi:
+                raise NotFoundError(key)
+            return self._list(self._rec_nos[lo:hi], desc='match = %r' % (key, ))
+        else:
+            raise TypeError('indices must be integers, match objects must by strings or tuples')
+
+    def __len__(self):
+        self._merge()
+        return len(self._keys)
+
+    def _as_key(self, value):
+        """
+        returns value converted to the key dtype; raises TypeError if
+        it cannot be compared with the keys
+        """
+        if isinstance(value, tuple):
+            if len(value) != 1:
+                raise TypeError('index on %s takes one value, not %r' % (self._name, value))
+            value, = value
+        kind = self._dtype.kind
+        if value is None:
+            return {'U': '', 'f': np.nan, 'M': np.datetime64('NaT')}[kind]
+        if kind == 'U':
+            if not isinstance(value, basestring):
+                raise TypeError('%r is not a string' % (value, ))
+            return value.rstrip()
+        elif kind == 'f':
+            if isinstance(value, basestring):
+                raise TypeError('%r is not a number' % (value, ))
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                raise TypeError('%r is not a number' % (value, ))
+        value = getattr(value, '_date', value)    # dbf.Date
+        if value is None:
+            return np.datetime64('NaT')
+        try:
+            return np.datetime64(value, 'D')
+        except ValueError:
+            raise TypeError('%r is not a date' % (value, ))
+
+    def _build(self):
+        """
+        reads and sorts the key column of all records
+        """
+        stamp = self._stamp()
+        block = record_block(self._table, self._layout)
+        keys = self._decode(block)
+        order = np.argsort(keys, kind='stable')
+        self._keys = keys[order]
+        self._rec_nos = order.astype(self._recno_dtype(len(order)))
+        self._delta.clear()
+        self._dirty = True
+        if self._persistent:
+            self._save(stamp)
+
+    def _clear(self):
+        """
+        removes all entries from index
+        """
+        self._keys = np.empty(0, dtype=self._dtype)
+        self._rec_nos = np.empty(0, dtype=np.int32)
+        self._delta.clear()
+        self._dirty = True
+
+    def _close(self):
+        """
+        called by the table when it closes: writes a changed persistent index
+        """
+        if self._persistent and (self._dirty or self._delta):
+            stamp = self._stamp()
+            self._merge()
+            self._save(stamp)
+
+    def _decode(self, block):
+        values, missing = decode_column(block[self._name], self._fielddef, self._table._meta)
+        return fill_missing(values, missing).astype(self._dtype)
+
+    def _list(self, rec_nos, desc=None):
+        result = List(desc=desc)
+        for rec_num in rec_nos:
+            rec_num = int(rec_num)
+            record = self._table[rec_num]
+            result._maybe_add(item=(self._table, rec_num, result.key(record)))
+        return result
+
+    def _load(self):
+        """
+        loads the sidecar if it matches the table; returns True on success
+        """
+        path = sidecar_name(self._table, self._name)
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path, allow_pickle=False) as sidecar:
+                if (sidecar['version'] != SIDECAR_VERSION
+                        or sidecar['keys'].dtype != self._dtype
+                        or not np.array_equal(sidecar['field'], self._field_stamp())
+                        or not np.array_equal(sidecar['stamp'], self._stamp())):
+                    return False
+                self._keys = sidecar['keys']
+                self._rec_nos = sidecar['rec_nos']
+        except (OSError, ValueError, KeyError):
+            return False
+        self._dirty = False
+        return True
+
+    def _merge(self):
+        """
+        moves the changes in the delta buffer into the sorted arrays
+        """
+        self._nav_check()
+        if not self._delta:
+            return
+        changed = np.fromiter(self._delta.keys(), dtype=np.int64, count=len(self._delta))
+        keep = ~np.isin(self._rec_nos, changed)
+        keys, rec_nos = self._keys[keep], self._rec_nos[keep]
+        current = [rec_num for rec_num, value in self._delta.items() if value is not None]
+        new_keys = np.array([self._delta[rec_num] for rec_num in current], dtype=self._dtype)
+        order = np.argsort(new_keys, kind='stable')
+        new_keys = new_keys[order]
+        new_rec_nos = np.array(current, dtype=np.int64)[order]
+        where = np.searchsorted(keys, new_keys, side='right')
+        rec_no_dtype = self._recno_dtype(max(len(self._table), 1 + int(new_rec_nos.max(initial=0))))
+        self._keys = np.insert(keys, where, new_keys)
+        self._rec_nos = np.insert(rec_nos.astype(rec_no_dtype), where, new_rec_nos.astype(rec_no_dtype))
+        self._delta.clear()
+        self._dirty = True
+
+    def _partial_match(self, target, match):
+        target = getattr(target, 'item', lambda: target)()
+        if isinstance(match, tuple):
+            match, = match
+        return isinstance(target, basestring) and target.startswith(self._as_key(match))
+
+    def _purge(self, rec_num):
+        self._delta[rec_num] = None
+
+    def _recno_dtype(self, count):
+        return np.int32 if count < 2**31 else np.int64
+
+    def _reindex(self):
+        """
+        reindexes all records
+        """
+        self._build()
+
+    def _remap(self, translation):
+        """
+        translation holds the new number of each old record, -1 if the
+        record was removed; the keys stay sorted
+        """
+        self._merge()
+        rec_nos = translation[self._rec_nos]
+        keep = rec_nos >= 0
+        self._keys = self._keys[keep]
+        self._rec_nos = rec_nos[keep].astype(self._recno_dtype(len(translation)))
+        self._dirty = True
+
+    def _save(self, stamp):
+        path = sidecar_name(self._table, self._name)
+        temp = path + '.tmp'
+        with open(temp, 'wb') as sidecar:
+            np.savez(
+                    sidecar,
+                    version=np.array(SIDECAR_VERSION),
+                    field=self._field_stamp(),
+                    stamp=stamp,
+                    keys=self._keys,
+                    rec_nos=self._rec_nos,
+                    )
+        os.replace(temp, path)
+        self._dirty = False
+
+    def _search(self, match, lo=0, hi=None, where=None):
+        """
+        returns the location of the already converted key match
+        """
+        if hi is None:
+            hi = len(self._keys)
+        return lo + int(np.searchsorted(self._keys[lo:hi], match, side=where))
+
+    def _field_stamp(self):
+        fielddef = self._fielddef
+        return np.array([fielddef[START], fielddef[LENGTH], fielddef[DECIMALS]], dtype=np.int64)
+
+    def _stamp(self):
+        """
+        returns what identifies the current contents of the table file
+        """
+        meta = self._table._meta
+        if meta.location != ON_DISK:
+            return None
+        if meta.status == READ_WRITE:
+            self._table._table.flush()
+            meta.dfd.flush()
+        status = os.stat(meta.filename)
+        return np.array([
+                meta.header.record_count, meta.header.record_length,
+                status.st_size, status.st_mtime_ns,
+                ], dtype=np.int64)
+
+    def _update_range(self, first, count):
+        """
+        called after records first..first+count-1 were written in bulk
+        """
+        block = record_block(self._table, self._layout)[first:first + count]
+        self._delta.update(zip(range(first, first + count), self._decode(block)))
+        if len(self._delta) > MAX_DELTA:
+            self._merge()
+
+    def _upper(self):
+        """
+        returns the location after the last non-blank numeric or date key
+        """
+        if self._dtype.kind == 'U':
+            return len(self._keys)
+        return self._search(self._as_key(None), where='left')
+
+    def index_search(self, match, start=None, stop=None, nearest=False, partial=False):
+        """
+        returns the index of match between start and stop
+        start and stop default to the first and last record.
+        if nearest is true returns the location of where the match should be
+        otherwise raises NotFoundError
+        """
+        self._merge()
+        value = self._as_key(match)
+        if start is None:
+            start = 0
+        if stop is None:
+            stop = len(self._keys)
+        loc = self._search(value, start, stop, where='left')
+        if loc == len(self._keys):
+            if nearest:
+                return IndexLocation(loc, False)
+            raise NotFoundError("dbf.Index.index_search(x): x not in index", data=match)
+        if self._keys[loc] == value or partial and self._partial_match(self._keys[loc], match):
+            return IndexLocation(loc, True)
+        elif nearest:
+            return IndexLocation(loc, False)
+        else:
+            raise NotFoundError("dbf.Index.index_search(x): x not in Index", data=match)
+
+    def save(self):
+        """
+        writes the index to its sidecar file
+        """
+        if not self._persistent:
+            raise DbfError('index on %s is not persistent' % self._name)
+        stamp = self._stamp()
+        self._merge()
+        self._save(stamp)
+
+    def search_range(self, low=None, high=None, include_low=True, include_high=True):
+        """
+        returns the record numbers, in key order, of keys between low and
+        high (None for unbounded); blank numbers and dates are not in any range
+        """
+        self._merge()
+        if low is None:
+            lo = 0
+        else:
+            lo = self._search(self._as_key(low), where=('right', 'left')[include_low])
+        if high is None:
+            hi = self._upper()
+        else:
+            hi = min(self._upper(), self._search(self._as_key(high), where=('left', 'right')[include_high]))
+        return self._rec_nos[lo:max(lo, hi)]
+
+    def search(self, match, partial=False):
+        """
+        returns dbf.List of all (partially) matching records
+        """
+        self._merge()
+        value = self._as_key(match)
+        lo = self._search(value, where='left')
+        if partial and self._dtype.kind == 'U':
+            hi = self._search(value + u'\U0010ffff', where='right')
+        else:
+            hi = self._search(value, where='right')
+        return self._list(self._rec_nos[lo:hi])
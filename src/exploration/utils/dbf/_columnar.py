@@ -0,0 +1,1148 @@
+"""
+columnar (bulk) access to dbf tables
+
+Instead of building one Record per row and converting one field at
+a time, the record block of the .dbf file is memory-mapped and viewed
+as a NumPy structured array whose fields sit at the offsets and
+lengths given in the table header.  Each column is then converted
+with a handful of vectorized operations:
+
+    table = dbf.Table('counties.dbf')
+    with table:
+        columns = table.to_numpy()                  # {field_name: ndarray}
+        df = table.to_dataframe('STATEFP, COUNTYFP, NAME')
+
+Column types:
+
+    Character   --> str ('U') array, trailing padding removed
+    Numeric     --> int64 if no decimals, else float64; blanks are NaN
+    Float       --> same as Numeric
+    Date        --> datetime64[D]; blank or invalid dates are NaT
+    DateTime    --> datetime64[ms] (Visual FoxPro); blank or invalid are NaT
+    Logical     --> bool; if unknowns ('?') are present, object with None
+    Integer     --> int32
+    Double      --> float64
+    Currency    --> float64
+    Memo        --> object; the memos are read in file order
+    others      --> object, converted per value by the field's Retrieve function
+
+Writing goes the other way: each column is encoded to its fixed-width
+bytes in one step, the columns are laid into a block of blank records,
+and the block is written with a single write and a single header update:
+
+    with table:
+        table.append_many(df)                       # new records
+        table.write_columns({'FULL_FIPS': fips})    # overwrite a column in place
+        table.add_computed_field(                   # new field from existing ones
+                'FULL_FIPS C(5)',
+                lambda cols: np.char.add(cols['STATEFP'], cols['COUNTYFP']),
+                fields='STATEFP, COUNTYFP',
+                )
+
+Table.pack() reads the deletion flags as one array, moves the remaining
+records forward a chunk at a time through a writable memory map, and
+remaps the table's indexes with an old-to-new record number array.
+
+dbf.export() uses the same decoder for CSV and tab-delimited output
+(written by pandas), and for Parquet and Feather (written by pyarrow),
+a chunk of records at a time.
+
+Character columns of single-byte codepages (all but the Asian ones)
+are decoded as one string and viewed as a 'U' array, instead of value
+by value.  to_dataframe() decodes each distinct value of a character
+column once: repeated values (state FIPS codes, county names) share one
+str object, or, with categorical=True, become a pandas Categorical.
+
+Visual FoxPro null flags are read as one column of bytes and unpacked
+with np.unpackbits into a boolean mask per nullable field; Null values
+are then missing like blanks, without a check per value.  Masked arrays
+(to_numpy(masked=True)) and pandas' nullable dtypes
+(to_dataframe(nullable=True)) keep the decoded type of such columns.
+Missing values written to nullable fields (None, Null, NaN, NaT) are
+flagged as Null.
+
+Requires numpy; to_dataframe() and CSV export also require pandas.
+"""
+from __future__ import print_function
+
+import csv
+import datetime
+import mmap
+import os
+import sys
+
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import (
+        BINARY, CHAR, CLASS, CLOSED, CURRENCY, DATE, DATETIME, DECIMALS, DOUBLE, EMPTY, FLAGS, FLOAT,
+        INTEGER, LENGTH, LOGICAL, NUL, NULLABLE, NUMERIC, ON_DISK, READ_WRITE, START, TYPE, VFPTIME,
+        DataOverflowError, DbfError, FieldMissingError, FieldSpecError, NoneType, Null, Record, Table, _codepage_lookup,
+        to_bytes,
+        retrieve_memo, retrieve_vfp_datetime, retrieve_vfp_memo, update_vfp_datetime,
+        )
+
+## the package itself, for run-time configuration flags such as LOGICAL_BAD_IS_NONE
+dbf_module = sys.modules[__package__]
+
+## name of the deletion flag in record layouts; longer than any
+## dbf field name (max 10 characters), so it cannot collide
+DELETED_FLAG = '_deleted_flag'
+
+## name of the Visual FoxPro null flags in record layouts, as a row of bytes
+NULL_FLAGS = '_null_flags'
+
+## field types whose raw bytes NumPy can use directly
+native_formats = {
+        INTEGER: '<i4',
+        DOUBLE: '<f8',
+        CURRENCY: '<i8',
+        }
+
+## field types that are stored as text, and are decoded from 'S' arrays
+text_types = (CHAR, DATE, FLOAT, LOGICAL, NUMERIC)
+
+LOGICAL_TRUE = np.frombuffer(b'tTyY', dtype=np.uint8) if np is not None else None
+LOGICAL_FALSE = np.frombuffer(b'fFnN', dtype=np.uint8) if np is not None else None
+LOGICAL_UNKNOWN = np.frombuffer(b'? ', dtype=np.uint8) if np is not None else None
+
+## Visual FoxPro datetimes: Julian day number of 1970-01-01, and
+## milliseconds per day
+UNIX_EPOCH_JULIAN = datetime.date(1970, 1, 1).toordinal() + VFPTIME
+MS_PER_DAY = 86400000
+
+## Julian day numbers of datetime.date.min and datetime.date.max
+JULIAN_MIN = datetime.date.min.toordinal() + VFPTIME
+JULIAN_MAX = datetime.date.max.toordinal() + VFPTIME
+
+## whether an encoding maps each byte to one character, by encoding name
+single_byte_encodings = {}
+
+
+def require_numpy():
+    if np is None:
+        raise DbfError('numpy is required for columnar access to dbf tables')
+
+def field_format(fielddef):
+    """
+    Returns the NumPy format of one field in the record layout
+    """
+    field_type = fielddef[TYPE]
+    if field_type in native_formats:
+        return native_formats[field_type]
+    elif field_type in text_types:
+        return 'S%d' % fielddef[LENGTH]
+    else:
+        return 'V%d' % fielddef[LENGTH]
+
+def resolve_fields(table, fields):
+    """
+    Returns the names, as stored in the table, of the requested fields
+    (default: all user fields); lookups are case-insensitive
+    """
+    meta = table._meta
+    stored = dict((name.upper(), name) for name in meta.fields)
+    names = []
+    for name in table._list_fields(fields):
+        try:
+            names.append(stored[name.upper()])
+        except KeyError:
+            raise FieldMissingError('%s: no such field in table' % name)
+    return names
+
+def is_nullable(fielddef, meta):
+    """
+    Returns whether the field can hold Null, flagged by a bit of the
+    record's null flags
+    """
+    return bool(fielddef[FLAGS] & NULLABLE) and '_NULLFLAGS' in meta
+
+def record_layout(meta, field_names):
+    """
+    Returns a structured dtype that overlays one record: the deletion
+    flag, followed by the requested fields at their offsets, and the
+    null flags if any of the fields is nullable
+    """
+    names = [DELETED_FLAG]
+    formats = ['S1']
+    offsets = [0]
+    for name in field_names:
+        fielddef = meta[name]
+        names.append(name)
+        formats.append(field_format(fielddef))
+        offsets.append(fielddef[START])
+    if any(is_nullable(meta[name], meta) for name in field_names):
+        null_def = meta['_NULLFLAGS']
+        names.append(NULL_FLAGS)
+        formats.append(('u1', (null_def[LENGTH], )))
+        offsets.append(null_def[START])
+    return np.dtype({
+            'names': names,
+            'formats': formats,
+            'offsets': offsets,
+            'itemsize': meta.header.record_length,
+            })
+
+def record_block(table, layout):
+    """
+    Returns all records of table as an array of layout; for disk
+    tables the array is a read-only view of a memory map of the file
+    """
+    meta = table._meta
+    header = meta.header
+    count = header.record_count
+    if meta.location != ON_DISK:
+        data = b''.join(record._data.tobytes() for record in table._table)
+        return np.frombuffer(data, dtype=layout, count=count)
+    if meta.journal is not None:
+        # records changed in the current Table.batch() are written first
+        meta.journal.write()
+    if meta.status == READ_WRITE:
+        # make records written through the table's own file visible to the map
+        meta.dfd.flush()
+    with open(meta.filename, 'rb') as dfd:
+        size = os.fstat(dfd.fileno()).st_size
+        count = min(count, max(0, size - header.start) // header.record_length)
+        if not count:
+            return np.empty(0, dtype=layout)
+        data = mmap.mmap(dfd.fileno(), 0, access=mmap.ACCESS_READ)
+    # the map stays open for as long as arrays refer to it
+    return np.frombuffer(data, dtype=layout, count=count, offset=header.start)
+
+def text_codec(meta):
+    """
+    Returns (encoding, errors) used to decode character fields
+    """
+    cp, sd, ld = _codepage_lookup(meta.header.codepage())
+    errors = meta.unicode_errors
+    if errors not in ('ignore', 'replace'):
+        errors = 'strict'
+    return sd, errors
+
+def single_byte(encoding):
+    """
+    Returns True if encoding decodes every byte to exactly one character
+    """
+    known = single_byte_encodings.get(encoding)
+    if known is None:
+        known = single_byte_encodings[encoding] = (
+                len(bytes(bytearray(range(256))).decode(encoding, 'replace')) == 256
+                # lead bytes of utf-8 and of the Asian codepages
+                and len(b'\xc3\xa9\x82\xa0\xa4\xa1'.decode(encoding, 'replace')) == 6
+                )
+    return known
+
+def decode_text(raw, meta):
+    """
+    Returns the 'S' array raw decoded to a 'U' array, without trailing
+    spaces and NULs
+    """
+    encoding, errors = text_codec(meta)
+    length = raw.dtype.itemsize
+    if length and errors != 'ignore' and single_byte(encoding):
+        # one decode for the whole column; every value keeps its width
+        data = np.ascontiguousarray(raw).tobytes()
+        try:
+            text = data.decode(encoding, errors)
+        except UnicodeDecodeError:
+            # same fallback as retrieve_character
+            text = data.decode('latin-1')
+        values = np.frombuffer(text.encode('utf-32-le'), dtype='<U%d' % length)
+        return np.char.rstrip(values, ' \x00')
+    text = np.char.rstrip(raw, b' \x00')
+    try:
+        return np.char.decode(text, encoding, errors)
+    except UnicodeDecodeError:
+        return np.char.decode(text, 'latin-1')
+
+def character_codes(raw, meta):
+    """
+    Returns (codes, categories): the distinct values of the character
+    column raw, decoded and sorted, and the position of each value of
+    raw in them
+    """
+    length = raw.dtype.itemsize
+    if length <= 8:
+        # sorting numbers is faster than sorting strings
+        keys = np.zeros(len(raw), dtype='S8')
+        keys[:] = raw
+        uniques, codes = np.unique(keys.view('>u8'), return_inverse=True)
+        uniques = uniques.view('S8').astype(raw.dtype)
+    else:
+        uniques, codes = np.unique(raw, return_inverse=True)
+    # values that differ only in their padding decode the same
+    categories, merged = np.unique(decode_text(uniques, meta), return_inverse=True)
+    return merged[codes.reshape(-1)], categories
+
+def decode_character(raw, fielddef, meta):
+    if fielddef[FLAGS] & BINARY:
+        return np.array(raw), None
+    return decode_text(raw, meta), None
+
+def decode_numeric(raw, fielddef, meta):
+    text = np.char.strip(raw, b' \x00')
+    # '*'s are written when a value is too big for the field
+    missing = (text == b'') | np.char.startswith(text, b'*')
+    text[missing] = b'0'
+    if fielddef[DECIMALS]:
+        values = text.astype(np.float64)
+    else:
+        try:
+            values = text.astype(np.int64)
+        except ValueError:
+            values = text.astype(np.float64)
+    return values, missing
+
+def decode_date(raw, fielddef, meta):
+    digits = np.ascontiguousarray(raw).view(np.uint8).reshape(-1, 8).astype(np.int32) - ord('0')
+    valid = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = digits[:, 4] * 10 + digits[:, 5]
+    day = digits[:, 6] * 10 + digits[:, 7]
+    valid &= (month >= 1) & (month <= 12) & (year >= 1)
+    months = np.where(valid, (year - 1970) * 12 + month - 1, 0).astype('datetime64[M]')
+    month_start = months.astype('datetime64[D]')
+    month_length = ((months + 1).astype('datetime64[D]') - month_start).astype(np.int32)
+    valid &= (day >= 1) & (day <= month_length)
+    values = month_start + np.where(valid, day - 1, 0).astype('timedelta64[D]')
+    values[~valid] = np.datetime64('NaT')
+    return values, ~valid
+
+def decode_datetime(raw, fielddef, meta):
+    """
+    Visual FoxPro datetimes: a Julian day number and the milliseconds
+    since midnight, two little-endian int32s
+    """
+    if meta.fieldtypes[fielddef[TYPE]]['Retrieve'] is not retrieve_vfp_datetime:
+        return decode_per_value(raw, fielddef, meta)
+    pairs = np.frombuffer(np.ascontiguousarray(raw).tobytes(), dtype='<i4').reshape(-1, 2)
+    julian = pairs[:, 0].astype(np.int64)
+    millis = pairs[:, 1].astype(np.int64)
+    # all zeros is blank; days before 0001-01-01 are nulled, as by retrieve_vfp_datetime
+    valid = ((julian != 0) | (millis != 0)) & (julian >= JULIAN_MIN) & (julian <= JULIAN_MAX)
+    stamps = np.where(valid, (julian - UNIX_EPOCH_JULIAN) * MS_PER_DAY + millis, 0)
+    values = stamps.astype('datetime64[ms]')
+    values[~valid] = np.datetime64('NaT')
+    return values, ~valid
+
+def decode_logical(raw, fielddef, meta):
+    flag = raw.view(np.uint8)
+    values = np.isin(flag, LOGICAL_TRUE)
+    missing = ~(values | np.isin(flag, LOGICAL_FALSE))
+    if not dbf_module.LOGICAL_BAD_IS_NONE:
+        bad = missing & ~np.isin(flag, LOGICAL_UNKNOWN)
+        if bad.any():
+            raise dbf_module.BadDataError(
+                    'Logical field contained %r' % raw[bad.argmax()])
+    return values, missing
+
+def decode_native(raw, fielddef, meta):
+    if fielddef[TYPE] == CURRENCY:
+        return raw / 10000.0, None
+    return np.array(raw), None
+
+def decode_per_value(raw, fielddef, meta):
+    """
+    Returns an object array of the values converted one at a time by
+    the field's Retrieve function (memos, VFP datetimes, ...)
+    """
+    retrieve = meta.fieldtypes[fielddef[TYPE]]['Retrieve']
+    length = fielddef[LENGTH]
+    data = np.ascontiguousarray(raw).tobytes()
+    values = np.empty(len(raw), dtype=object)
+    for i in range(len(raw)):
+        chunk = array('B', data[i * length:(i + 1) * length])
+        values[i] = retrieve(chunk, fielddef, meta.memo, meta.decoder)
+    return values, None
+
+def decode_memo(raw, fielddef, meta):
+    """
+    Returns an object array of memo contents; the block numbers are
+    parsed as one array, and the memos are fetched in file order
+    """
+    retrieve = meta.fieldtypes[fielddef[TYPE]]['Retrieve']
+    memo = meta.memo
+    if memo is None or retrieve not in (retrieve_memo, retrieve_vfp_memo):
+        return decode_per_value(raw, fielddef, meta)
+    if retrieve is retrieve_vfp_memo:
+        blocks = np.frombuffer(np.ascontiguousarray(raw).tobytes(), dtype='<i4')
+    else:
+        digits = np.char.strip(np.ascontiguousarray(raw).view('S%d' % fielddef[LENGTH]))
+        blocks = np.where(digits == b'', b'0', digits).astype(np.int64)
+    values = np.empty(len(raw), dtype=object)
+    empty = fielddef[EMPTY]
+    values.fill(None if empty is NoneType else empty())
+    present = np.flatnonzero(blocks)
+    binary = fielddef[FLAGS] & BINARY
+    cls = fielddef[CLASS]
+    for i, data in zip(present.tolist(), memo.get_memos(blocks[present].tolist())):
+        values[i] = to_bytes(data) if binary else cls(meta.decoder(data)[0])
+    return values, None
+
+column_decoders = {
+        CHAR: decode_character,
+        CURRENCY: decode_native,
+        DATE: decode_date,
+        DATETIME: decode_datetime,
+        DOUBLE: decode_native,
+        FLOAT: decode_numeric,
+        INTEGER: decode_native,
+        LOGICAL: decode_logical,
+        NUMERIC: decode_numeric,
+        }
+
+def decode_column(raw, fielddef, meta):
+    """
+    Returns (values, missing) for one raw column; missing is a boolean
+    array marking blank values, or None if the type has no blanks
+    """
+    if fielddef[TYPE] in meta.memo_types:
+        return decode_memo(raw, fielddef, meta)
+    decoder = column_decoders.get(fielddef[TYPE], decode_per_value)
+    return decoder(raw, fielddef, meta)
+
+def fill_missing(values, missing):
+    """
+    Returns values with the missing entries set to NaN, NaT, or None,
+    widening the dtype where needed
+    """
+    if missing is None or not missing.any():
+        return values
+    kind = values.dtype.kind
+    if kind in 'iuf':
+        values = values.astype(np.float64)
+        values[missing] = np.nan
+    elif kind == 'M':
+        values[missing] = np.datetime64('NaT')
+    else:
+        values = values.astype(object)
+        values[missing] = None
+    return values
+
+def table_rows(table, fields=None, skip_deleted=False):
+    """
+    Returns (record_numbers, rows, field_names): the records of table
+    as an array of the record layout of field_names
+    """
+    require_numpy()
+    meta = table._meta
+    if meta.status == CLOSED:
+        raise DbfError('%s is closed; unable to read columns' % meta.filename)
+    field_names = resolve_fields(table, fields)
+    block = record_block(table, record_layout(meta, field_names))
+    record_numbers = np.arange(len(block))
+    if skip_deleted:
+        keep = block[DELETED_FLAG] != b'*'
+        record_numbers = record_numbers[keep]
+        block = block[keep]
+    return record_numbers, block, field_names
+
+def table_columns(table, fields=None, skip_deleted=False, masked=False):
+    """
+    Returns (record_numbers, {field_name: values}) for the records
+    of table, decoded a column at a time
+    """
+    record_numbers, rows, field_names = table_rows(table, fields, skip_deleted)
+    return record_numbers, decode_rows(rows, field_names, table._meta, masked)
+
+def null_masks(rows, field_names, meta):
+    """
+    Returns {field_name: boolean array} marking the Null values of the
+    nullable fields among field_names, from the null flags of rows
+    """
+    if NULL_FLAGS not in (rows.dtype.names or ()):
+        return {}
+    # one bit per nullable field, the first field in the lowest bit
+    bits = np.unpackbits(rows[NULL_FLAGS], axis=1, bitorder='little').view(bool)
+    return dict(
+            (name, bits[:, meta[name][NUL]])
+            for name in field_names
+            if is_nullable(meta[name], meta)
+            )
+
+def merge_missing(missing, null):
+    """
+    Returns the union of two missing masks, either of which may be None
+    """
+    if null is None or not null.any():
+        return missing
+    elif missing is None:
+        return null
+    return missing | null
+
+def masked_values(values, missing):
+    """
+    Returns values as a masked array, masked where missing
+    """
+    if missing is None:
+        missing = np.ma.nomask
+    return np.ma.masked_array(values, mask=missing)
+
+def nullable_values(values, missing):
+    """
+    Returns values as a pandas array of a nullable dtype (Int64, Float64,
+    boolean) where there is one, with missing entries as NA; other
+    types as by fill_missing()
+    """
+    import pandas as pd
+    kind = values.dtype.kind
+    if missing is None:
+        missing = np.zeros(len(values), dtype=bool)
+    if kind in 'iu':
+        return pd.arrays.IntegerArray(values, missing)
+    elif kind == 'f':
+        return pd.arrays.FloatingArray(values, missing)
+    elif kind == 'b':
+        return pd.arrays.BooleanArray(values, missing)
+    return fill_missing(values, missing)
+
+def decode_rows(rows, field_names, meta, masked=False):
+    """
+    Returns {field_name: values} for rows, an array of a record layout;
+    blank and Null values are NaN, NaT, or None, or, if masked is True,
+    masked
+    """
+    nulls = null_masks(rows, field_names, meta)
+    columns = {}
+    for name in field_names:
+        values, missing = decode_column(rows[name], meta[name], meta)
+        missing = merge_missing(missing, nulls.get(name))
+        if masked:
+            columns[name] = masked_values(values, missing)
+        else:
+            columns[name] = fill_missing(values, missing)
+    return columns
+
+def table_frame(table, fields=None, skip_deleted=False, categorical=False, nullable=False):
+    """
+    Returns the columns of table as a pandas DataFrame indexed by
+    record number; each distinct value of a character column is decoded
+    once, and the column is a Categorical if categorical is True; with
+    nullable=True, numeric and logical columns have pandas' nullable
+    dtypes, and blank and Null values are NA
+    """
+    try:
+        import pandas as pd
+    except ImportError:
+        raise DbfError('pandas is required for dbf.Table.to_dataframe()').from_exc(None)
+    record_numbers, rows, field_names = table_rows(table, fields, skip_deleted)
+    meta = table._meta
+    nulls = null_masks(rows, field_names, meta)
+    columns = {}
+    for name in field_names:
+        fielddef = meta[name]
+        null = nulls.get(name)
+        if fielddef[TYPE] == CHAR and not fielddef[FLAGS] & BINARY:
+            codes, categories = character_codes(rows[name], meta)
+            if null is not None and null.any():
+                codes = np.where(null, -1, codes)
+            if categorical:
+                columns[name] = pd.Categorical.from_codes(codes, categories)
+            else:
+                # one str object per distinct value; code -1 is Null
+                columns[name] = np.append(categories.astype(object), None)[codes]
+        else:
+            values, missing = decode_column(rows[name], fielddef, meta)
+            missing = merge_missing(missing, null)
+            if nullable:
+                columns[name] = nullable_values(values, missing)
+            else:
+                columns[name] = fill_missing(values, missing)
+    return pd.DataFrame(columns, index=pd.Index(record_numbers, name='recno'))
+
+
+# exporting
+
+export_formats = ('csv', 'tab', 'parquet', 'feather')
+
+def column_chunks(table, fields=None, record_numbers=None, chunk_size=65536):
+    """
+    Yields (record_numbers, {field_name: values}) for chunk_size records
+    at a time, of all records or of the given record numbers
+    """
+    require_numpy()
+    meta = table._meta
+    if meta.status == CLOSED:
+        raise DbfError('%s is closed; unable to read columns' % meta.filename)
+    field_names = resolve_fields(table, fields)
+    block = record_block(table, record_layout(meta, field_names))
+    count = len(block) if record_numbers is None else len(record_numbers)
+    # an empty table still yields one (empty) chunk with typed columns
+    for start in range(0, max(count, 1), chunk_size):
+        if record_numbers is None:
+            numbers = np.arange(start, min(start + chunk_size, count))
+            rows = block[start:start + chunk_size]
+        else:
+            numbers = np.asarray(record_numbers[start:start + chunk_size], dtype=np.int64)
+            rows = block[numbers]
+        yield numbers, decode_rows(rows, field_names, meta)
+
+def export_columns(table, filename, fields=None, format='csv', header=True, dialect='dbf',
+                   encoding=None, record_numbers=None, chunk_size=65536):
+    """
+    Writes the given fields of all records, or of the given record numbers,
+    to filename as CSV, tab-delimited, Parquet, or Feather, decoding and
+    writing chunk_size records at a time; returns the number of records
+    """
+    meta = table._meta
+    field_names = resolve_fields(table, fields)
+    chunks = column_chunks(table, field_names, record_numbers, chunk_size)
+    # whole numbers with blanks are written as integers, not as floats
+    whole = [name for name in field_names
+            if meta[name][TYPE] in (NUMERIC, FLOAT) and not meta[name][DECIMALS]]
+    if format in ('csv', 'tab'):
+        try:
+            import pandas as pd
+        except ImportError:
+            raise DbfError('pandas is required for bulk CSV export').from_exc(None)
+        if format == 'csv':
+            dialect = csv.get_dialect(dialect)
+            options = dict(
+                    sep=dialect.delimiter, quotechar=dialect.quotechar, quoting=dialect.quoting,
+                    doublequote=dialect.doublequote, escapechar=dialect.escapechar,
+                    lineterminator=dialect.lineterminator,
+                    )
+        else:
+            options = dict(sep='\t', quoting=csv.QUOTE_NONE, lineterminator='\n')
+        count = 0
+        with open(filename, 'w', encoding=encoding or table.codepage.name, newline='') as fd:
+            for numbers, columns in chunks:
+                for name in whole:
+                    if columns[name].dtype.kind == 'f':
+                        columns[name] = pd.array(columns[name], dtype='Int64')
+                frame = pd.DataFrame(columns, columns=field_names)
+                frame.to_csv(fd, header=header and not count, index=False, **options)
+                count += len(numbers)
+        return count
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise DbfError('pyarrow is required for %s export' % format).from_exc(None)
+    count = 0
+    writer = None
+    try:
+        for numbers, columns in chunks:
+            arrays = {}
+            for name in field_names:
+                values = columns[name]
+                if name in whole and values.dtype.kind == 'f':
+                    blank = np.isnan(values)
+                    arrays[name] = pa.array(np.where(blank, 0, values).astype(np.int64), mask=blank)
+                else:
+                    arrays[name] = pa.array(values, from_pandas=True)
+            batch = pa.table(arrays)
+            if writer is None:
+                if format == 'parquet':
+                    writer = pq.ParquetWriter(filename, batch.schema)
+                else:
+                    writer = pa.ipc.new_file(filename, batch.schema)
+            writer.write_table(batch)
+            count += len(numbers)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+# writing
+
+def missing_mask(values):
+    """
+    Returns a boolean array marking None, Null, NaN, and NaT in values
+    """
+    kind = values.dtype.kind
+    if kind == 'f':
+        return np.isnan(values)
+    elif kind in 'mM':
+        return np.isnat(values)
+    elif kind == 'O':
+        return np.array([v is None or v is Null or v != v for v in values], dtype=bool)
+    else:
+        return np.zeros(len(values), dtype=bool)
+
+def check_widths(encoded, length, name):
+    widths = np.char.str_len(encoded)
+    if (widths > length).any():
+        raise DataOverflowError('tried to store %d bytes in %d byte field %s'
+                % (widths.max(), length, name))
+
+def encode_character(values, fielddef, meta, name):
+    length = fielddef[LENGTH]
+    missing = missing_mask(values)
+    if fielddef[FLAGS] & BINARY:
+        data = [b'' if m else bytes(v) for v, m in zip(values, missing)]
+        widest = max(len(d) for d in data)
+        if widest > length:
+            raise DataOverflowError('tried to store %d bytes in %d byte field %s' % (widest, length, name))
+        return np.char.ljust(np.array(data, dtype='S%d' % length), length, b' ')
+    if missing.any():
+        values = np.where(missing, '', values.astype(object))
+    text = np.char.strip(values.astype(str))
+    encoding, errors = text_codec(meta)
+    try:
+        encoded = np.char.encode(text, encoding, errors)
+    except UnicodeEncodeError:
+        # same fallback as update_character
+        encoded = np.char.encode(text, 'latin-1')
+    check_widths(encoded, length, name)
+    return np.char.ljust(encoded, length, b' ')
+
+def encode_numeric(values, fielddef, meta, name):
+    length = fielddef[LENGTH]
+    missing = missing_mask(values)
+    numbers = np.where(missing, 0, values).astype(np.float64)
+    text = np.char.encode(np.char.mod('%%%d.%df' % (length, fielddef[DECIMALS]), numbers), 'ascii')
+    text[missing] = b' ' * length
+    check_widths(text, length, name)
+    return text
+
+def as_dates(values):
+    """
+    Returns values as a datetime64[D] array; None becomes NaT
+    """
+    if values.dtype.kind == 'M':
+        return values.astype('datetime64[D]')
+    try:
+        return np.asarray(values, dtype='datetime64[D]')
+    except (TypeError, ValueError):
+        # dbf.Date and friends
+        return np.array(
+                [None if v is None or not v else datetime.date(v.year, v.month, v.day) for v in values],
+                dtype='datetime64[D]',
+                )
+
+def encode_date(values, fielddef, meta, name):
+    dates = as_dates(values)
+    missing = np.isnat(dates)
+    dates = np.where(missing, np.datetime64('1970-01-01'), dates)
+    months = dates.astype('datetime64[M]')
+    year = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+    month = months.astype(np.int64) % 12 + 1
+    day = (dates - months.astype('datetime64[D]')).astype(np.int64) + 1
+    if ((year < 1) | (year > 9999)).any():
+        raise DataOverflowError('dates in field %s must be between years 1 and 9999' % name)
+    digits = np.empty((len(dates), 8), dtype=np.uint8)
+    for i, scale in enumerate((1000, 100, 10, 1)):
+        digits[:, i] = year // scale % 10
+    digits[:, 4], digits[:, 5] = month // 10, month % 10
+    digits[:, 6], digits[:, 7] = day // 10, day % 10
+    digits += ord('0')
+    digits[missing] = ord(' ')
+    return digits.view('S8').ravel()
+
+def as_datetimes(values):
+    """
+    Returns values as a datetime64[ms] array; None becomes NaT
+    """
+    if values.dtype.kind == 'M':
+        return values.astype('datetime64[ms]')
+    try:
+        return np.asarray(values, dtype='datetime64[ms]')
+    except (TypeError, ValueError):
+        # dbf.DateTime and friends
+        return np.array(
+                [None if v is None or not v else datetime.datetime(
+                    v.year, v.month, v.day,
+                    getattr(v, 'hour', 0), getattr(v, 'minute', 0), getattr(v, 'second', 0),
+                    getattr(v, 'microsecond', 0),
+                    ) for v in values],
+                dtype='datetime64[ms]',
+                )
+
+def encode_datetime(values, fielddef, meta, name):
+    if meta.fieldtypes[fielddef[TYPE]]['Update'] is not update_vfp_datetime:
+        return encode_per_value(values, fielddef, meta, name)
+    moments = as_datetimes(values)
+    missing = np.isnat(moments)
+    days, millis = np.divmod(np.where(missing, 0, moments.astype(np.int64)), MS_PER_DAY)
+    julian = days + UNIX_EPOCH_JULIAN
+    if ((julian < JULIAN_MIN) | (julian > JULIAN_MAX))[~missing].any():
+        raise DataOverflowError('datetimes in field %s must be between years 1 and 9999' % name)
+    pairs = np.empty((len(moments), 2), dtype='<i4')
+    pairs[:, 0] = julian
+    pairs[:, 1] = millis
+    pairs[missing] = 0
+    return pairs
+
+def encode_logical(values, fielddef, meta, name):
+    missing = missing_mask(values)
+    encoded = np.full(len(values), b'?', dtype='S1')
+    known = ~missing
+    truth = np.zeros(len(values), dtype=bool)
+    truth[known] = values[known].astype(bool)
+    encoded[known & truth] = b'T'
+    encoded[known & ~truth] = b'F'
+    return encoded
+
+def encode_native(values, fielddef, meta, name):
+    missing = missing_mask(values)
+    numbers = np.where(missing, 0, values).astype(np.float64)
+    field_type = fielddef[TYPE]
+    if field_type == CURRENCY:
+        numbers = np.round(numbers * 10000)
+        limit = 2 ** 63
+    elif field_type == INTEGER:
+        limit = 2 ** 31
+    else:
+        limit = None
+    if limit is not None and ((numbers < -limit) | (numbers >= limit)).any():
+        raise DataOverflowError('value out of range for field %s' % name)
+    return numbers.astype(native_formats[field_type])
+
+def encode_per_value(values, fielddef, meta, name):
+    """
+    Returns the values converted one at a time by the field's Update
+    function (memos, VFP datetimes, ...)
+    """
+    update = meta.fieldtypes[fielddef[TYPE]]['Update']
+    length = fielddef[LENGTH]
+    encoded = np.empty(len(values), dtype='S%d' % length)
+    for i, value in enumerate(values):
+        if value is not None and value != value:
+            value = None
+        data = to_bytes(update(value, fielddef, meta.memo, meta.input_decoder, meta.encoder))
+        if len(data) > length:
+            raise DataOverflowError("tried to store %d bytes in %d byte field" % (len(data), length))
+        encoded[i] = data + b' ' * (length - len(data))
+    return encoded
+
+column_encoders = {
+        CHAR: encode_character,
+        CURRENCY: encode_native,
+        DATE: encode_date,
+        DATETIME: encode_datetime,
+        DOUBLE: encode_native,
+        FLOAT: encode_numeric,
+        INTEGER: encode_native,
+        LOGICAL: encode_logical,
+        NUMERIC: encode_numeric,
+        }
+
+def encode_column(values, fielddef, meta, name):
+    """
+    Returns the values as a (count, field length) uint8 array of
+    their bytes in the record
+    """
+    encoder = column_encoders.get(fielddef[TYPE], encode_per_value)
+    encoded = np.ascontiguousarray(encoder(values, fielddef, meta, name))
+    if encoded.dtype.kind == 'S':
+        # S arrays pad short values with NULs; make the padding explicit
+        encoded = encoded.astype('S%d' % fielddef[LENGTH])
+    return encoded.view(np.uint8).reshape(len(values), fielddef[LENGTH])
+
+def as_column(values):
+    """
+    Returns values as an array; sequences holding Null become object
+    arrays
+    """
+    try:
+        return np.asarray(values)
+    except ValueError:
+        # Null answers every attribute, NumPy's array interface included
+        column = np.empty(len(values), dtype=object)
+        for i, value in enumerate(values):
+            column[i] = value
+        return column
+
+def column_data(table, data, drop=False):
+    """
+    Returns ({stored_field_name: values}, count) for a DataFrame, a
+    structured array, or a mapping of field names to sequences
+    """
+    # pandas is only imported by callers that use it
+    pd = sys.modules.get('pandas')
+    if pd is not None and isinstance(data, pd.DataFrame):
+        items = [(name, data[name].to_numpy()) for name in data.columns]
+    elif isinstance(data, np.ndarray) and data.dtype.names:
+        items = [(name, data[name]) for name in data.dtype.names]
+    else:
+        items = [(name, as_column(values)) for name, values in data.items()]
+    stored = dict((name.upper(), name) for name in table._meta.user_fields)
+    columns = {}
+    count = None
+    for name, values in items:
+        try:
+            field = stored[str(name).upper()]
+        except KeyError:
+            if drop:
+                continue
+            raise FieldMissingError('%s: no such field in table' % name)
+        if count is None:
+            count = len(values)
+        elif len(values) != count:
+            raise DbfError('all columns must have the same length; %s has %d values, not %d'
+                    % (name, len(values), count))
+        columns[field] = values
+    return columns, count or 0
+
+def fill_block(block, columns, meta):
+    """
+    Lays the encoded columns into block, a (records, record length)
+    uint8 array; missing values of nullable fields are flagged as Null
+    """
+    for name, values in columns.items():
+        fielddef = meta[name]
+        block[:, fielddef[START]:fielddef[START] + fielddef[LENGTH]] = encode_column(values, fielddef, meta, name)
+        if is_nullable(fielddef, meta):
+            byte, bit = divmod(fielddef[NUL], 8)
+            flags = block[:, meta['_NULLFLAGS'][START] + byte]
+            null = missing_mask(values)
+            flags[:] = np.where(null, flags | 1 << bit, flags & (0xff ^ 1 << bit))
+
+def update_indexes(table, first, count):
+    """
+    Brings the table's indexes up to date for records first..first+count-1
+    """
+    indexen = []
+    for index in table._indexen:
+        if hasattr(index, '_update_range'):
+            # array-backed indexes read the new values a column at a time
+            index._update_range(first, count)
+        else:
+            indexen.append(index)
+    if not indexen:
+        return
+    for recnum in range(first, first + count):
+        record = table._table[recnum]
+        for index in indexen:
+            index(record)
+
+def append_columns(table, data, drop=False):
+    """
+    Appends one record per row of data, returns the number of records added
+    """
+    require_numpy()
+    meta = table._meta
+    header = meta.header
+    if meta.status != READ_WRITE:
+        raise DbfError('%s not in read/write mode, unable to append records' % meta.filename)
+    if not table.field_count:
+        raise DbfError("No fields defined, cannot append")
+    columns, count = column_data(table, data, drop)
+    if header.record_count + count > meta.max_records:
+        raise DbfError("table %r is full; unable to add %d more records" % (table, count))
+    if not count:
+        return 0
+    blank = np.frombuffer(meta.blankrecord.tobytes(), dtype=np.uint8)
+    block = np.tile(blank, (count, 1))
+    fill_block(block, columns, meta)
+    first = header.record_count
+    records = table._table
+    if meta.location == ON_DISK:
+        meta.dfd.seek(header.start + first * header.record_length)
+        meta.dfd.write(block.tobytes())
+        records._max_count += count
+    else:
+        for i in range(count):
+            records.append(Record(first + i, meta, kamikaze=block[i].tobytes()))
+    header.record_count = first + count
+    table._update_disk(headeronly=True)
+    update_indexes(table, first, count)
+    return count
+
+def write_columns(table, data, start=0):
+    """
+    Overwrites the given fields of records start..start+len(data)-1 in
+    place, returns the number of records written
+    """
+    require_numpy()
+    meta = table._meta
+    header = meta.header
+    if meta.status != READ_WRITE:
+        raise DbfError('%s not in read/write mode, unable to write columns' % meta.filename)
+    columns, count = column_data(table, data)
+    if not 0 <= start <= start + count <= header.record_count:
+        raise DbfError('records %d..%d are not all in table %s'
+                % (start, start + count - 1, meta.filename))
+    if not count:
+        return 0
+    length = header.record_length
+    records = table._table
+    if meta.location == ON_DISK:
+        # records in a 'with record' block would be overwritten with stale data
+        records.flush()
+        location = header.start + start * length
+        meta.dfd.seek(location)
+        block = np.frombuffer(meta.dfd.read(count * length), dtype=np.uint8).reshape(count, length).copy()
+        fill_block(block, columns, meta)
+        meta.dfd.seek(location)
+        meta.dfd.write(block.tobytes())
+        if meta.record_cache is not None:
+            for recnum in range(start, start + count):
+                meta.record_cache.discard(recnum)
+        # keep records that are still in use in step with the disk
+        for recnum, ref in list(records._weakref_list.items()):
+            record = ref()
+            if record is not None and start <= recnum < start + count:
+                record._data = array('B', block[recnum - start].tobytes())
+    else:
+        block = np.array([record._data for record in records[start:start + count]], dtype=np.uint8)
+        fill_block(block, columns, meta)
+        for i, record in enumerate(records[start:start + count]):
+            record._data = array('B', block[i].tobytes())
+    update_indexes(table, start, count)
+    return count
+
+def compact_file(meta, keep, chunk_size=65536):
+    """
+    Moves the records flagged in keep to the front of the record block,
+    a chunk at a time through a writable memory map of the file
+    """
+    header = meta.header
+    length = header.record_length
+    count = len(keep)
+    meta.dfd.flush()
+    with mmap.mmap(meta.dfd.fileno(), header.start + count * length) as data:
+        block = np.frombuffer(data, dtype=np.uint8, count=count * length, offset=header.start).reshape(count, length)
+        kept = 0
+        for first in range(0, count, chunk_size):
+            wanted = keep[first:first + chunk_size]
+            if kept == first and wanted.all():
+                # nothing removed so far: these records stay where they are
+                kept += len(wanted)
+                continue
+            # the kept records are copied out before being written back at
+            # or before first, so records not yet moved are never overwritten
+            chunk = block[first:first + chunk_size][wanted]
+            block[kept:kept + len(chunk)] = chunk
+            kept += len(chunk)
+        # the map cannot close while arrays still use it
+        del block
+        data.flush()
+
+def pack_records(table):
+    """
+    Physically removes the records marked deleted, with one pass over the
+    record block; indexes are remapped, not rebuilt.  Returns the number
+    of records removed
+    """
+    require_numpy()
+    meta = table._meta
+    header = meta.header
+    records = table._table
+    flags = record_block(table, record_layout(meta, []))[DELETED_FLAG]
+    keep = flags != b'*'
+    # drop the read-only map before the file shrinks
+    del flags
+    count = len(keep)
+    kept = int(np.count_nonzero(keep))
+    if kept == count:
+        return 0
+    # new record number of each old record, -1 if removed
+    translation = np.full(count, -1, dtype=np.int64)
+    translation[keep] = np.arange(kept)
+    if meta.location == ON_DISK:
+        # records in a 'with record' block would be written to the wrong place
+        records.flush()
+        compact_file(meta, keep)
+        meta.dfd.truncate(header.start + kept * header.record_length)
+        live = {}
+        for recnum, ref in records._weakref_list.items():
+            record = ref()
+            if record is None:
+                continue
+            record._recnum = int(translation[recnum]) if recnum < count else -1
+            if record._recnum >= 0:
+                live[record._recnum] = ref
+        records._weakref_list = live
+        records._max_count = kept
+        records._next_read = 0
+        if meta.record_cache is not None:
+            meta.record_cache.clear()
+    else:
+        survivors = []
+        for record, wanted in zip(records, keep.tolist()):
+            if wanted:
+                record._recnum = len(survivors)
+                survivors.append(record)
+            else:
+                record._recnum = -1
+        records[:] = survivors
+    header.record_count = kept
+    table._pack_count += 1
+    table._index = -1
+    table._update_disk(headeronly=True)
+    for index in table._indexen:
+        index._remap(translation)
+    return count - kept
+
+def add_computed_field(table, field_spec, func, fields=None):
+    """
+    Adds the field described by field_spec, filled with func(columns),
+    where columns is {field_name: values} of fields as returned by
+    table_columns(); the table file is rewritten once
+    """
+    require_numpy()
+    meta = table._meta
+    header = meta.header
+    if meta.status != READ_WRITE:
+        raise DbfError('%s not in read/write mode, unable to add fields' % meta.filename)
+    # lay out and encode the new field in a scratch table first, so that
+    # bad specs or values fail before the table is touched
+    scratch = Table(
+            ':memory:', [field_spec],
+            codepage=table.codepage.name,
+            dbf_type=table._versionabbr,
+            on_disk=False,
+            )
+    if len(scratch.field_names) != 1:
+        raise FieldSpecError('add_computed_field() adds exactly one field, not %r' % field_spec)
+    name = scratch.field_names[0]
+    if name in table.field_names:
+        raise DbfError("Field '%s' already exists" % name)
+    # the limits add_fields() enforces, checked before the table is touched
+    structure = table.structure() + [field_spec]
+    if len(structure) + any('NULL' in spec.upper() for spec in structure) > meta.max_fields:
+        raise DbfError('Adding a field to %s would exceed the limit of %d fields'
+                % (meta.filename, meta.max_fields))
+    # the scratch record has its own deletion flag
+    if header.record_length + scratch._meta.header.record_length - 1 > 65535:
+        raise DataOverflowError('Adding field %s to %s would exceed the record length of 65535'
+                % (name, meta.filename))
+    record_numbers, columns = table_columns(table, fields)
+    values = np.asarray(func(columns))
+    count = len(table)
+    if values.shape != (count, ):
+        raise DbfError('computed field %s needs %d values, not %r' % (name, count, values.shape))
+    encoded = encode_column(values, scratch._meta[name], scratch._meta, name)
+    if meta.memofields or meta.location != ON_DISK:
+        # restructuring as below would start a new memo file; memory
+        # tables are cheap to restructure record by record
+        table.add_fields(field_spec)
+        return write_columns(table, {name: values})
+
+    # (name, start, length) of the deletion flag and the existing fields
+    old_layout = [(None, 0, 1)] + [(f, meta[f][START], meta[f][LENGTH]) for f in meta.fields]
+    old_length = header.record_length
+    records = table._table
+    records.flush()
+    meta.dfd.seek(header.start)
+    old_block = np.frombuffer(meta.dfd.read(count * old_length), dtype=np.uint8).reshape(count, old_length)
+    # an empty table is restructured without backup and re-append
+    header.record_count = 0
+    records.clear()
+    try:
+        table.add_fields(field_spec)
+    except Exception:
+        # the records are still on disk, in the old layout
+        header.record_count = count
+        records._max_count = count
+        raise
+    block = np.tile(np.frombuffer(meta.blankrecord.tobytes(), dtype=np.uint8), (count, 1))
+    for old_name, old_start, length in old_layout:
+        new_start = 0 if old_name is None else meta[old_name][START]
+        block[:, new_start:new_start + length] = old_block[:, old_start:old_start + length]
+    start = meta[name][START]
+    block[:, start:start + meta[name][LENGTH]] = encoded
+    meta.dfd.seek(header.start)
+    meta.dfd.write(block.tobytes())
+    records._max_count = count
+    header.record_count = count
+    table._update_disk(headeronly=True)
+    update_indexes(table, 0, count)
+    return count
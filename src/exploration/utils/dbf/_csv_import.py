@@ -0,0 +1,234 @@
+"""
+streaming import of csv files into dbf tables
+
+The csv file is read a chunk of rows at a time by pandas.  A first
+pass over the sample (by default the whole file) infers the type and
+width of each column:
+
+    Logical     --> all values are T, F, Y, N, TRUE, FALSE, YES, NO, or ?
+    Date        --> all values are YYYY-MM-DD dates
+    Numeric     --> all values are decimal numbers of up to 15 digits,
+                    without leading zeros (so FIPS codes stay text)
+    Character   --> anything else, up to 255 characters wide
+    Memo        --> wider text
+
+Blank values do not count.  The table is then created once, and the
+second pass appends each chunk with Table.append_many(); values beyond
+the sample that do not fit the fields, such as numbers with more
+decimals, raise a DbfError instead of being rounded or cut:
+
+    table = dbf.from_csv('counties.csv', filename='counties.dbf', header=True)
+
+Memory use is bounded by the chunk size, not by the size of the file.
+Before the two passes, the csv module counts the columns of the
+longest row, so the file is read up to three times in all.
+Requires numpy and pandas.
+"""
+from __future__ import print_function
+
+import csv
+import os
+import re
+
+from ._columnar import np, require_numpy
+from . import (
+        CHAR, CURRENCY, DATE, DECIMALS, DOUBLE, FLOAT, INTEGER, LOGICAL, NUMERIC, READ_WRITE, TYPE,
+        DbfError, Table,
+        )
+
+logical_values = {
+        'T': True, 'TRUE': True, 'Y': True, 'YES': True,
+        'F': False, 'FALSE': False, 'N': False, 'NO': False,
+        '?': None,
+        }
+numeric_types = (CURRENCY, DOUBLE, FLOAT, INTEGER, NUMERIC)
+number_pattern = r'[+-]?(?:(?:0|[1-9]\d*)(?:\.\d*)?|\.\d+)'
+date_pattern = r'\d{4}-\d{2}-\d{2}'
+max_digits = 15
+
+
+class ColumnGuess(object):
+    """
+    what the values of one column seen so far allow it to be
+    """
+
+    __slots__ = 'logical', 'date', 'numeric', 'width', 'digits', 'int_width', 'decimals', 'seen'
+
+    def __init__(self):
+        self.logical = self.date = self.numeric = True
+        self.width = self.digits = self.int_width = self.decimals = 0
+        self.seen = False
+
+    def update(self, values):
+        """
+        narrows the guess with values, a Series of stripped strings
+        """
+        values = values[values != '']
+        if not len(values):
+            return
+        self.seen = True
+        lengths = values.str.len()
+        self.width = max(self.width, int(lengths.max()))
+        if self.logical:
+            self.logical = bool(values.str.upper().isin(logical_values).all())
+        if self.date:
+            self.date = bool(values.str.fullmatch(date_pattern).all()) and \
+                    not values.pipe(parse_dates, errors='coerce').isna().any()
+        if self.numeric:
+            self.numeric = bool(values.str.fullmatch(number_pattern).all())
+            if self.numeric:
+                point = values.str.find('.')
+                has_point = point >= 0
+                self.decimals = max(self.decimals, int(decimal_places(values).max()))
+                # width left of the point as formatted by dbf: '.5' is '0.5'
+                signed = values.str.startswith('-') | values.str.startswith('+')
+                digits = (point.where(has_point, lengths) - signed).clip(lower=1)
+                int_width = digits + values.str.startswith('-')
+                self.digits = max(self.digits, int(digits.max()))
+                self.int_width = max(self.int_width, int(int_width.max()))
+
+    def spec(self, name, min_field_size):
+        """
+        returns the field specification of the column
+        """
+        if not self.seen:
+            return '%s C(%d)' % (name, max(1, min_field_size))
+        if self.logical:
+            return '%s L' % name
+        if self.date:
+            return '%s D' % name
+        if self.numeric and self.digits + self.decimals <= max_digits:
+            if self.decimals:
+                return '%s N(%d,%d)' % (name, self.int_width + 1 + self.decimals, self.decimals)
+            return '%s N(%d,0)' % (name, self.int_width)
+        width = max(self.width, min_field_size)
+        if width > 255:
+            return '%s M' % name
+        return '%s C(%d)' % (name, width)
+
+
+def decimal_places(values):
+    """
+    returns the number of digits after the point of each of values
+    """
+    point = values.str.find('.')
+    return (values.str.len() - point - 1).where(point >= 0, 0)
+
+def parse_dates(values, errors='raise'):
+    import pandas as pd
+    return pd.to_datetime(values, format='%Y-%m-%d', errors=errors)
+
+def field_name(name, taken):
+    """
+    returns name made into a valid, unused dbf field name
+    """
+    name = re.sub(r'\W', '_', str(name).strip(), flags=re.ASCII)[:10] or 'f'
+    if not name[0].isalpha():
+        name = ('f' + name)[:10]
+    candidate, i = name, 0
+    while candidate.upper() in taken:
+        i += 1
+        candidate = '%s%d' % (name[:10 - len(str(i))], i)
+    taken.add(candidate.upper())
+    return candidate
+
+def read_chunks(csvfile, column_count, encoding, errors, chunk_size, skip_rows, rows=None):
+    """
+    yields DataFrames of up to chunk_size rows of csvfile, all values as
+    stripped strings; columns are numbered
+    """
+    import pandas as pd
+    reader = pd.read_csv(
+            csvfile, header=None, names=range(column_count), dtype=str,
+            keep_default_na=False, na_filter=False, skiprows=skip_rows, nrows=rows,
+            encoding=encoding, encoding_errors=errors or 'strict',
+            chunksize=chunk_size, engine='c',
+            )
+    with reader:
+        for chunk in reader:
+            yield chunk.fillna('').apply(lambda column: column.str.strip())
+
+def column_values(values, table, name):
+    """
+    returns the strings of one column converted for field name of table
+    """
+    meta = table._meta
+    field_type = meta[name][TYPE]
+    blank = values == ''
+    if field_type == LOGICAL:
+        return values.str.upper().map(logical_values).where(~blank, None).to_numpy(dtype=object)
+    elif field_type == DATE:
+        return parse_dates(values.where(~blank, None)).to_numpy(dtype='M8[D]')
+    elif field_type in numeric_types:
+        import pandas as pd
+        if field_type in (FLOAT, NUMERIC):
+            # dbf would round the extra digits away
+            decimals = decimal_places(values.str.rstrip('0'))
+            if len(decimals) and decimals.max() > meta[name][DECIMALS]:
+                raise ValueError('%r has more than %d decimals'
+                        % (values[decimals.idxmax()], meta[name][DECIMALS]))
+        return pd.to_numeric(values.where(~blank, None)).to_numpy(dtype=np.float64, na_value=np.nan)
+    elif field_type == CHAR:
+        return values.to_numpy(dtype=str)
+    return values.where(~blank, None).to_numpy(dtype=object)
+
+def import_csv(csvfile, filename=None, to_disk=False, field_names=None, extra_fields=None,
+               dbf_type='db3', memo_size=64, min_field_size=1, encoding=None, errors=None,
+               header=False, sample_rows=None, chunk_size=65536):
+    """
+    creates a table from csvfile, with field types inferred from the
+    first sample_rows rows (default: all), and appends chunk_size rows at
+    a time; returns the (closed) table
+    """
+    require_numpy()
+    try:
+        import pandas
+    except ImportError:
+        raise DbfError('pandas is required for dbf.from_csv()').from_exc(None)
+    read_encoding = encoding or 'latin-1'
+    with open(csvfile, 'r', encoding=read_encoding, errors=errors or 'strict', newline='') as fd:
+        reader = csv.reader(fd)
+        first_row = next(reader, [])
+        column_count = max(len(first_row), max(map(len, reader), default=0))
+    skip_rows = 1 if header else 0
+    if isinstance(field_names, str):
+        field_names = field_names.split()
+    field_names = list(field_names or [])
+    column_count = max(column_count, len(field_names), 1)
+    taken = set(name.split()[0].upper() for name in field_names)
+    for i in range(len(field_names), column_count):
+        name = first_row[i] if header and i < len(first_row) else 'f%d' % i
+        field_names.append(field_name(name, taken))
+
+    # pass 1: infer the fields not given with a type
+    guesses = dict((i, ColumnGuess()) for i, name in enumerate(field_names) if ' ' not in name)
+    if guesses:
+        for chunk in read_chunks(csvfile, column_count, read_encoding, errors, chunk_size, skip_rows, sample_rows):
+            for i, guess in guesses.items():
+                guess.update(chunk[i])
+    specs = [guesses[i].spec(name, min_field_size) if i in guesses else name
+             for i, name in enumerate(field_names)]
+
+    if filename:
+        to_disk = True
+    else:
+        filename = os.path.splitext(csvfile)[0]
+    if to_disk:
+        table = Table(filename, specs, dbf_type=dbf_type, memo_size=memo_size, codepage=encoding)
+    else:
+        table = Table(':memory:', specs, dbf_type=dbf_type, memo_size=memo_size, codepage=encoding, on_disk=False)
+    # pass 2: append the rows a chunk at a time
+    names = table.field_names
+    table.open(READ_WRITE)
+    try:
+        for chunk in read_chunks(csvfile, column_count, read_encoding, errors, chunk_size, skip_rows):
+            try:
+                columns = dict((name, column_values(chunk[i], table, name)) for i, name in enumerate(names))
+            except ValueError as exc:
+                raise DbfError('%s: value does not fit the field types: %s' % (csvfile, exc))
+            table.append_many(columns)
+        if extra_fields:
+            table.add_fields(extra_fields)
+    finally:
+        table.close()
+    return table
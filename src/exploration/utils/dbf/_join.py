@@ -0,0 +1,133 @@
+"""
+set-oriented joins between the tables of a Relation
+
+relation[record] finds the target records of one source record
+through an Index that is built record by record.  Relation.join()
+instead reads the source and target key columns with the columnar
+reader, builds a hash table over the target keys once, and probes it
+with all source keys at the same time (pandas.merge):
+
+    fips = dbf.Relation((counties, 'FIPS'), (geocodes, 'FIPS'))
+    with counties, geocodes:
+        src, tgt = fips.join(validate='n:1')        # aligned record numbers
+        df = fips.join_frame(tgt_fields='LAT, LON', how='left')
+
+Keys are compared as decoded by to_numpy(): character keys without
+trailing padding, numbers as numbers.  Blank numeric and date keys
+match nothing.  Record pairs come in source record order, and the
+target records of one source record in target record order.
+
+validate checks the keys before joining:
+
+    '1:1'   --> source keys and target keys are unique
+    '1:n'   --> source keys are unique
+    'n:1'   --> target keys are unique
+
+Requires numpy and pandas.
+"""
+from __future__ import print_function
+
+from ._columnar import np, require_numpy, resolve_fields, table_columns, table_frame
+from . import DbfError, baseinteger, recno, source_table
+
+join_types = ('inner', 'left')
+validations = {
+        '1:1': (True, True),
+        '1:n': (True, False),
+        'n:1': (False, True),
+        None: (False, False),
+        }
+
+
+def key_frame(table, field, record_numbers=None):
+    """
+    Returns a DataFrame of the key column of field and the record
+    numbers, for record_numbers (default: all records) of table
+    """
+    import pandas as pd
+    name, = resolve_fields(table, field)
+    all_numbers, columns = table_columns(table, [name])
+    keys = columns[name]
+    if record_numbers is None:
+        record_numbers = all_numbers
+    else:
+        keys = keys[record_numbers]
+    return pd.DataFrame({'key': keys, 'recno': record_numbers})
+
+def source_numbers(table, src_records):
+    """
+    Returns the record numbers of src_records, records of table or
+    record numbers, as an array; None stands for all records
+    """
+    if src_records is None:
+        return None
+    src_records = list(src_records)
+    if all(isinstance(item, (baseinteger, np.integer)) for item in src_records):
+        numbers = np.array(src_records, dtype=np.int64)
+    else:
+        for record in src_records:
+            if source_table(record) is not table:
+                raise DbfError('%r is not a record of %s' % (record, table.filename))
+        numbers = np.array([recno(record) for record in src_records], dtype=np.int64)
+    if len(numbers) and not (0 <= numbers.min() and numbers.max() < len(table)):
+        raise DbfError('record numbers are not all in table %s' % table.filename)
+    return numbers
+
+def join_records(relation, src_records=None, how='inner', validate=None):
+    """
+    Returns (source record numbers, target record numbers) of the
+    matching records, as two aligned int64 arrays; with how='left',
+    source records without a match are paired with -1
+    """
+    require_numpy()
+    try:
+        import pandas as pd
+    except ImportError:
+        raise DbfError('pandas is required for Relation.join()').from_exc(None)
+    if how not in join_types:
+        raise DbfError("how must be one of %s, not %r" % (', '.join(join_types), how))
+    if validate not in validations:
+        raise DbfError("validate must be '1:1', '1:n', or 'n:1', not %r" % (validate, ))
+    source = key_frame(
+            relation.src_table, relation.src_field,
+            source_numbers(relation.src_table, src_records),
+            )
+    source['position'] = np.arange(len(source))
+    target = key_frame(relation.tgt_table, relation.tgt_field)
+    # missing keys match nothing; a left join keeps them unmatched
+    target = target[target.key.notna()]
+    matched = source[source.key.notna()]
+    unique_source, unique_target = validations[validate]
+    if unique_source and matched.key.duplicated().any():
+        raise DbfError('%s is not a %s relation: source keys repeat' % (relation, validate))
+    if unique_target and target.key.duplicated().any():
+        raise DbfError('%s is not a %s relation: target keys repeat' % (relation, validate))
+    try:
+        merged = (source if how == 'left' else matched).merge(
+                target, on='key', how=how, suffixes=('_src', '_tgt'), sort=False,
+                )
+    except ValueError as exc:
+        raise DbfError('%s: keys cannot be compared: %s' % (relation, exc)).from_exc(None)
+    src = merged.recno_src.to_numpy(dtype=np.int64)
+    tgt = merged.recno_tgt.fillna(-1).to_numpy(dtype=np.int64)
+    order = np.lexsort((tgt, merged.position.to_numpy()))
+    return src[order], tgt[order]
+
+def join_frame(relation, src_records=None, src_fields=None, tgt_fields=None, how='inner', validate=None):
+    """
+    Returns the joined records as a DataFrame of src_fields and
+    tgt_fields (default: all), indexed by (src_recno, tgt_recno)
+    """
+    import pandas as pd
+    src, tgt = join_records(relation, src_records, how, validate)
+    left = table_frame(relation.src_table, src_fields).iloc[src]
+    right = table_frame(relation.tgt_table, tgt_fields).reindex(tgt)
+    tgt_key, = resolve_fields(relation.tgt_table, relation.tgt_field)
+    src_key, = resolve_fields(relation.src_table, relation.src_field)
+    if tgt_key == src_key and tgt_key in left.columns:
+        # same values as the source key, where there is a match
+        right = right.drop(columns=[tgt_key], errors='ignore')
+    right = right.rename(columns=dict((name, name + '_tgt') for name in right.columns if name in left.columns))
+    frame = pd.concat([left.reset_index(drop=True), right.reset_index(drop=True)], axis=1)
+    frame.index = pd.MultiIndex.from_arrays([src, tgt], names=['src_recno', 'tgt_recno'])
+    return frame
@@ -0,0 +1,158 @@
+"""
+parallel scans over the records of a disk table
+
+Iter, scan, Process, and pql visit the records one after the other, in
+one process.  parallel_map() and parallel_query() split the record
+range into one contiguous shard per worker; each worker process opens
+the file again (read-only), maps it, and works through its own shard:
+
+    def margin(record):
+        votes = dbf.values(record)
+        ...
+
+    with counties:
+        margins = dbf.parallel_map(counties, margin, workers=8)
+        swing = dbf.parallel_query(counties, "share > 0.45 and share < 0.55")
+
+Results are merged in record order.  func is sent to the workers, so
+it has to be picklable -- a function defined at module level, not a
+lambda.  Records handed to func are read-only; changes made by the
+workers are not seen by the table.
+
+Changes to a table open read-write are written to the file before the
+workers start.  Indexes of the table are not used by the workers.
+parallel_query() requires numpy.
+"""
+from __future__ import print_function
+
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from ._columnar import np, require_numpy
+from ._query import ColumnSource, compile_criteria
+from . import CLOSED, ON_DISK, READ_ONLY, READ_WRITE, DbfError, Record, Table
+
+
+def shard_bounds(count, shards):
+    """
+    Returns [(start, stop)] of at most shards contiguous ranges that
+    cover range(count), with sizes differing by at most one
+    """
+    shards = max(1, min(shards, count))
+    size, extra = divmod(count, shards)
+    bounds = []
+    start = 0
+    for shard in range(shards):
+        stop = start + size + (shard < extra)
+        bounds.append((start, stop))
+        start = stop
+    return bounds
+
+def open_shard(filename, dbf_type):
+    """
+    Returns the table in filename, opened read-only
+    """
+    table = Table(filename, dbf_type=dbf_type)
+    table.open(READ_ONLY)
+    return table
+
+def map_shard(filename, dbf_type, start, stop, func, skip_deleted):
+    """
+    Returns [func(record)] for the records start to stop of the table
+    in filename, read from a memory map of the file
+    """
+    table = open_shard(filename, dbf_type)
+    try:
+        meta = table._meta
+        header = meta.header
+        size = header.record_length
+        results = []
+        with open(filename, 'rb') as dfd:
+            data = mmap.mmap(dfd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for recnum in range(start, stop):
+                offset = header.start + recnum * size
+                raw = data[offset:offset + size]
+                if skip_deleted and raw[0:1] == b'*':
+                    continue
+                results.append(func(Record(recnum, meta, kamikaze=raw, _fromdisk=True)))
+        finally:
+            data.close()
+        return results
+    finally:
+        table.close()
+
+def query_shard(filename, dbf_type, start, stop, criteria):
+    """
+    Returns the record numbers from start to stop of the table in
+    filename that match criteria
+    """
+    table = open_shard(filename, dbf_type)
+    try:
+        source = ColumnSource(table)
+        source.restrict(np.arange(start, min(stop, len(source))))
+        matched = compile_criteria(criteria).evaluate(source)
+        matched = np.broadcast_to(np.asarray(matched).astype(bool), (len(source), ))
+        return source.record_numbers[matched]
+    finally:
+        table.close()
+
+def run_shards(table, shard_func, args, workers=None):
+    """
+    Returns [shard_func(filename, dbf_type, start, stop, *args)] for the
+    shards of table, in record order; each shard runs in its own process
+    """
+    meta = table._meta
+    if meta.location != ON_DISK:
+        raise DbfError('%s is not on disk; parallel scans reopen the file' % meta.filename)
+    if meta.status == CLOSED:
+        raise DbfError('%s is closed' % meta.filename)
+    if meta.status == READ_WRITE:
+        # the workers read the header and records from the file
+        table._update_disk(headeronly=True)
+        meta.dfd.flush()
+        if meta.mfd is not None:
+            meta.mfd.flush()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise DbfError('workers must be at least 1, not %r' % (workers, ))
+    bounds = shard_bounds(len(table), workers)
+    dbf_type = table._versionabbr
+    if len(bounds) == 1:
+        start, stop = bounds[0]
+        return [shard_func(meta.filename, dbf_type, start, stop, *args)]
+    with ProcessPoolExecutor(max_workers=len(bounds)) as pool:
+        futures = [
+                pool.submit(shard_func, meta.filename, dbf_type, start, stop, *args)
+                for start, stop in bounds
+                ]
+        return [future.result() for future in futures]
+
+def parallel_map(table, func, workers=None, skip_deleted=False):
+    """
+    Returns [func(record)] for the records of table, in record order,
+    with the records split among workers processes
+    """
+    results = []
+    for shard in run_shards(table, map_shard, (func, skip_deleted), workers):
+        results.extend(shard)
+    return results
+
+def parallel_query(table, criteria, workers=None, mask=False):
+    """
+    Returns the record numbers of the records of table matching
+    criteria, or a boolean mask over all records if mask is True,
+    with the records split among workers processes
+    """
+    require_numpy()
+    # bad criteria fail here, not in every worker
+    compile_criteria(criteria)
+    shards = run_shards(table, query_shard, (criteria, ), workers)
+    record_numbers = np.concatenate(shards) if shards else np.empty(0, dtype=np.int64)
+    if mask:
+        result = np.zeros(len(table), dtype=bool)
+        result[record_numbers] = True
+        return result
+    return record_numbers
@@ -0,0 +1,468 @@
+"""
+column-wise evaluation of pql criteria
+
+pql criteria are Python expressions over the (lower-case) field names
+of a table:
+
+    votes > 1000 and statefp in ('04', '55') and not is_deleted()
+
+pql_criteria() turns them into a loop that binds every referenced field
+of every record.  Here the criteria are parsed once into an expression
+tree (cached by criteria string) that is evaluated over whole columns
+decoded by _columnar.  Comparisons of a field with a constant use an
+index on that field, if the table has one (table.create_index('VOTES')),
+and only the candidate records found through the index are decoded.
+
+Supported: and, or, not, comparisons (including chains, in, not in),
++ - * / %, the string methods strip, lstrip, rstrip, upper, lower,
+startswith, endswith on fields, and recno(), is_deleted().  As with
+to_numpy(), character fields are compared without trailing padding.
+"""
+from __future__ import print_function
+
+import ast
+import datetime
+
+from ._columnar import (
+        DELETED_FLAG, decode_column, fill_missing, np, record_block,
+        record_layout, require_numpy,
+        )
+from . import (
+        CHAR, CLOSED, CURRENCY, DATE, DOUBLE, FLOAT, INTEGER, LENGTH, NUMERIC, TYPE,
+        DbfError, FieldMissingError, basestring,
+        )
+
+## compiled criteria, keyed by criteria string
+compiled_criteria = {}
+max_compiled_criteria = 256
+
+comparisons = {
+        ast.Eq: '==',
+        ast.NotEq: '!=',
+        ast.Lt: '<',
+        ast.LtE: '<=',
+        ast.Gt: '>',
+        ast.GtE: '>=',
+        ast.In: 'in',
+        ast.NotIn: 'not in',
+        }
+
+## comparison after swapping its operands
+flipped = {'==': '==', '!=': '!=', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+arithmetic = {
+        ast.Add: np.add if np is not None else None,
+        ast.Sub: np.subtract if np is not None else None,
+        ast.Mult: np.multiply if np is not None else None,
+        ast.Div: np.true_divide if np is not None else None,
+        ast.Mod: np.mod if np is not None else None,
+        }
+
+string_methods = {
+        'strip': lambda values: np.char.strip(values),
+        'lstrip': lambda values: np.char.lstrip(values),
+        'rstrip': lambda values: np.char.rstrip(values),
+        'upper': lambda values: np.char.upper(values),
+        'lower': lambda values: np.char.lower(values),
+        'startswith': lambda values, prefix: np.char.startswith(values, prefix),
+        'endswith': lambda values, suffix: np.char.endswith(values, suffix),
+        }
+
+## field types whose indexes can answer range queries
+ordered_types = (CURRENCY, DATE, DOUBLE, FLOAT, INTEGER, NUMERIC)
+
+## comparisons an index on the field can answer: whether the value is
+## the low and the high end of the key range, and whether the ends are
+## included; others ('!=', 'not in') are evaluated without the index
+index_bounds = {
+        '==': (True, True, True, True),
+        'in': (True, True, True, True),
+        '<': (False, True, True, False),
+        '<=': (False, True, True, True),
+        '>': (True, False, False, True),
+        '>=': (True, False, True, True),
+        }
+
+
+class ColumnSource(object):
+    """
+    the records a criteria is evaluated over -- all records of a table,
+    or the candidates found through indexes -- with columns decoded on
+    first use
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.meta = meta = table._meta
+        self.stored = dict((name.upper(), name) for name in meta.user_fields)
+        self.block = record_block(table, record_layout(meta, list(meta.user_fields)))
+        self.record_numbers = np.arange(len(self.block))
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.record_numbers)
+
+    def field_name(self, name):
+        try:
+            return self.stored[name.upper()]
+        except KeyError:
+            raise FieldMissingError('%s: no such field in table' % name)
+
+    def column(self, name):
+        name = self.field_name(name)
+        values = self.columns.get(name)
+        if values is None:
+            values, missing = decode_column(self.block[name], self.meta[name], self.meta)
+            values = self.columns[name] = fill_missing(values, missing)
+        return values
+
+    def deleted(self):
+        return self.block[DELETED_FLAG] == b'*'
+
+    def restrict(self, record_numbers):
+        """
+        only evaluate over record_numbers from now on
+        """
+        self.record_numbers = record_numbers
+        self.block = self.block[record_numbers]
+        self.columns.clear()
+
+    def index_candidates(self, name, op, value):
+        """
+        returns the sorted record numbers an index on name finds for
+        'name op value', or None if no index can answer it
+        """
+        name = self.field_name(name)
+        for index in self.table._indexen:
+            if index.fields == (name.upper(), ):
+                break
+        else:
+            return None
+        fielddef = self.meta[name]
+        field_type = fielddef[TYPE]
+        if op not in index_bounds:
+            # e.g. 'not in'; evaluated without the index
+            return None
+        values = value if op == 'in' else (value, )
+        if field_type == CHAR:
+            # index keys keep the padding
+            if op not in ('==', 'in') or not all(isinstance(v, basestring) for v in values):
+                return None
+            values = [v.ljust(fielddef[LENGTH]) for v in values]
+        elif field_type in ordered_types:
+            if field_type == DATE:
+                try:
+                    values = [as_date(v) for v in values]
+                except ValueError:
+                    return None
+        else:
+            return None
+        low, high, include_low, include_high = index_bounds[op]
+        bounds = [
+                (v if low else None, v if high else None, include_low, include_high)
+                for v in values
+                ]
+        found = []
+        try:
+            for low, high, include_low, include_high in bounds:
+                found.extend(index.search_range(low, high, include_low, include_high))
+        except TypeError:
+            # keys that do not compare with the value, e.g. None
+            return None
+        return np.unique(np.array(found, dtype=np.int64))
+
+
+class Node(object):
+    """
+    expression tree node
+    """
+
+    def evaluate(self, source):
+        """
+        returns the value of the node for all records of source
+        """
+        raise NotImplementedError
+
+    def candidates(self, source):
+        """
+        returns sorted record numbers that include all matches, or None
+        """
+        return None
+
+
+class Constant(Node):
+
+    def __init__(self, value):
+        self.value = value
+
+    def evaluate(self, source):
+        return self.value
+
+
+class FieldRef(Node):
+
+    def __init__(self, name):
+        self.name = name
+
+    def evaluate(self, source):
+        return source.column(self.name)
+
+
+class Function(Node):
+    """
+    recno() or is_deleted()
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def evaluate(self, source):
+        if self.name == 'recno':
+            return source.record_numbers
+        return source.deleted()
+
+
+class Method(Node):
+    """
+    string method called on a field value
+    """
+
+    def __init__(self, target, name, args):
+        self.target = target
+        self.name = name
+        self.args = args
+
+    def evaluate(self, source):
+        args = [arg.evaluate(source) for arg in self.args]
+        return string_methods[self.name](self.target.evaluate(source), *args)
+
+
+class Arithmetic(Node):
+
+    def __init__(self, operation, left, right):
+        self.operation = operation
+        self.left = left
+        self.right = right
+
+    def evaluate(self, source):
+        return self.operation(self.left.evaluate(source), self.right.evaluate(source))
+
+
+class Comparison(Node):
+
+    def __init__(self, left, ops, comparators):
+        self.left = left
+        self.ops = ops
+        self.comparators = comparators
+
+    def evaluate(self, source):
+        result = True
+        left_node, left = self.left, self.left.evaluate(source)
+        for op, comparator in zip(self.ops, self.comparators):
+            right = comparator.evaluate(source)
+            field = left_node if isinstance(left_node, FieldRef) else comparator
+            field = source.field_name(field.name) if isinstance(field, FieldRef) else None
+            matched = compare(op, left, right, field)
+            result = np.logical_and(result, matched)
+            left_node, left = comparator, right
+        return result
+
+    def candidates(self, source):
+        if len(self.ops) != 1:
+            return None
+        op, right = self.ops[0], self.comparators[0]
+        if isinstance(self.left, FieldRef) and isinstance(right, Constant):
+            return source.index_candidates(self.left.name, op, right.value)
+        elif isinstance(self.left, Constant) and isinstance(right, FieldRef) and op in flipped:
+            return source.index_candidates(right.name, flipped[op], self.left.value)
+        return None
+
+
+class BoolOp(Node):
+
+    def __init__(self, op, operands):
+        self.op = op
+        self.operands = operands
+
+    def evaluate(self, source):
+        combine = np.logical_and if self.op == 'and' else np.logical_or
+        result = self.operands[0].evaluate(source)
+        for operand in self.operands[1:]:
+            result = combine(result, operand.evaluate(source))
+        return result
+
+    def candidates(self, source):
+        found = [operand.candidates(source) for operand in self.operands]
+        if self.op == 'and':
+            found = [f for f in found if f is not None]
+            if not found:
+                return None
+            result = found[0]
+            for f in found[1:]:
+                result = np.intersect1d(result, f, assume_unique=True)
+            return result
+        if any(f is None for f in found):
+            return None
+        return np.unique(np.concatenate(found))
+
+
+class Not(Node):
+
+    def __init__(self, operand):
+        self.operand = operand
+
+    def evaluate(self, source):
+        return np.logical_not(self.operand.evaluate(source))
+
+
+def as_date(value):
+    if isinstance(value, basestring):
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    elif isinstance(value, datetime.date):
+        return datetime.date(value.year, value.month, value.day)
+    raise ValueError('%r is not a date' % (value, ))
+
+def as_moment(value):
+    """
+    returns value as a datetime64[ms], for comparisons with datetime fields
+    """
+    if isinstance(value, basestring):
+        try:
+            return np.datetime64(value, 'ms')
+        except ValueError:
+            raise ValueError('%r is not a date or datetime' % (value, ))
+    if hasattr(value, 'hour'):
+        return np.datetime64(datetime.datetime(
+                value.year, value.month, value.day,
+                value.hour, value.minute, value.second, value.microsecond,
+                ), 'ms')
+    return np.datetime64(as_date(value), 'ms')
+
+def coerce(values, other, field=None):
+    """
+    returns other as datetime64 if values is a date or datetime column
+    (field, if known)
+    """
+    if isinstance(values, np.ndarray) and values.dtype.kind == 'M' and other is not None:
+        if np.datetime_data(values.dtype)[0] == 'D':
+            convert = lambda value: np.datetime64(as_date(value), 'D')
+        else:
+            convert = as_moment
+        try:
+            if isinstance(other, (tuple, list)):
+                return [convert(o) for o in other]
+            if not isinstance(other, np.ndarray):
+                return convert(other)
+        except ValueError:
+            # e.g. '2020-06', not a full date
+            raise DbfError('cannot compare field %s with %r' % (field or 'of dates', other)).from_exc(None)
+    return other
+
+def compare(op, left, right, field=None):
+    right = coerce(left, right, field)
+    left = coerce(right, left, field)
+    if op == 'in':
+        return np.isin(left, list(right))
+    elif op == 'not in':
+        return ~np.isin(left, list(right))
+    elif op == '==':
+        return np.equal(left, right)
+    elif op == '!=':
+        return np.not_equal(left, right)
+    elif op == '<':
+        return np.less(left, right)
+    elif op == '<=':
+        return np.less_equal(left, right)
+    elif op == '>':
+        return np.greater(left, right)
+    else:
+        return np.greater_equal(left, right)
+
+def build(node, criteria):
+    """
+    converts the Python ast of criteria into an expression tree
+    """
+    if isinstance(node, ast.Expression):
+        return build(node.body, criteria)
+    elif isinstance(node, ast.BoolOp):
+        return BoolOp(
+                'and' if isinstance(node.op, ast.And) else 'or',
+                [build(value, criteria) for value in node.values],
+                )
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return Not(build(node.operand, criteria))
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        operand = build(node.operand, criteria)
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        if isinstance(operand, Constant):
+            return Constant(-operand.value)
+        return Arithmetic(np.subtract, Constant(0), operand)
+    elif isinstance(node, ast.Compare) and all(type(op) in comparisons for op in node.ops):
+        return Comparison(
+                build(node.left, criteria),
+                [comparisons[type(op)] for op in node.ops],
+                [build(c, criteria) for c in node.comparators],
+                )
+    elif isinstance(node, ast.BinOp) and type(node.op) in arithmetic:
+        return Arithmetic(arithmetic[type(node.op)], build(node.left, criteria), build(node.right, criteria))
+    elif isinstance(node, ast.Name):
+        if node.id in ('True', 'False', 'None'):
+            return Constant({'True': True, 'False': False, 'None': None}[node.id])
+        return FieldRef(node.id)
+    elif isinstance(node, ast.Constant):
+        return Constant(node.value)
+    elif isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+        items = [build(item, criteria) for item in node.elts]
+        if all(isinstance(item, Constant) for item in items):
+            return Constant(tuple(item.value for item in items))
+    elif isinstance(node, ast.Call) and not node.keywords:
+        if isinstance(node.func, ast.Name) and node.func.id in ('recno', 'is_deleted') and not node.args:
+            return Function(node.func.id)
+        if isinstance(node.func, ast.Attribute) and node.func.attr in string_methods:
+            return Method(
+                    build(node.func.value, criteria),
+                    node.func.attr,
+                    [build(arg, criteria) for arg in node.args],
+                    )
+    raise DbfError('unable to evaluate %s in %r column-wise' % (node.__class__.__name__, criteria))
+
+def compile_criteria(criteria):
+    """
+    returns the expression tree for criteria
+    """
+    criteria = criteria.strip()
+    tree = compiled_criteria.get(criteria)
+    if tree is None:
+        try:
+            parsed = ast.parse(criteria, mode='eval')
+        except SyntaxError:
+            raise DbfError('invalid criteria: %r' % criteria).from_exc(None)
+        tree = build(parsed, criteria)
+        if len(compiled_criteria) >= max_compiled_criteria:
+            compiled_criteria.clear()
+        compiled_criteria[criteria] = tree
+    return tree
+
+def select_records(table, criteria, mask=False):
+    """
+    Returns the record numbers of the records of table matching criteria,
+    or a boolean mask over all records if mask is True
+    """
+    require_numpy()
+    meta = table._meta
+    if meta.status == CLOSED:
+        raise DbfError('%s is closed' % meta.filename)
+    tree = compile_criteria(criteria)
+    source = ColumnSource(table)
+    candidates = tree.candidates(source)
+    if candidates is not None:
+        source.restrict(candidates)
+    matched = tree.evaluate(source)
+    matched = np.broadcast_to(np.asarray(matched).astype(bool), (len(source), ))
+    record_numbers = source.record_numbers[matched]
+    if mask:
+        result = np.zeros(len(table), dtype=bool)
+        result[record_numbers] = True
+        return result
+    return record_numbers
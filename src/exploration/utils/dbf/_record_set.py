@@ -0,0 +1,233 @@
+"""
+record sets backed by arrays of record numbers
+
+dbf.List keeps a (table, record number, key) tuple per record, and a
+set of the keys; its unions and differences walk those lists.  A
+RecordSet keeps one sorted int32 array of record numbers per table,
+four bytes per record, and combines sets with np.union1d,
+np.intersect1d, and np.setdiff1d.  Records are read only when the set
+is iterated or indexed:
+
+    with counties:
+        close = dbf.record_set(counties, counties.where("share > 0.45 and share < 0.55"))
+        large = dbf.record_set(counties, counties.where("votes > 100000"))
+        for record in close & large:
+            ...
+        rest = dbf.record_set(counties) - close     # all records, less close
+
+Records are identified by table and record number, not by a key
+function; records of one table come in record number order, tables in
+the order they were first added.  Lists, tables, and other iterables
+of records are turned into RecordSets when combined with one.  As with
+List, a set becomes invalid when one of its tables is packed.
+
+Requires numpy.
+"""
+from __future__ import print_function
+
+from ._columnar import np, require_numpy
+from . import (
+        DbfError, List, NotFoundError, Record, Table,
+        baseinteger, py_ver, recno, source_table,
+        )
+
+## dtype of the record number arrays
+RECORD_NUMBER = np.int32 if np is not None else None
+
+
+class RecordSet(object):
+    """
+    set of dbf records, stored as sorted record numbers per table
+    """
+
+    _desc = ''
+
+    def __init__(self, records=None, desc=None):
+        require_numpy()
+        self._numbers = {}
+        self._tables = {}
+        if isinstance(records, RecordSet):
+            records._still_valid_check()
+            self._numbers.update(records._numbers)
+            self._tables.update(records._tables)
+        elif isinstance(records, Table):
+            self._add_numbers(records, np.arange(len(records), dtype=RECORD_NUMBER))
+        elif records is not None:
+            grouped = {}
+            for record in records:
+                grouped.setdefault(source_table(record), []).append(recno(record))
+            for table, numbers in grouped.items():
+                self._add_numbers(table, np.unique(np.array(numbers, dtype=RECORD_NUMBER)))
+        if desc is not None:
+            self._desc = desc
+
+    @classmethod
+    def from_numbers(cls, table, record_numbers, desc=None):
+        """
+        returns the set of the records of table with record_numbers, in
+        any order and possibly repeated
+        """
+        numbers = np.asarray(record_numbers)
+        if numbers.dtype == bool:
+            # a mask, as from table.where(criteria, mask=True)
+            numbers = np.flatnonzero(numbers)
+        numbers = np.unique(numbers.astype(np.int64))
+        if len(numbers) and not (0 <= numbers[0] and numbers[-1] < len(table)):
+            raise DbfError('record numbers are not all in table %s' % table.filename)
+        result = cls(desc=desc)
+        result._add_numbers(table, numbers.astype(RECORD_NUMBER))
+        return result
+
+    def __and__(self, other):
+        return self._combine(other, np.intersect1d)
+
+    def __contains__(self, record):
+        self._still_valid_check()
+        if not isinstance(record, Record):
+            raise TypeError('%r is not a record' % (record, ))
+        numbers = self._numbers.get(source_table(record))
+        if numbers is None:
+            return False
+        number = recno(record)
+        position = np.searchsorted(numbers, number)
+        return position < len(numbers) and numbers[position] == number
+
+    def __getitem__(self, index):
+        self._still_valid_check()
+        if isinstance(index, slice):
+            result = self.__class__()
+            result._tables.update(self._tables)
+            start, stop, step = index.indices(len(self))
+            positions = np.arange(start, stop, step)
+            for table, numbers, first in self._spans():
+                chosen = positions[(positions >= first) & (positions < first + len(numbers))] - first
+                result._add_numbers(table, np.unique(numbers[chosen]))
+            return result
+        elif isinstance(index, (baseinteger, np.integer)):
+            count = len(self)
+            if not -count <= index < count:
+                raise NotFoundError('Record %d is not in set.' % index)
+            index %= count
+            for table, numbers, first in self._spans():
+                if index < first + len(numbers):
+                    return table[int(numbers[index - first])]
+        raise TypeError('%r should be an int or a slice -- not a %r' % (index, type(index)))
+
+    def __iter__(self):
+        self._still_valid_check()
+        # materialize records only as they are asked for
+        for table, numbers in list(self._numbers.items()):
+            for number in numbers.tolist():
+                yield table[number]
+
+    def __len__(self):
+        return sum(len(numbers) for numbers in self._numbers.values())
+
+    if py_ver < (3, 0):
+        def __nonzero__(self):
+            self._still_valid_check()
+            return len(self) > 0
+    else:
+        def __bool__(self):
+            self._still_valid_check()
+            return len(self) > 0
+
+    def __or__(self, other):
+        return self._combine(other, np.union1d)
+
+    __add__ = __or__
+
+    def __rand__(self, other):
+        return self._combine(other, np.intersect1d, reflected=True)
+
+    def __repr__(self):
+        if self._desc:
+            return '%s(%d records, desc=%s)' % (self.__class__, len(self), self._desc)
+        return '%s(%d records)' % (self.__class__, len(self))
+
+    def __ror__(self, other):
+        return self._combine(other, np.union1d, reflected=True)
+
+    __radd__ = __ror__
+
+    def __rsub__(self, other):
+        return self._combine(other, np.setdiff1d, reflected=True)
+
+    def __sub__(self, other):
+        return self._combine(other, np.setdiff1d)
+
+    def _add_numbers(self, table, numbers):
+        """
+        sets the record numbers of table (sorted, unique); an empty array
+        removes table from the set
+        """
+        if len(numbers):
+            self._numbers[table] = numbers.astype(RECORD_NUMBER, copy=False)
+            self._tables[table] = table._pack_count
+        else:
+            self._numbers.pop(table, None)
+            self._tables.pop(table, None)
+
+    def _combine(self, other, operation, reflected=False):
+        """
+        returns the RecordSet of operation applied to the record numbers
+        of each table of self and other
+        """
+        self._still_valid_check()
+        if isinstance(other, (Table, List, list, tuple)):
+            other = self.__class__(other)
+        elif not isinstance(other, RecordSet):
+            return NotImplemented
+        other._still_valid_check()
+        left, right = (other, self) if reflected else (self, other)
+        empty = np.empty(0, dtype=RECORD_NUMBER)
+        result = self.__class__()
+        tables = list(left._numbers) + [t for t in right._numbers if t not in left._numbers]
+        for table in tables:
+            numbers = left._numbers.get(table, empty), right._numbers.get(table, empty)
+            if operation is np.union1d:
+                result._add_numbers(table, operation(*numbers))
+            else:
+                # both arrays are sorted and unique already
+                result._add_numbers(table, operation(*numbers, assume_unique=True))
+        return result
+
+    def _spans(self):
+        """
+        yields (table, record numbers, position of the first one in the set)
+        """
+        first = 0
+        for table, numbers in self._numbers.items():
+            yield table, numbers, first
+            first += len(numbers)
+
+    def _still_valid_check(self):
+        for table, last_pack in self._tables.items():
+            if last_pack != table._pack_count:
+                raise DbfError("table has been packed; record set is invalid")
+
+    def record_numbers(self, table=None):
+        """
+        returns the sorted record numbers of table (default: the only table
+        of the set) as an int32 array
+        """
+        self._still_valid_check()
+        if table is None:
+            if len(self._numbers) > 1:
+                raise DbfError('record set spans %d tables; specify one' % len(self._numbers))
+            elif not self._numbers:
+                return np.empty(0, dtype=RECORD_NUMBER)
+            table, = self._numbers
+        return self._numbers.get(table, np.empty(0, dtype=RECORD_NUMBER))
+
+    def tables(self):
+        """
+        returns the tables with records in the set
+        """
+        return list(self._numbers)
+
+    def to_list(self):
+        """
+        returns the records as a dbf.List
+        """
+        return List(self, desc=self._desc or None)
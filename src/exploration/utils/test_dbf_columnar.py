@@ -0,0 +1,799 @@
+'''
+Created on Oct 23, 2020
+
+@author: paepcke
+
+Tests for the bulk (columnar) and index additions
+to the vendored dbf package.
+'''
+import datetime
+import os
+import struct
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(__file__))
+import dbf
+
+TEST_ALL = True
+#TEST_ALL = False
+
+def full_fips(record):
+    '''
+    Worker function for the parallel_map() test;
+    must be picklable, so lives at module level.
+    '''
+    return record.STATEFP + record.COUNTYFP
+
+class DbfColumnarTest(unittest.TestCase):
+
+    #------------------------------------
+    # setUp
+    #-------------------
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory(prefix='dbf_columnar')
+        self.tbl_path = os.path.join(self.tmpdir.name, 'counties.dbf')
+        self.tbl = dbf.Table(self.tbl_path,
+                             'STATEFP C(2); COUNTYFP C(3); NAME C(20); '
+                             'VOTES N(8,0); SHARE N(6,3); ELECTION D; SWING L',
+                             codepage='cp1252')
+        self.tbl.open(dbf.READ_WRITE)
+        self.tbl.append(('06', '001', 'Alameda', 739000, 0.812, datetime.date(2020, 11, 3), False))
+        self.tbl.append(('55', '025', 'Dane', None, None, None, None))
+        self.tbl.append(('35', '013', 'Doña Ana', 85000, 0.5, datetime.date(2016, 2, 29), True))
+
+    #------------------------------------
+    # tearDown
+    #-------------------
+
+    def tearDown(self):
+        self.tbl.close()
+        self.tmpdir.cleanup()
+
+    #------------------------------------
+    # test_to_numpy
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_to_numpy(self):
+        cols = self.tbl.to_numpy()
+        self.assertEqual(list(cols.keys()), list(self.tbl.field_names))
+        self.assertEqual(list(cols['NAME']), ['Alameda', 'Dane', 'Doña Ana'])
+        # Blank numbers become NaN:
+        self.assertTrue(np.isnan(cols['VOTES'][1]))
+        self.assertEqual(cols['VOTES'][2], 85000)
+        self.assertEqual(cols['ELECTION'][2], np.datetime64('2016-02-29'))
+        self.assertTrue(np.isnat(cols['ELECTION'][1]))
+        self.assertEqual(list(cols['SWING']), [False, None, True])
+
+        # Same values as record by record access:
+        for recno, record in enumerate(self.tbl):
+            self.assertEqual(cols['NAME'][recno], record.NAME.rstrip())
+            if record.SHARE is not None:
+                self.assertAlmostEqual(cols['SHARE'][recno], record.SHARE)
+
+        # Field subset, case-insensitive; deleted records:
+        dbf.delete(self.tbl[1])
+        cols = self.tbl.to_numpy('statefp, countyfp', skip_deleted=True)
+        self.assertEqual(list(cols.keys()), ['STATEFP', 'COUNTYFP'])
+        self.assertEqual(list(cols['STATEFP']), ['06', '35'])
+        # All records have a value now:
+        self.assertEqual(self.tbl.to_numpy('VOTES', skip_deleted=True)['VOTES'].dtype, np.int64)
+
+    #------------------------------------
+    # test_to_dataframe
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_to_dataframe(self):
+        df = self.tbl.to_dataframe(['STATEFP', 'COUNTYFP'])
+        self.assertEqual(list(df.index), [0, 1, 2])
+        self.assertEqual(list(df.STATEFP + df.COUNTYFP), ['06001', '55025', '35013'])
+
+        # Character fields as categoricals:
+        self.tbl.append(('06', '075', 'San Francisco', 412000, 0.85, None, False))
+        df = self.tbl.to_dataframe('STATEFP, NAME', categorical=True)
+        self.assertEqual(list(df.STATEFP.cat.categories), ['06', '35', '55'])
+        self.assertEqual(list(df.STATEFP), ['06', '55', '35', '06'])
+        self.assertEqual(df.NAME.iloc[2], 'Doña Ana')
+
+    #------------------------------------
+    # test_decode_text
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_decode_text(self):
+        from dbf._columnar import character_codes, decode_text
+
+        raw = np.array([b'06 ', b'06\x00', b'Do\xf1a', b''], dtype='S4')
+        # Single-byte codepage, decoded as one string:
+        self.assertEqual(list(decode_text(raw, self.tbl._meta)), ['06', '06', 'Doña', ''])
+        # Padding does not make values distinct:
+        codes, categories = character_codes(raw, self.tbl._meta)
+        self.assertEqual(list(categories), ['', '06', 'Doña'])
+        self.assertEqual(list(codes), [1, 1, 2, 0])
+
+        # Multi-byte codepage, decoded value by value:
+        path = os.path.join(self.tmpdir.name, 'kanji')
+        kanji = dbf.Table(path, 'NAME C(10)', codepage='cp932')
+        with kanji:
+            kanji.append(('東京',))
+            kanji.append(('東京',))
+            self.assertEqual(list(kanji.to_numpy('NAME')['NAME']), ['東京', '東京'])
+            self.assertEqual(list(kanji.to_dataframe('NAME').NAME), ['東京', '東京'])
+
+    #------------------------------------
+    # test_append_many
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_append_many(self):
+        new_rows = pd.DataFrame({'statefp'  : ['04', '04'],
+                                 'countyfp' : ['013', '019'],
+                                 'NAME'     : ['Maricopa', 'Pima'],
+                                 'VOTES'    : [2069475, np.nan],
+                                 'ELECTION' : [datetime.date(2020, 11, 3), None],
+                                 'SWING'    : [True, False]
+                                 })
+        self.assertEqual(self.tbl.append_many(new_rows), 2)
+        self.assertEqual(len(self.tbl), 5)
+        # Record by record access sees the new records:
+        maricopa = self.tbl[3]
+        self.assertEqual(maricopa.NAME.rstrip(), 'Maricopa')
+        self.assertEqual(maricopa.VOTES, 2069475)
+        self.assertEqual(maricopa.ELECTION, datetime.date(2020, 11, 3))
+        self.assertIsNone(self.tbl[4].VOTES)
+        self.assertIsNone(self.tbl[4].SHARE)
+
+        with self.assertRaises(dbf.DataOverflowError):
+            self.tbl.append_many({'STATEFP' : ['123']})
+        self.assertEqual(len(self.tbl), 5)
+
+    #------------------------------------
+    # test_write_columns
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_write_columns(self):
+        dane = self.tbl[1]
+        self.tbl.write_columns({'VOTES' : [340000, 20000]}, start=1)
+        # Records in use see the new values:
+        self.assertEqual(dane.VOTES, 340000)
+        self.assertEqual(dane.NAME.rstrip(), 'Dane')
+        self.assertEqual(list(self.tbl.to_numpy('VOTES')['VOTES']), [739000, 340000, 20000])
+        with self.assertRaises(dbf.DbfError):
+            self.tbl.write_columns({'VOTES' : [1, 2]}, start=2)
+
+    #------------------------------------
+    # test_add_computed_field
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_add_computed_field(self):
+        dbf.delete(self.tbl[1])
+        self.tbl.add_computed_field('FULL_FIPS C(5)',
+                                    lambda cols: np.char.add(cols['STATEFP'], cols['COUNTYFP']),
+                                    fields='STATEFP, COUNTYFP')
+        self.assertEqual(self.tbl.field_names[-1], 'FULL_FIPS')
+        self.assertEqual([rec.FULL_FIPS for rec in self.tbl], ['06001', '55025', '35013'])
+        # Existing fields and deletion flags survive:
+        self.assertEqual(self.tbl[2].ELECTION, datetime.date(2016, 2, 29))
+        self.assertTrue(dbf.is_deleted(self.tbl[1]))
+
+        # Values that do not fit leave the table alone:
+        with self.assertRaises(dbf.DataOverflowError):
+            self.tbl.add_computed_field('SHORT C(2)',
+                                        lambda cols: cols['FULL_FIPS'],
+                                        fields='FULL_FIPS')
+        self.assertEqual(len(self.tbl), 3)
+        self.assertNotIn('SHORT', self.tbl.field_names)
+
+        # As do failures of add_fields() itself:
+        self.tbl._meta.max_fields = len(self.tbl.field_names)
+        with self.assertRaises(dbf.DbfError):
+            self.tbl.add_computed_field('SHORT C(2)', lambda cols: cols['STATEFP'], fields='STATEFP')
+        self.tbl._meta.max_fields = 255
+        with mock.patch.object(dbf.Table, 'add_fields', side_effect=dbf.DbfError('no room')):
+            with self.assertRaises(dbf.DbfError):
+                self.tbl.add_computed_field('SHORT C(2)', lambda cols: cols['STATEFP'], fields='STATEFP')
+        self.assertEqual(len(self.tbl), 3)
+        self.assertEqual([rec.FULL_FIPS for rec in self.tbl], ['06001', '55025', '35013'])
+        # ... and appends go after the existing records:
+        self.tbl.append(('04', '013', 'Maricopa', 2069475, 0.5, None, True, '04013'))
+        self.assertEqual([rec.FULL_FIPS for rec in self.tbl], ['06001', '55025', '35013', '04013'])
+
+    #------------------------------------
+    # test_where
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_where(self):
+        self.assertEqual(list(self.tbl.where("votes > 100000")), [0])
+        self.assertEqual(list(self.tbl.where("statefp in ('06', '35') and not swing")), [0])
+        self.assertEqual(list(self.tbl.where("election >= '2016-01-01' or name.startswith('Da')")),
+                         [0, 1, 2])
+        self.assertEqual(list(self.tbl.where("0.4 < share < 0.6", mask=True)), [False, False, True])
+        dbf.delete(self.tbl[2])
+        self.assertEqual(list(self.tbl.where("not is_deleted() and recno() > 0")), [1])
+
+        # Same results when an index narrows the candidates:
+        self.tbl.create_index('STATEFP')
+        self.assertEqual(list(self.tbl.where("statefp == '55' or statefp == '06'")), [0, 1])
+        self.assertEqual(list(self.tbl.where("statefp == '06' and votes < 10")), [])
+        with self.assertRaises(dbf.DbfError):
+            self.tbl.where("statefp == open('/etc/passwd')")
+
+        # Comparisons an index cannot answer, with and without one:
+        unindexed = [list(self.tbl.where(criteria))
+                     for criteria in ("votes not in (85000,)", "votes != 85000")]
+        # The table holds its indexes weakly:
+        by_votes = self.tbl.create_index('VOTES')
+        self.assertEqual(list(self.tbl.where("votes not in (85000,)")), unindexed[0])
+        self.assertEqual(list(self.tbl.where("votes != 85000")), unindexed[1])
+        self.assertEqual(unindexed[0], [0, 1])
+
+        # Dates that are not YYYY-MM-DD, with and without an index:
+        for indexed in (False, True):
+            if indexed:
+                by_election = self.tbl.create_index('ELECTION')
+            for criteria in ("election > '2020-06'", "'11/03/2020' == election",
+                             "election in ('2020-11-03', 'soon')"):
+                with self.assertRaisesRegex(dbf.DbfError, 'cannot compare field ELECTION'):
+                    self.tbl.where(criteria)
+
+    #------------------------------------
+    # test_export
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_export(self):
+        self.assertEqual(dbf.export(self.tbl, field_names='NAME, VOTES, ELECTION'), 3)
+        with open(os.path.join(self.tmpdir.name, 'counties.csv'), encoding='cp1252') as fd:
+            self.assertEqual(fd.read().splitlines(),
+                             ['"NAME","VOTES","ELECTION"',
+                              '"Alameda",739000,"2020-11-03"',
+                              '"Dane","",""',
+                              '"Doña Ana",85000,"2016-02-29"'
+                              ])
+        # Records of the table, chunk by chunk:
+        few_path = os.path.join(self.tmpdir.name, 'few.txt')
+        dbf.export(self.tbl[1:], few_path, field_names='STATEFP', format='tab', chunk_size=1)
+        with open(few_path) as fd:
+            self.assertEqual(fd.read(), 'STATEFP\n55\n35\n')
+
+        for format in ('parquet', 'feather'):
+            self.assertEqual(dbf.export(self.tbl, format=format, chunk_size=2), 3)
+            df = pd.read_parquet(os.path.join(self.tmpdir.name, 'counties.parquet')) \
+                if format == 'parquet' else pd.read_feather(os.path.join(self.tmpdir.name, 'counties.feather'))
+            self.assertEqual(list(df.NAME), ['Alameda', 'Dane', 'Doña Ana'])
+            self.assertEqual(df.VOTES[0], 739000)
+            self.assertTrue(pd.isna(df.VOTES[1]))
+            self.assertTrue(pd.isna(df.SWING[1]))
+
+    #------------------------------------
+    # test_array_index
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_array_index(self):
+        by_votes = self.tbl.create_index('VOTES', persistent=True)
+        self.assertIsInstance(by_votes, dbf.Index)
+        self.assertEqual(len(by_votes), 3)
+        # Blank numbers are in no range:
+        self.assertEqual(list(by_votes.search_range(0)), [2, 0])
+        self.assertEqual(list(by_votes.search_range(high=100000)), [2])
+
+        by_name = self.tbl.create_index('NAME')
+        self.assertEqual([rec.NAME.rstrip() for rec in by_name], ['Alameda', 'Dane', 'Doña Ana'])
+        self.assertEqual(len(by_name.search('D', partial=True)), 2)
+        self.assertEqual(by_name['Dane'][0].STATEFP, '55')
+        # Lookups by record, and keys of records:
+        self.assertEqual(by_name.key(self.tbl[2]), ('Doña Ana'.ljust(20), ))
+        self.assertEqual(by_votes.key(self.tbl[1]), (None, ))
+        self.assertEqual([rec.STATEFP for rec in by_name[self.tbl[2]]], ['35'])
+        self.assertEqual([rec.STATEFP for rec in by_votes[self.tbl[0]]], ['06'])
+        self.assertIn(self.tbl[0], by_votes)
+
+        # Record updates, appends, and packing reach the index:
+        with self.tbl[1] as dane:
+            dane.VOTES = 20
+        self.tbl.append(('04', '013', 'Maricopa', 2069475, 0.5, None, True))
+        self.tbl.append_many({'NAME' : ['Pima'], 'VOTES' : [500000]})
+        self.assertEqual(list(by_votes.search_range(high=100000)), [1, 2])
+        self.assertEqual([rec.NAME.rstrip() for rec in by_name][-2:], ['Maricopa', 'Pima'])
+        dbf.delete(self.tbl[0])
+        self.tbl.pack()
+        self.assertEqual(list(by_votes.search_range(100000)), [3, 2])
+
+        # Reopening an unchanged table loads the saved index:
+        self.tbl.close()
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, 'counties.votes.npz')))
+        self.tbl.open(dbf.READ_WRITE)
+        reloaded = self.tbl.create_index('votes', persistent=True)
+        self.assertFalse(reloaded._dirty)
+        self.assertEqual(list(reloaded.search_range(100000)), [3, 2])
+        # ... but rebuilds it for a changed one:
+        sidecar_path = os.path.join(self.tmpdir.name, 'counties.votes.npz')
+        saved_stamp = np.load(sidecar_path)['stamp']
+        self.tbl.close()
+        with open(self.tbl_path, 'ab') as dbf_file:
+            dbf_file.write(b' ')
+        self.tbl.open(dbf.READ_WRITE)
+        self.assertEqual(len(self.tbl.create_index('VOTES', persistent=True)), 4)
+        self.assertFalse(np.array_equal(np.load(sidecar_path)['stamp'], saved_stamp))
+        with self.assertRaises(dbf.DbfError):
+            self.tbl.create_index('SWING', persistent=True)
+
+    #------------------------------------
+    # test_idx
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_idx(self):
+        # FoxPro .idx on COUNTYFP: an interior root node over two leaves
+        idx_path = os.path.join(self.tmpdir.name, 'counties.idx')
+        self.write_idx(idx_path, [(512, 3, [(b'001', 1), (b'013', 3)], -1, 1024),
+                                  (1024, 2, [(b'025', 2)], 512, -1),
+                                  (1536, 1, [(b'013', 512), (b'025', 1024)], -1, -1)
+                                  ])
+        dbf.Idx.set_node_cache(maxbytes=1024 * 1024)
+        idx = dbf.Idx(self.tbl, idx_path)
+        self.assertEqual([rec.COUNTYFP for rec in idx], ['001', '013', '025'])
+        self.assertEqual([rec.COUNTYFP for rec in idx.backward()], ['025', '013', '001'])
+        self.assertEqual(list(idx.rec_no_batches(batch_size=2)), [[0, 2], [1]])
+        # A second Idx on the same file uses the nodes already cached:
+        cached = len(dbf.Idx.node_cache)
+        self.assertEqual(len(list(dbf.Idx(self.tbl, idx_path))), 3)
+        self.assertEqual(len(dbf.Idx.node_cache), cached)
+
+        # The cache stays within its byte limit:
+        cache = dbf.LruCache(maxsize=None, maxbytes=10)
+        for key in range(5):
+            cache.get((key, ), lambda key: b'1234')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 8)
+
+    #------------------------------------
+    # test_record_cache
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_record_cache(self):
+        # No caching unless asked for:
+        self.assertIsNone(self.tbl.record_cache)
+        self.tbl.close()
+        self.tbl.open(dbf.READ_WRITE)
+        self.tbl.set_record_cache(dbf.RecordCache())
+        cache = self.tbl.record_cache
+        # One read-ahead for the scan, hits after that:
+        self.assertEqual([rec.STATEFP for rec in self.tbl], ['06', '55', '35'])
+        self.assertEqual((cache.misses, cache.hits, len(cache)), (1, 2, 3))
+        self.assertEqual(self.tbl[2].NAME.rstrip(), 'Doña Ana')
+        self.assertEqual(cache.hits, 3)
+
+        # Writes reach later readers:
+        with self.tbl[1] as dane:
+            dane.VOTES = 340000
+        del dane
+        self.assertEqual(self.tbl[1].VOTES, 340000)
+        self.tbl.write_columns({'VOTES' : [1]}, start=1)
+        self.assertEqual(self.tbl[1].VOTES, 1)
+
+        # Byte limit, and no caching at all:
+        small = dbf.RecordCache(maxbytes=2 * self.tbl.record_length)
+        self.tbl.set_record_cache(small)
+        self.assertEqual(len([rec for rec in self.tbl]), 3)
+        self.assertEqual(len(small), 2)
+        self.assertEqual(small.stats()['evictions'], 1)
+        self.tbl.set_record_cache(None)
+        self.assertEqual(self.tbl[0].NAME.rstrip(), 'Alameda')
+
+    #------------------------------------
+    # test_two_handles
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_two_handles(self):
+        # A full scan, then a write through a second Table
+        # object: the first one reads the new value.
+        self.assertEqual([rec.STATEFP for rec in self.tbl], ['06', '55', '35'])
+        other = dbf.Table(self.tbl_path)
+        with other:
+            with other[1] as dane:
+                dane.VOTES = 999
+        self.assertEqual(self.tbl[1].VOTES, 999)
+
+    #------------------------------------
+    # test_from_csv
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_from_csv(self):
+        csv_path = os.path.join(self.tmpdir.name, 'counties.csv')
+        with open(csv_path, 'w', encoding='latin-1') as fd:
+            fd.write('STATEFP,COUNTYFP,NAME,VOTES,SHARE,ELECTION,SWING\n'
+                     '06,001,Alameda,739000,0.812,2020-11-03,F\n'
+                     '55,025,Dane,,,,\n'
+                     '35,013,Doña Ana,85000,.5,2016-02-29,T\n')
+
+        # Types inferred from all rows, read one row at a time:
+        table = dbf.from_csv(csv_path, filename=os.path.join(self.tmpdir.name, 'inferred'),
+                             header=True, chunk_size=1)
+        with table:
+            self.assertEqual(table.structure(),
+                             ['STATEFP C(2)', 'COUNTYFP C(3)', 'NAME C(8)', 'VOTES N(6,0)',
+                              'SHARE N(5,3)', 'ELECTION D', 'SWING L'])
+            self.assertEqual(table[0].COUNTYFP, '001')
+            self.assertEqual(table[2].NAME, 'Doña Ana')
+            self.assertEqual(table[2].SHARE, 0.5)
+            self.assertEqual(table[2].ELECTION, dbf.Date(2016, 2, 29))
+            self.assertIs(table[2].SWING, True)
+            self.assertIsNone(table[1].SWING)
+
+        # Given types are kept, the others are inferred:
+        table = dbf.from_csv(csv_path, filename=os.path.join(self.tmpdir.name, 'given'),
+                             field_names=['st C(4)', 'county'], header=True)
+        with table:
+            self.assertEqual(table.structure()[:2], ['ST C(4)', 'COUNTY C(3)'])
+            self.assertEqual(len(table), 3)
+
+        # Values beyond the sample that do not fit:
+        with self.assertRaises(dbf.DbfError):
+            dbf.from_csv(csv_path, filename=os.path.join(self.tmpdir.name, 'sampled'),
+                         header=True, sample_rows=1)
+
+        # More decimals than in the sample are not rounded away:
+        shares_path = os.path.join(self.tmpdir.name, 'shares.csv')
+        with open(shares_path, 'w') as fd:
+            fd.write('SHARE\n0.5\n1.20\n')
+        table = dbf.from_csv(shares_path, filename=os.path.join(self.tmpdir.name, 'shares'),
+                             header=True, sample_rows=1)
+        with table:
+            self.assertEqual(table.structure(), ['SHARE N(3,1)'])
+            self.assertEqual(table[1].SHARE, 1.2)
+        with open(shares_path, 'a') as fd:
+            fd.write('1.25\n')
+        with self.assertRaises(dbf.DbfError):
+            dbf.from_csv(shares_path, filename=os.path.join(self.tmpdir.name, 'shares'),
+                         header=True, sample_rows=1, chunk_size=2)
+    #------------------------------------
+    # test_pack
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_pack(self):
+        by_name = self.tbl.create_index(lambda rec: rec.NAME)
+        by_state = self.tbl.create_index('STATEFP')
+        alameda, dane, dona_ana = self.tbl[0], self.tbl[1], self.tbl[2]
+        dbf.delete(dane)
+        self.tbl.pack()
+
+        self.assertEqual([rec.STATEFP for rec in self.tbl], ['06', '35'])
+        self.assertEqual(os.path.getsize(self.tbl_path),
+                         self.tbl._meta.header.start + 2 * self.tbl.record_length + 1)
+        # Records in use are renumbered:
+        self.assertEqual((dbf.recno(alameda), dbf.recno(dona_ana), dbf.recno(dane)), (0, 1, -1))
+        # Indexes are remapped:
+        self.assertEqual([rec.NAME.rstrip() for rec in by_name], ['Alameda', 'Doña Ana'])
+        self.assertEqual([dbf.recno(rec) for rec in by_state.search('35')], [1])
+        self.assertEqual(len(by_state), 2)
+
+        # The file survives a reopen; nothing left to remove is a no-op:
+        self.tbl.close()
+        self.tbl.open(dbf.READ_WRITE)
+        self.assertEqual(self.tbl[1].NAME.rstrip(), 'Doña Ana')
+        self.tbl.pack()
+        self.assertEqual(len(self.tbl), 2)
+
+        self.tbl.zap()
+        self.assertEqual((len(self.tbl), len(by_state)), (0, 0))
+
+    #------------------------------------
+    # test_memo
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_memo(self):
+        long_note = 'Recount requested. ' * 2000
+        for dbf_type in ('db3', 'vfp'):
+            path = os.path.join(self.tmpdir.name, f"notes_{dbf_type}")
+            notes = dbf.Table(path, 'FIPS C(5); NOTE M', dbf_type=dbf_type, codepage='cp1252')
+            with notes:
+                notes.append(('06001', 'Doña Ana style ñ'))
+                notes.append(('55025', ''))
+                notes.append(('35013', long_note))
+                # Memos written after the file was mapped:
+                self.assertEqual(notes[0].NOTE.rstrip(), 'Doña Ana style ñ')
+                self.assertEqual(notes[2].NOTE.rstrip(), long_note.rstrip())
+
+            with notes:
+                # Memos are read in file order, as one batch:
+                cols = notes.to_numpy('NOTE')['NOTE']
+                self.assertEqual([note.rstrip() for note in cols],
+                                 [rec.NOTE.rstrip() for rec in notes])
+
+                # Optional read-back after writing:
+                dbf.VERIFY_MEMO_WRITES = True
+                try:
+                    with notes[1] as rec:
+                        rec.NOTE = 'Late returns'
+                finally:
+                    dbf.VERIFY_MEMO_WRITES = False
+                self.assertEqual(notes[1].NOTE.rstrip(), 'Late returns')
+
+    #------------------------------------
+    # test_relation_join
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_relation_join(self):
+        # Two precincts for Alameda, none for Dane:
+        precincts = dbf.Table(os.path.join(self.tmpdir.name, 'precincts'),
+                              'STATEFP C(2); PRECINCT C(8)')
+        with precincts:
+            precincts.append_many({'STATEFP' : ['35', '06', '06', '99'],
+                                   'PRECINCT' : ['LC-1', 'OAK-1', 'OAK-2', 'NOWHERE']})
+            relation = dbf.Relation((self.tbl, 'STATEFP'), (precincts, 'STATEFP'))
+
+            src, tgt = relation.join()
+            self.assertEqual((list(src), list(tgt)), ([0, 0, 2], [1, 2, 0]))
+            src, tgt = relation.join(how='left', validate='1:n')
+            self.assertEqual((list(src), list(tgt)), ([0, 0, 1, 2], [1, 2, -1, 0]))
+            with self.assertRaises(dbf.DbfError):
+                relation.join(validate='n:1')
+
+            # Same pairs as record by record lookups:
+            for record in self.tbl:
+                matches = tgt[(src == dbf.recno(record)) & (tgt >= 0)]
+                self.assertEqual([dbf.recno(match) for match in relation[record]], list(matches))
+
+            frame = relation.join_frame(src_records=[self.tbl[2], self.tbl[1]], tgt_fields='PRECINCT', how='left')
+            self.assertEqual(list(frame.index), [(2, 0), (1, -1)])
+            self.assertEqual(list(frame.NAME), ['Doña Ana', 'Dane'])
+            self.assertEqual(frame.PRECINCT.iloc[0], 'LC-1')
+            self.assertTrue(pd.isna(frame.PRECINCT.iloc[1]))
+
+    #------------------------------------
+    # test_values
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_values(self):
+        for record in self.tbl:
+            by_field = [record[name] for name in self.tbl.field_names]
+            self.assertEqual(dbf.values(record), by_field)
+            self.assertEqual(dbf.as_tuple(record), tuple(by_field))
+        self.assertEqual(dbf.values(self.tbl[2])[2].rstrip(), 'Doña Ana')
+
+        # Decoders follow changes of the layout and of field values:
+        self.tbl.add_fields('REPORTED L')
+        self.assertEqual(len(dbf.values(self.tbl[0])), 8)
+        with self.tbl[0] as record:
+            record.NAME = 'Alpine'
+            self.assertEqual(dbf.values(record)[2].rstrip(), 'Alpine')
+        self.assertEqual(dbf.values(self.tbl[0])[2].rstrip(), 'Alpine')
+
+        # Nullable fields:
+        path = os.path.join(self.tmpdir.name, 'turnout')
+        turnout = dbf.Table(path, 'FIPS C(5); VOTERS I; TURNOUT B null', dbf_type='vfp')
+        with turnout:
+            turnout.append(('06001', 900000, 0.82))
+            turnout.append(('55025', 400000, dbf.Null))
+            self.assertEqual([dbf.values(record) for record in turnout],
+                             [['06001', 900000, 0.82], ['55025', 400000, dbf.Null]])
+
+    #------------------------------------
+    # test_parallel
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_parallel(self):
+        dbf.delete(self.tbl[1])
+        self.assertEqual(dbf.parallel_map(self.tbl, full_fips, workers=2),
+                         ['06001', '55025', '35013'])
+        self.assertEqual(dbf.parallel_map(self.tbl, full_fips, workers=2, skip_deleted=True),
+                         ['06001', '35013'])
+        # Records appended after opening are seen by the workers:
+        self.tbl.append(('04', '013', 'Maricopa', 2069475, 0.5, None, True))
+        for criteria in ("votes > 100000", "swing or is_deleted()", "name.startswith('M')"):
+            self.assertEqual(list(dbf.parallel_query(self.tbl, criteria, workers=3)),
+                             list(self.tbl.where(criteria)))
+        self.assertEqual(list(dbf.parallel_query(self.tbl, "swing", workers=1, mask=True)),
+                         [False, False, True, True])
+        with self.assertRaises(dbf.DbfError):
+            dbf.parallel_query(self.tbl, "votes >", workers=2)
+
+    #------------------------------------
+    # test_record_set
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_record_set(self):
+        counted = dbf.record_set(self.tbl, self.tbl.where("votes > 0"))
+        swing = dbf.record_set(self.tbl, self.tbl.where("swing", mask=True))
+        self.assertEqual(len(counted), 2)
+        self.assertEqual(list((counted & swing).record_numbers()), [2])
+        self.assertEqual(list((counted | swing).record_numbers()), [0, 2])
+        self.assertEqual(list((dbf.record_set(self.tbl) - counted).record_numbers()), [1])
+        # Records are read when asked for:
+        self.assertEqual([full_fips(record) for record in counted], ['06001', '35013'])
+        self.assertEqual(full_fips(counted[-1]), '35013')
+        self.assertIn(self.tbl[2], swing)
+        self.assertNotIn(self.tbl[1], counted)
+
+        # Lists combine with record sets either way round:
+        first = dbf.List(self.tbl)[:1]
+        self.assertEqual(list((swing + first).record_numbers()), [0, 2])
+        self.assertEqual(list((first + swing).record_numbers()), [0, 2])
+        self.assertEqual(len((counted - first).to_list()), 1)
+
+        with self.assertRaises(dbf.DbfError):
+            dbf.record_set(self.tbl, [0, 3])
+        dbf.delete(self.tbl[1])
+        self.tbl.pack()
+        with self.assertRaises(dbf.DbfError):
+            len(counted & swing)
+
+    #------------------------------------
+    # test_batch
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_batch(self):
+        self.tbl.add_fields('FULL_FIPS C(5)')
+        with self.tbl.batch() as journal:
+            for record in self.tbl:
+                with record:
+                    record.FULL_FIPS = record.STATEFP + record.COUNTYFP
+            self.tbl.append(('04', '013', 'Maricopa', 2069475, 0.5, None, True, '04013'))
+            # Nothing written yet, but the changes are visible:
+            self.assertEqual(len(journal), 4)
+            self.assertEqual(self.tbl[3].NAME.rstrip(), 'Maricopa')
+        # One run of consecutive records, one write:
+        self.assertEqual(journal.writes, 1)
+        self.tbl.close()
+        with self.tbl:
+            self.assertEqual([rec.FULL_FIPS for rec in self.tbl],
+                             ['06001', '55025', '35013', '04013'])
+
+            # An exception discards the batch:
+            fips = self.tbl.create_index('FULL_FIPS')
+            with self.assertRaises(ValueError):
+                with self.tbl.batch():
+                    with self.tbl[0] as record:
+                        record.FULL_FIPS = '99999'
+                    self.tbl.append(('02', '020', 'Anchorage'))
+                    raise ValueError('abandoned')
+            self.assertEqual(len(self.tbl), 4)
+            self.assertEqual(self.tbl[0].FULL_FIPS, '06001')
+            self.assertEqual(len(fips), 4)
+            self.assertEqual(len(fips.search('99999')), 0)
+
+    #------------------------------------
+    # test_reopen
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_reopen(self):
+        self.tbl.close()
+        # The same file, changed through another table object:
+        other = dbf.Table(self.tbl_path)
+        with other:
+            other.add_fields('FULL_FIPS C(5)')
+            with other[2] as record:
+                record.FULL_FIPS = '35013'
+        with self.tbl:
+            self.assertEqual(self.tbl.field_names[-1], 'FULL_FIPS')
+            self.assertEqual(self.tbl[2].FULL_FIPS, '35013')
+        # Unchanged fields are not parsed again:
+        with self.tbl:
+            self.assertEqual(self.tbl[2].NAME.rstrip(), 'Doña Ana')
+
+        # dbf types are sent by xmlrpc.client, imported after dbf:
+        import xmlrpc.client
+        self.assertIn('<boolean>1</boolean>', xmlrpc.client.dumps((dbf.Logical(True), )))
+
+    #------------------------------------
+    # test_datetime
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_datetime(self):
+        path = os.path.join(self.tmpdir.name, 'polls')
+        polls = dbf.Table(path, 'FIPS C(5); CLOSED T', dbf_type='vfp')
+        with polls:
+            polls.append(('06001', datetime.datetime(2020, 11, 3, 20, 0, 0, 250000)))
+            polls.append(('55025', None))
+            polls.append_many({'FIPS' : ['35013', '04013'],
+                               'CLOSED' : np.array(['2016-11-08T19:00:00.001', 'NaT'],
+                                                   dtype='datetime64[ms]')})
+            closed = polls.to_numpy('CLOSED')['CLOSED']
+            self.assertEqual(closed.dtype, np.dtype('datetime64[ms]'))
+            self.assertEqual(closed[0], np.datetime64('2020-11-03T20:00:00.250'))
+            self.assertEqual(list(np.isnat(closed)), [False, True, False, True])
+            # Same values as record by record access:
+            self.assertEqual(polls[2].CLOSED, datetime.datetime(2016, 11, 8, 19, 0, 0, 1000))
+            self.assertIsNone(polls[3].CLOSED)
+
+            self.assertEqual(list(polls.where("closed > '2020-11-03T12:00'")), [0])
+            with self.assertRaises(dbf.DbfError):
+                polls.where("closed > 'election night'")
+            with self.assertRaises(dbf.DataOverflowError):
+                polls.append_many({'CLOSED' : np.array(['-0001-01-01'], dtype='datetime64[ms]')})
+
+    #------------------------------------
+    # test_null_flags
+    #-------------------
+
+    @unittest.skipIf(not TEST_ALL, 'skipping temporarily')
+    def test_null_flags(self):
+        path = os.path.join(self.tmpdir.name, 'turnout')
+        turnout = dbf.Table(path, 'FIPS C(5) null; VOTES N(8,0) null; MAILED L null; SHARE B',
+                            dbf_type='vfp')
+        with turnout:
+            turnout.append(('06001', 713000, True, 0.8))
+            turnout.append((dbf.Null, dbf.Null, dbf.Null, 0.5))
+            turnout.append_many({'FIPS' : ['35013', None],
+                                 'VOTES' : [None, 97000],
+                                 'MAILED' : [False, dbf.Null],
+                                 'SHARE' : [0.6, 0.7]})
+            # Bulk written Nulls read back as Null record by record:
+            self.assertIs(turnout[3].FIPS, dbf.Null)
+            self.assertIs(turnout[2].VOTES, dbf.Null)
+            self.assertIs(turnout[3].MAILED, dbf.Null)
+            self.assertEqual(turnout[2].FIPS, '35013')
+
+            columns = turnout.to_numpy()
+            self.assertEqual(list(columns['FIPS']), ['06001', None, '35013', None])
+            self.assertTrue(np.isnan(columns['VOTES'][[1, 2]]).all())
+            self.assertEqual(list(columns['MAILED']), [True, None, False, None])
+            self.assertEqual(columns['SHARE'].dtype, np.float64)
+
+            masked = turnout.to_numpy('VOTES, MAILED', masked=True)
+            self.assertEqual(masked['VOTES'].dtype, np.int64)
+            self.assertEqual(list(masked['VOTES'].mask), [False, True, True, False])
+            self.assertEqual(masked['VOTES'].sum(), 810000)
+            self.assertEqual(masked['MAILED'].dtype, bool)
+
+            frame = turnout.to_dataframe(nullable=True)
+            self.assertEqual(str(frame.VOTES.dtype), 'Int64')
+            self.assertEqual(str(frame.MAILED.dtype), 'boolean')
+            self.assertEqual(list(frame.VOTES.isna()), [False, True, True, False])
+            self.assertEqual(list(frame.FIPS.isna()), [False, True, False, True])
+            categories = turnout.to_dataframe('FIPS', categorical=True)
+            self.assertEqual(list(categories.FIPS.isna()), [False, True, False, True])
+
+    #------------------------------------
+    # write_idx
+    #-------------------
+
+    def write_idx(self, path, nodes):
+        '''
+        Write a FoxPro .idx file with 3-byte keys.
+
+        @param path: where to write the file
+        @type path: str
+        @param nodes: (offset, attributes, [(key, rec_no)], left_peer, right_peer)
+            for each node; the last one is the root
+        @type nodes: [(int, int, [(bytes, int)], int, int)]
+        '''
+        root = nodes[-1][0]
+        data = bytearray(root + 512)
+        struct.pack_into('<lllhbb', data, 0, root, -1, len(data), 3, 0, 0)
+        for offset, attributes, keys, left_peer, right_peer in nodes:
+            struct.pack_into('<hhll', data, offset, attributes, len(keys), left_peer, right_peer)
+            for i, (key, rec_no) in enumerate(keys):
+                struct.pack_into('>3sL', data, offset + 12 + i * 7, key, rec_no)
+        with open(path, 'wb') as fd:
+            fd.write(data)
+
+# --------------- Main ----------
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
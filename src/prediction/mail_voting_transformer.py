@@ -3,35 +3,75 @@ Created on Sep 27, 2020
 
 @author: paepcke
 '''
+import os
 
 from sklearn.base import BaseEstimator, TransformerMixin
 
 import pandas as pd
+from exploration.eavs_aggregator import EAVSAggregator
 from prediction.covid_utils import CovidUtils
 from utils.logging_service import LoggingService
 
 
 class MailVotingTransformer(BaseEstimator, TransformerMixin):
 
+    # The voteByMail2018.xlsx summary only has State totals.
+    # County level numbers for 2018 come from the full survey
+    # release:
+    EAVS_2018_FILE = os.path.join(os.path.dirname(__file__),
+                                  '../../data/Exploration/EAVS_2018_for_Public_Release_Updates3.xlsx')
+
+    # Names of the 'votes cast' and 'returned by mail'
+    # columns in the EAVS panel written by the 
+    # exploration.eavs_panel module:
+    PANEL_MEASURES = {2014 : ('TotalCountVote', 'TotalVoteByMail'),
+                      2016 : ('TotalVote', 'TotalByMail'),
+                      2018 : ('TotalVoteCounted', 'ByMailCountBallotsReturned')
+                      }
+
+    # Where the full survey releases keep what the
+    # etl_election_survey() method needs: sheet, and the
+    # State, jurisdiction, votes cast, and returned by mail
+    # columns:
+    SURVEY_COLUMNS = {2012 : (0, 'State', 'Jurisdiction', 'QF1aBallotsCast', 'QF1gVoteByMail'),
+                      2014 : (0, 'State', 'Jurisdiction', 'QF1a', 'QF1g'),
+                      2016 : ('SECTION F', 'State', 'JurisdictionName', 'F1a', 'F1g'),
+                      2018 : (0, 'State_Abbr', 'Jurisdiction_Name', 'F1a', 'C1b')
+                      }
+
     #------------------------------------
     # Constructor 
     #-------------------
 
-    def __init__(self, file_dict, county_level=False):
+    def __init__(self, file_dict, county_level=False, states=None):
         '''
         Given a dictionary with keys (<State>,<year>),
         and values being full paths to CSV files that
         hold the data. One file for each year:
+        
+        A value may instead be the directory of an
+        EAVS panel (see exploration/eavs_panel.py). Only
+        that year, the States in states, and the two
+        needed columns are then read from the panel.
     
         @param file_dict: pointers to data files
         @type file_dict: {int : str}
+        @param county_level: whether to keep county detail
+        @type county_level: bool
+        @param states: 2-letter abbreviations of States to
+            retain when reading from a panel. Default: all
+        @type states: {None | [str]}
         '''
         self.utils = CovidUtils()
         self.all_elections_df = None
         self.log = LoggingService()
+        self.states = states
+        self.county_level = county_level
 
         for year in file_dict.keys():
-            if year == 2018:
+            if os.path.isdir(file_dict[year]):
+                df = self.handle_panel(file_dict[year], year, county_level)
+            elif year == 2018:
                 df = self.handle_2018(file_dict[year],county_level)
             elif year == 2016:
                 df = self.handle_2016(file_dict[year],county_level)
@@ -45,6 +85,80 @@ class MailVotingTransformer(BaseEstimator, TransformerMixin):
             else:
                 self.all_elections_df = pd.concat([self.all_elections_df, df])
 
+        # A sorted index lets transform() join with
+        # a merge of the sorted keys:
+        if self.all_elections_df is not None:
+            self.all_elections_df = self.all_elections_df.sort_index()
+
+    #------------------------------------
+    # handle_panel
+    #-------------------
+
+    def handle_panel(self, panel_dir, year, county_level=False):
+        '''
+        Reads votes cast and votes returned by mail
+        for one year from an EAVS panel directory. Filters
+        for the year and for self.states are pushed down
+        to the Parquet reader, so only the needed row groups
+        and columns are loaded. Returns the same format
+        as the handle_<year>() methods.
+        
+        @param panel_dir: root of the EAVS panel
+        @type panel_dir: str
+        @param year: election year
+        @type year: int
+        @param county_level: whether to keep county detail
+        @type county_level: bool
+        @return information on votes counted, how many
+            were mail-ins, and percentage.
+        @rtype: pd.DataFrame
+        '''
+        try:
+            votes_col, by_mail_col = self.PANEL_MEASURES[year]
+        except KeyError:
+            raise NotImplementedError(f"No EAVS panel measures known for year {year}")
+        
+        self.log.info(f"Reading mail voting from panel for {year}...")
+        aggregator = EAVSAggregator.for_panel_dir(panel_dir, states=self.states)
+        df = self.rollup(aggregator, year, county_level, measures=(votes_col, by_mail_col))
+        self.log.info(f"Done reading mail voting from panel for {year}.")
+        
+        df[f'ByMailPerc{year}'] = df[f'ByMailReturned{year}'] / df[f'VotesCast{year}']
+        return df
+
+    #------------------------------------
+    # rollup
+    #-------------------
+
+    def rollup(self, aggregator, year, county_level, measures=None):
+        '''
+        Have the given EAVSAggregator sum votes cast and
+        votes returned by mail of one year to State, or 
+        to jurisdiction level. Returns a df with columns 
+        VotesCast{year} and ByMailReturned{year}, and index
+        [Region, Election], or [Region, County, Election].
+        
+        @param aggregator: aggregator over EAVS data
+        @type aggregator: EAVSAggregator
+        @param year: election year
+        @type year: int
+        @param county_level: whether to keep county detail
+        @type county_level: bool
+        @param measures: names of the votes cast and by-mail
+            columns in the aggregator's data. Default:
+            VotesCast{year} and ByMailReturned{year}
+        @type measures: {None | (str, str)}
+        @return: votes cast and returned by mail
+        @rtype: pd.DataFrame
+        '''
+        if measures is None:
+            measures = (f'VotesCast{year}', f'ByMailReturned{year}')
+        level = 'jurisdiction' if county_level else 'state'
+        df = aggregator.rollup(year, list(measures), level=level)
+        df.columns = [f'VotesCast{year}', f'ByMailReturned{year}']
+        df.index = df.index.rename({'State' : 'Region', 'Jurisdiction' : 'County'})
+        return df.astype(int)
+
     #------------------------------------
     # handle_2018 
     #-------------------
@@ -65,10 +179,13 @@ class MailVotingTransformer(BaseEstimator, TransformerMixin):
         where Region is a State abbreviation, and Eleciton
         is a year.
         
-        NOTE: County level information was not yet available for
-              the 2018 election. So we cannot use the method
-              etl_election_survey() below, which is common to
-              all other years.
+        NOTE: The State level summary file for 2018 has 
+              a layout that differs from the other years. So 
+              we cannot use the method etl_election_survey() 
+              below, which is common to all other years. For
+              county level, file_name is ignored, and the
+              full survey release in EAVS_2018_FILE is read
+              instead (see handle_2018_county()).
         
         @param file_name: path to EAVS survey results
         @type file_name: str
@@ -76,7 +193,7 @@ class MailVotingTransformer(BaseEstimator, TransformerMixin):
         @rtype: pd.DataFrame
         '''
         if county_level:
-            raise NotImplementedError("County level not yet available for 2018")
+            return self.handle_2018_county(self.EAVS_2018_FILE)
         
         sheet = pd.read_excel(io=file_name,
                               header=[0,1,2])
@@ -139,6 +256,26 @@ class MailVotingTransformer(BaseEstimator, TransformerMixin):
 
         return df
     
+    #------------------------------------
+    # handle_2018_county
+    #-------------------
+
+    def handle_2018_county(self, file_name):
+        '''
+        Reads the county (jurisdiction) level 2018 numbers
+        from the full Election Administration and Voting 
+        Survey release. F1a is total votes counted, and C1b 
+        is the number of by-mail ballots returned by voters,
+        which is what the State level summary reports.
+        
+        @param file_name: path to the 2018 EAVS release
+        @type file_name: str
+        @return information on votes counted, how many
+            were mail-ins, and percentage.
+        @rtype: pd.DataFrame
+        '''
+        return self.read_survey(file_name, 2018, county_level=True)
+
     #------------------------------------
     # handle_2016 
     #-------------------
@@ -169,52 +306,7 @@ class MailVotingTransformer(BaseEstimator, TransformerMixin):
         @return information on votes counted, how many
             were mail-ins, and percentage.
         '''
-        year = 2016
-        
-        self.log.info(f"Reading mail voting spreadsheet for {year}...")
-        # State is a State abbreviation
-        # F1a is total votes counted, and F1g is raw
-        # number of how many voted by mail.
-
-        sheet = pd.read_excel(io=file_name,
-                              header=[0],
-                              sheet_name='SECTION F',
-                              usecols=['State',
-                                       'JurisdictionName',
-                                       'F1a',
-                                       'F1g']
-                              )
-        self.log.info(f"Done reading mail voting spreadsheet for {year}.")        
-        
-        # Now have:
-        #      State   JurisdictionName     F1a                      F1g
-        # 0       AK             ALASKA  323288  -888888: Not Applicable
-        # 1       AL     AUTAUGA COUNTY   25146  -888888: Not Applicable
-        # 2       AL     BALDWIN COUNTY   96229  -888888: Not Applicable
-        # 3       AL     BARBOUR COUNTY   10544  -888888: Not Applicable
-        # 4       AL        BIBB COUNTY    8853  -888888: Not Applicable
-        # ...    ...                ...     ...                      ...
-        # 6462    WY  SWEETWATER COUNTY   16430  -888888: Not Applicable
-        # 6463    WY       TETON COUNTY   12769  -888888: Not Applicable
-        # 6464    WY       UINTA COUNTY    8544  -888888: Not Applicable
-        # 6465    WY    WASHAKIE COUNTY    3855  -888888: Not Applicable
-        # 6466    WY      WESTON COUNTY    3578  -888888: Not Applicable
-        # 
-        # [6467 rows x 4 columns]
-        
-        # Rename cols:
-        df = sheet.rename({'F1a' : f'VotesCast{year}',
-                           'F1g' : f'ByMailReturned{year}',
-                           'JurisdictionName' : 'Jurisdiction'
-                           },axis=1)
-        
-        # This df is now in standard format for the County election survey
-        # responses to stats in their jurisdiction. From here we
-        # proceed the same for all election years:
-        
-        final_df = self.etl_election_survey(df, year, county_level)
-        
-        return final_df
+        return self.read_survey(file_name, 2016, county_level)
 
     #------------------------------------
     # handle_2014
@@ -246,41 +338,7 @@ class MailVotingTransformer(BaseEstimator, TransformerMixin):
         @return information on votes counted, how many
             were mail-ins, and percentage.
         '''
-        year = 2014
-        
-        self.log.info(f"Reading mail voting spreadsheet for {year}...")
-        # State is a State abbreviation
-        # F1a is total votes counted, and F1g is raw
-        # number of how many voted by mail.
-
-        sheet = pd.read_excel(io=file_name,
-                              header=[0],
-                              usecols=['State',
-                                       'Jurisdiction',
-                                       'QF1a',
-                                       'QF1g']
-                              )
-        self.log.info(f"Done reading spreadsheet for {year}.")
-        # Now have:
-        #          State    QF1a                     QF1g
-        #     0       AK  323288  -888888: Not Applicable
-        #     1       AL   25146  -888888: Not Applicable
-        #     2       AL   96229  -888888: Not Applicable
-        #     3       AL   10544  -888888: Not Applicable
-        #     4       AL    8853  -888888: Not Applicable
-        #     ...    ...     ...                      ...
-        #     6462    WY   16430  -888888: Not Applicable
-        #     6463    WY   12769  -888888: Not Applicable
-        #     6464    WY    8544  -888888: Not Applicable
-        #     6465    WY    3855  -888888: Not Applicable
-        #     6466    WY    3578  -888888: Not Applicable    
-        
-        # Rename cols:
-        df = sheet.rename({'QF1a' : f'VotesCast{year}',
-                           'QF1g' : f'ByMailReturned{year}'
-                           },axis=1)
-        final_df = self.etl_election_survey(df, year, county_level)
-        return final_df
+        return self.read_survey(file_name, 2014, county_level)
 
     #------------------------------------
     # handle_2012
@@ -295,43 +353,55 @@ class MailVotingTransformer(BaseEstimator, TransformerMixin):
         @return information on votes counted, how many
             were mail-ins, and percentage.
         '''
-        year = 2012
+        return self.read_survey(file_name, 2012, county_level)
+
+    #------------------------------------
+    # read_survey
+    #-------------------
+
+    def read_survey(self, file_name, year, county_level=False):
+        '''
+        Reads votes cast and votes returned by mail from
+        the jurisdiction level survey release of one year.
+        Only the columns listed in SURVEY_COLUMNS are read.
+        They are renamed to the standard State, Jurisdiction,
+        VotesCast{year}, and ByMailReturned{year}, and handed
+        to etl_election_survey(), so all years are cleaned
+        and rolled up the same way.
         
-        self.log.info(f"Reading mail voting spreadsheet for {year}...")
-        # State is a State abbreviation
-        # F1a is total votes counted, and F1g is raw
-        # number of how many voted by mail.
+        @param file_name: path to Excel file
+        @type file_name: str
+        @param year: election year
+        @type year: int
+        @param county_level: whether to keep county detail
+        @type county_level: bool
+        @return information on votes counted, how many
+            were mail-ins, and percentage.
+        @rtype: pd.DataFrame
+        '''
+        try:
+            sheet_name, state_col, jurisdiction_col, votes_col, by_mail_col = \
+                self.SURVEY_COLUMNS[year]
+        except KeyError:
+            raise NotImplementedError(f"No EAVS survey columns known for year {year}")
 
+        self.log.info(f"Reading mail voting spreadsheet for {year}...")
         sheet = pd.read_excel(io=file_name,
                               header=[0],
-                              usecols=['State',
-                                       'Jurisdiction',
-                                       'QF1aBallotsCast',
-                                       'QF1gVoteByMail']
-                                       )
-        self.log.info(f"Done reading spreadsheet for {year}.")
-        # Now have:
-        #      State       Jurisdiction  QF1aBallotsCast  QF1gVoteByMail
-        # 0       AK             ALASKA         302465.0             NaN
-        # 1       AL     AUTAUGA COUNTY          24065.0       -999999.0
-        # 2       AL     BALDWIN COUNTY          85873.0       -999999.0
-        # 3       AL     BARBOUR COUNTY          11534.0       -999999.0
-        # 4       AL        BIBB COUNTY           8454.0       -999999.0
-        # ...    ...                ...              ...             ...
-        # 8149    WY  SWEETWATER COUNTY          17041.0             NaN
-        # 8150    WY       TETON COUNTY          11507.0             NaN
-        # 8151    WY       UINTA COUNTY           8578.0             NaN
-        # 8152    WY    WASHAKIE COUNTY           3979.0             NaN
-        # 8153    WY      WESTON COUNTY           3399.0             NaN
-        # 
-        # [8154 rows x 4 columns]
-
-        # Rename cols:
-        df = sheet.rename({'QF1aBallotsCast' : f'VotesCast{year}',
-                           'QF1gVoteByMail' : f'ByMailReturned{year}'
+                              sheet_name=sheet_name,
+                              usecols=[state_col,
+                                       jurisdiction_col,
+                                       votes_col,
+                                       by_mail_col]
+                              )
+        self.log.info(f"Done reading mail voting spreadsheet for {year}.")
+
+        df = sheet.rename({state_col        : 'State',
+                           jurisdiction_col : 'Jurisdiction',
+                           votes_col        : f'VotesCast{year}',
+                           by_mail_col      : f'ByMailReturned{year}'
                            },axis=1)
-        final_df = self.etl_election_survey(df, year, county_level)
-        return final_df
+        return self.etl_election_survey(df, year, county_level)
 
 
     #------------------------------------
@@ -353,6 +423,11 @@ class MailVotingTransformer(BaseEstimator, TransformerMixin):
            o len(X) is number of States plus D.C, but w/o Puerto Rico
            o X.index are tuples (<State_abbrev>, <year>)
            
+        If the transformer was created with county_level=True,
+        X.index must instead be (<State_abbrev>, <county>, <year>),
+        with levels named Region, County, and Election. The
+        join is then done at county granularity.
+           
         Returns a copy of X with vote-by-mail columns
         attached to the right.
         new columns:
@@ -366,6 +441,9 @@ class MailVotingTransformer(BaseEstimator, TransformerMixin):
         @rtype: pd.DataFrame
         '''
         
+        if self.county_level and X.index.names != self.all_elections_df.index.names:
+            raise ValueError(f"County level transform needs index levels "
+                             f"{self.all_elections_df.index.names}, not {X.index.names}")
         new_X = X.join(self.all_elections_df)
         return new_X
 
@@ -412,52 +490,12 @@ class MailVotingTransformer(BaseEstimator, TransformerMixin):
         @rtype: pd.DataFrame
         '''
 
-        # Remove Guam and U.S. Virgin Islands (if they
-        # are included; no harm if they are absent:
-        df = df.drop(df[df['State'].isin(['GU','VI', 'PR'])].index)
-        
-        # Throw away info on no mail-in for now by
-        # setting the Not Applicable and Not Available
-        # to zero:
-        df = df.replace(to_replace='-888888: Not Applicable', value=0)
-        df = df.replace(to_replace='-999999: Data Not Available', value=0)
-        # Sometimes the text is omitted:
-        df = df.replace(to_replace=-888888, value=0)
-        df = df.replace(to_replace=-999999, value=0)
-
-        # Ensure no nan:
-        df = df.fillna(0, axis=0)
-        
-        # Ensure that ByMailReturned are all ints, not strings:
-        df = df.astype(dtype={f'VotesCast{year}' : int, 
-                              f'ByMailReturned{year}' : int})
-
-        # Create a multiindex ['Region', 'Election'] with the
-        # State and the year for joining with the main 
-        # data table:
-        
-        if county_level:
-            # Need a 3-tier multiindex: Region/County/Election:
-            region   = df.State
-            county   = df.Jurisdiction
-            election = [year]*len(region)*len(county)
-            indx = pd.MultiIndex.from_tuples(zip(region,county,election), 
-                                             names=['Region','County', 'Election'])
-            df.index = indx
-            # Remove cols State and Jurisdiction, b/c
-            # they are now in the index:
-            df = df.drop(['State', 'Jurisdiction'], axis=1)
-        else:
-            # Need 2-tier multiindex: Region/Election:
-            indx = pd.MultiIndex.from_tuples(zip(df.State, [year]*len(df)), 
-                                             names=['Region','Election'])
-            df.index = indx
-            # Aggregate county data for each State:
-            grp = df.groupby(level=['Region', 'Election'])
-            # The following loses the State and Jurisdiction
-            # cols, b/c they are non-numeric. That's fine, since
-            # State is in the index now:
-            df  = grp.sum()
+        # Guam, U.S. Virgin Islands, and Puerto Rico are
+        # excluded (no harm if they are absent). Not
+        # Applicable and Not Available codes count as 0:
+        aggregator = EAVSAggregator(panel=df.assign(Election=year),
+                                    excluded_states=['GU','VI', 'PR'])
+        df = self.rollup(aggregator, year, county_level)
 
         # Add the 'ByMailPerc' col:
         df[f'ByMailPerc{year}'] = df[f'ByMailReturned{year}'] / df[f'VotesCast{year}']
@@ -4,6 +4,7 @@ Created on Sep 27, 2020
 @author: paepcke
 '''
 import os
+import tempfile
 import unittest
 
 import pandas as pd
@@ -210,6 +211,30 @@ class MailVotingTest(unittest.TestCase):
         self.assertTrue(df[f'VotesCast{year}'].sum() > 0)
         self.assertTrue(df[f'VotesCast{year}'].sum() > 0)
 
+    #------------------------------------
+    # test_read_survey
+    #-------------------
+
+    def test_read_survey(self):
+        year = 2014
+        xformer = MailVotingTransformer({})
+        with tempfile.TemporaryDirectory() as tmpdir:
+            survey_path = os.path.join(tmpdir, f'survey{year}.xlsx')
+            pd.DataFrame({'State'        : ['AK', 'AL', 'AL', 'GU'],
+                          'Jurisdiction' : ['ALASKA', 'AUTAUGA COUNTY', 'BALDWIN COUNTY', 'GUAM'],
+                          'QF1a'         : [323288, 25146, 96229, 100],
+                          'QF1g'         : [1000, '-888888: Not Applicable', 500, 10],
+                          'QF1b'         : [1, 2, 3, 4]
+                          }).to_excel(survey_path, index=False)
+            df = xformer.read_survey(survey_path, year)
+        self.assertEqual(list(df.index), [('AK', year), ('AL', year)])
+        self.assertEqual(list(df[f'VotesCast{year}']), [323288, 25146 + 96229])
+        # Not Applicable counts as 0:
+        self.assertEqual(list(df[f'ByMailReturned{year}']), [1000, 500])
+
+        with self.assertRaises(NotImplementedError):
+            xformer.read_survey(survey_path, 2010)
+
 
 # --------------- Main ----------
 if __name__ == "__main__":